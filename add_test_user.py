@@ -3,10 +3,11 @@
 Добавляет тестовую учётную запись в существующую базу `data.db`.
 Запускайте из корня проекта: `python add_test_user.py`
 """
-import sqlite3
 import os
 
-DB_PATH = 'data.db'
+import db_connection
+
+DB_PATH = db_connection.DB_PATH
 TEST_LOGIN = 'test_auto'
 TEST_PASSWORD = 'password123'
 TEST_EMAIL = 'test_auto@example.com'
@@ -18,7 +19,7 @@ def main():
         print(f"❌ База данных '{DB_PATH}' не найдена. Запустите init_db.py сначала.")
         return
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connection.connect(DB_PATH)
     cur = conn.cursor()
 
     cur.execute('SELECT id FROM users WHERE login = ? OR email = ?', (TEST_LOGIN, TEST_EMAIL))
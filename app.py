@@ -1,8 +1,10 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_from_directory, Response
 import sqlite3
 import os
 import re
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime
 from functools import wraps
 try:
@@ -22,14 +24,46 @@ if not hasattr(pkgutil, 'get_loader'):
     except Exception:
       return None
   pkgutil.get_loader = _get_loader
+# with RECO_ENGINE_SOCKET set the engine lives in a separate server process (engine_rpc.py)
+# and this process only loads the lightweight client
+RECO_ENGINE_SOCKET = os.environ.get('RECO_ENGINE_SOCKET') or None
+RecommendationEngine = None
+if RECO_ENGINE_SOCKET is None:
+  try:
+    from recommendations import RecommendationEngine
+  except Exception:
+    RecommendationEngine = None
+try:
+  import engine_rpc
+except Exception:
+  engine_rpc = None
+try:
+  from engine_watcher import EngineWatcher
+except Exception:
+  EngineWatcher = None
+try:
+  import manufacturers
+except Exception:
+  manufacturers = None
+try:
+  import fitment
+except Exception:
+  fitment = None
 try:
-  from recommendations import RecommendationEngine
+  import reco_fallback
 except Exception:
-  RecommendationEngine = None
+  reco_fallback = None
+import product_search
+import db_connection
+import migrations
+
+# Database file (DATABASE_PATH env var, else config.DATABASE)
+DB_PATH = db_connection.DB_PATH
 
 # Create app
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
+db_connection.init_app(app)
 
 # Initialize Swagger
 swagger_config = {
@@ -102,8 +136,8 @@ def setup_static_files():
 # Database initialization
 def init_db():
     """Initialize database with tables"""
-    if not os.path.exists('data.db'):
-        conn = sqlite3.connect('data.db')
+    if not os.path.exists(DB_PATH):
+        conn = db_connection.connect(DB_PATH)
         cursor = conn.cursor()
         
         # Create users table
@@ -190,7 +224,7 @@ def init_db():
         ]
 
         cursor.executemany('INSERT INTO goods (name, price, image, description, category, compatibility, manufacturer, warranty, stock) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', parts_data)
-        
+
         # Add admin user
         try:
             cursor.execute(
@@ -201,10 +235,12 @@ def init_db():
             pass
         
         conn.commit()
+        # manufacturers dictionary, fitment, full-text index, indexes (shared with init_db.py)
+        migrations.migrate(conn)
         conn.close()
     else:
         # Ensure admin exists
-        conn = sqlite3.connect('data.db')
+        conn = db_connection.connect(DB_PATH)
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM users WHERE login = ?', ('admin',))
         if not cursor.fetchone():
@@ -216,26 +252,191 @@ def init_db():
                 conn.commit()
             except sqlite3.IntegrityError:
                 pass
+        try:
+            migrations.migrate(conn)
+        except sqlite3.Error as e:
+            print(f"Миграции схемы не применены: {e}")
+        # Resolve manufacturer spellings written since the last start (loaders bypass the dictionary)
+        if manufacturers is not None:
+            try:
+                manufacturers.sync_goods(conn)
+                conn.commit()
+            except sqlite3.Error:
+                pass
         conn.close()
 
 # Helper functions
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect('data.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get the request's database connection (shared within the request, closed on teardown)"""
+    return db_connection.get_db()
 
-# Initialize recommendation engine lazily
+def sync_fitment(conn):
+    """Index goods queued by the goods_fitment triggers (inserted or edited outside the admin API)"""
+    try:
+        if fitment.sync_pending(conn):
+            conn.commit()
+    except sqlite3.Error:
+        # stale fitment for the queued goods until the next request or watcher pass
+        conn.rollback()
+
+def fitment_clause(conn, vehicle, column='id'):
+    """SQL filter (sql, params) for goods fitting `vehicle`, or None when no filter applies"""
+    if not vehicle or fitment is None:
+        return None
+    clause = fitment.filter_clause(vehicle, column=column)
+    if clause is not None:
+        sync_fitment(conn)
+    return clause
+
+# Background hot-reload of the engine on DB / reco_config.json changes
+RECO_AUTO_RELOAD = True
+RECO_WATCH_INTERVAL = 2.0   # seconds between polls
+RECO_WATCH_DEBOUNCE = 5.0   # quiet period before acting on a burst of changes
+reco_watcher = None
+
+def start_reco_watcher():
+    """Start the engine watcher thread once per process"""
+    global reco_watcher
+    if reco_watcher is None and EngineWatcher is not None and RECO_AUTO_RELOAD:
+        reco_watcher = EngineWatcher(
+            lambda: reco_engine, DB_PATH,
+            os.path.join(os.path.dirname(__file__), 'reco_config.json'),
+            interval=RECO_WATCH_INTERVAL, debounce=RECO_WATCH_DEBOUNCE)
+        reco_watcher.start()
+
+# Recommendation engine is built once per serving process in a background thread,
+# started when the server starts (see _start_reco_warmup), so the first recommendation
+# request does not pay for the fit; importing the module alone never starts a build
+RECO_EAGER_WARMUP = True
+# pickle-free engine snapshot written by scripts/export_prebuilt.py (see engine_store.py)
+RECO_SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), 'prebuilt', 'engine')
 reco_engine = None
-def get_reco_engine():
-    global reco_engine
-    if reco_engine is None and RecommendationEngine is not None:
-        # Build fresh engine from DB to ensure compatibility with current code
+reco_engine_error = None
+_reco_lock = threading.Lock()
+_reco_ready = threading.Event()
+_reco_thread = None
+_reco_warmup_requested = False
+
+def _engine_available():
+    return RecommendationEngine is not None or (RECO_ENGINE_SOCKET is not None and engine_rpc is not None)
+
+def _load_or_build_engine():
+    """Load the engine snapshot from RECO_SNAPSHOT_DIR if present, otherwise fit from the DB"""
+    if RECO_ENGINE_SOCKET is not None:
+        # drop-in client; the server process owns the model and its watcher
+        client = engine_rpc.EngineClient(RECO_ENGINE_SOCKET)
+        if not client.wait_ready():
+            raise RuntimeError(f'engine server at {RECO_ENGINE_SOCKET} is not responding')
+        return client
+    return RecommendationEngine.load_or_build(DB_PATH, RECO_SNAPSHOT_DIR)
+
+def _build_reco_engine():
+    global reco_engine, reco_engine_error
+    try:
+        reco_engine = _load_or_build_engine()
+        reco_engine_error = None
+    except Exception as e:
+        reco_engine = None
+        reco_engine_error = str(e)
+    _reco_ready.set()
+    if reco_engine is not None and RECO_ENGINE_SOCKET is None:
+        start_reco_watcher()
+
+def warm_up_reco_engine():
+    """Start the background engine build unless it is running or already succeeded"""
+    global _reco_thread
+    if not _engine_available():
+        return
+    with _reco_lock:
+        if _reco_thread is not None and (_reco_thread.is_alive() or reco_engine is not None):
+            return
+        # first start, or a retry after a failed build
+        _reco_ready.clear()
+        _reco_thread = threading.Thread(target=_build_reco_engine, name='reco-warmup', daemon=True)
+        _reco_thread.start()
+
+_db_initialized = False
+_db_init_lock = threading.Lock()
+
+@app.before_request
+def _init_db_once():
+    """Create or migrate the schema on the first request of a process served by a WSGI server"""
+    global _db_initialized
+    if not _db_initialized:
+        with _db_init_lock:
+            if not _db_initialized:
+                init_db()
+                _db_initialized = True
+
+@app.before_request
+def _start_reco_warmup():
+    """Start the engine build on the first request of a process served by a WSGI server"""
+    global _reco_warmup_requested
+    if RECO_EAGER_WARMUP and not _reco_warmup_requested:
+        _reco_warmup_requested = True
+        warm_up_reco_engine()
+
+def _is_serving_process(debug):
+    """False in the parent process of the debug reloader, which only watches files and restarts the child"""
+    return not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
+def reco_engine_state():
+    """'ready', 'building', 'failed' or 'unavailable'"""
+    if not _engine_available():
+        return 'unavailable'
+    if reco_engine is not None:
+        return 'ready'
+    if _reco_thread is not None and _reco_thread.is_alive():
+        return 'building'
+    return 'failed' if reco_engine_error else 'building'
+
+def get_reco_engine(wait=True):
+    """Return the engine; with wait=False return None instead of blocking while it builds"""
+    if reco_engine is None:
+        warm_up_reco_engine()
+        if wait and _engine_available():
+            _reco_ready.wait()
+    return reco_engine
+
+def notify_orders_changed():
+    """Refresh recommendation popularity in the background after new orders"""
+    # the orders are already committed: a failed refresh (e.g. engine server down) must not fail the request
+    if reco_engine is not None and hasattr(reco_engine, 'schedule_popularity_refresh'):
         try:
-            reco_engine = RecommendationEngine('data.db')
+            reco_engine.schedule_popularity_refresh()
         except Exception:
-            reco_engine = None
-    return reco_engine
+            pass
+    if top_sellers is not None:
+        top_sellers.mark_stale()
+
+def notify_services_changed():
+    """Re-index services in the engine's feature space after an admin edit"""
+    if reco_engine is not None and hasattr(reco_engine, 'refresh_services'):
+        try:
+            reco_engine.refresh_services()
+        except Exception:
+            pass
+
+# /api/recommendations answers within this budget (seconds); slower scoring, a missing
+# engine or products unknown to the model are answered with top sellers instead
+RECO_TIME_BUDGET = 0.3
+_reco_query_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='reco-query')
+top_sellers = reco_fallback.TopSellers(DB_PATH) if reco_fallback is not None else None
+
+def fallback_recommendations(product_id, vehicle, reason, top_k=5):
+    """Top-seller response; X-Reco-Path says which list served it, X-Reco-Fallback-Reason why"""
+    recs, path = [], 'none'
+    if top_sellers is not None:
+        try:
+            recs, source = top_sellers.recommend(product_id, top_k=top_k, vehicle=vehicle)
+            path = f'fallback-{source}'
+        except Exception:
+            recs = []
+        top_sellers.observe(f'{path}:{reason}')
+    response = jsonify(recs)
+    response.headers['X-Reco-Path'] = path
+    response.headers['X-Reco-Fallback-Reason'] = reason
+    return response
 
 def validate_login(login):
     """Validate login format"""
@@ -296,9 +497,14 @@ def showrooms():
 @app.route('/catalog')
 def catalog():
     """Catalog page with parts"""
+    vehicle = request.args.get('vehicle', '').strip()
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM goods')
+    clause = fitment_clause(conn, vehicle)
+    if clause:
+        cursor.execute(f'SELECT * FROM goods WHERE {clause[0]}', clause[1])
+    else:
+        cursor.execute('SELECT * FROM goods')
     products = cursor.fetchall()
     conn.close()
     return render_template('catalog.html', goods=products)
@@ -310,6 +516,12 @@ def api_products():
     ---
     tags:
       - Products
+    parameters:
+      - name: vehicle
+        in: query
+        type: string
+        required: false
+        description: Только товары, подходящие автомобилю (например, "BMW X5")
     responses:
       200:
         description: Список всех товаров
@@ -343,23 +555,197 @@ def api_products():
                 type: integer
                 description: Остаток на складе
     """
+    vehicle = request.args.get('vehicle', '').strip()
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM goods')
+    clause = fitment_clause(conn, vehicle)
+    if clause:
+        cursor.execute(f'SELECT * FROM goods WHERE {clause[0]}', clause[1])
+    else:
+        cursor.execute('SELECT * FROM goods')
     products = [dict(row) for row in cursor.fetchall()]
     conn.close()
     return jsonify(products)
 
+@app.route('/api/search')
+def api_search():
+    """
+    Полнотекстовый поиск товаров (FTS5, BM25)
+    ---
+    tags:
+      - Products
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: Запрос; последнее слово ищется по префиксу
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Размер страницы (1-100, по умолчанию 20)
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: next_cursor из предыдущей страницы
+      - name: vehicle
+        in: query
+        type: string
+        required: false
+        description: Только товары, подходящие автомобилю
+    responses:
+      200:
+        description: Найденные товары с подсветкой (name_highlight, description_snippet) и next_cursor
+    """
+    q = request.args.get('q', '').strip()
+    try:
+        limit = int(request.args.get('limit', 20))
+    except Exception:
+        limit = 20
+    vehicle = request.args.get('vehicle', '').strip()
+
+    conn = get_db()
+    try:
+        # unary + filters matches instead of turning the id list into FTS5 rowid lookups
+        clause = fitment_clause(conn, vehicle, column='+goods_fts.rowid')
+        result = product_search.search(conn, q, limit=limit, cursor=request.args.get('cursor'),
+                                       filter_clause=clause)
+    except sqlite3.Error as e:
+        conn.close()
+        return jsonify({'items': [], 'next_cursor': None, 'message': str(e)}), 500
+    conn.close()
+    return jsonify(result)
+
+@app.route('/api/vehicles')
+def api_vehicles():
+    """
+    Список автомобилей, известных по применимости товаров
+    ---
+    tags:
+      - Products
+    responses:
+      200:
+        description: Марки и модели (model пустая — подходит любая модель марки)
+    """
+    if fitment is None:
+        return jsonify([])
+    conn = get_db()
+    sync_fitment(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT make, model FROM vehicles WHERE make != ? ORDER BY make, model", (fitment.UNIVERSAL,))
+    vehicles = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return jsonify(vehicles)
+
 @app.route('/api/recommendations/<int:product_id>')
 def api_recommendations(product_id):
-    """API: получить рекомендации похожих товаров по ID"""
-    engine = get_reco_engine()
+    """API: получить рекомендации похожих товаров по ID (?vehicle= — только подходящие автомобилю,
+    ?profile= — профиль весов; без него профиль выбирается по id пользователя)"""
+    engine = get_reco_engine(wait=False)
+    vehicle = request.args.get('vehicle', '').strip() or None
     if engine is None:
+        return fallback_recommendations(product_id, vehicle, 'not_ready')
+    try:
+        # existence check, profile choice and scoring in one engine call (one round trip to an engine server)
+        future = _reco_query_pool.submit(engine.recommend_for, product_id, top_k=5, vehicle=vehicle,
+                                         profile=request.args.get('profile'), user_id=session.get('user_id'))
+        try:
+            result = future.result(timeout=RECO_TIME_BUDGET)
+        except FutureTimeout:
+            # a started computation still finishes and fills the engine's result cache
+            future.cancel()
+            return fallback_recommendations(product_id, vehicle, 'timeout')
+    except Exception:
+        return fallback_recommendations(product_id, vehicle, 'error')
+    if result is None:
+        # added after the last build: nothing to score against until the rebuild
+        return fallback_recommendations(product_id, vehicle, 'cold_start')
+    profile, recs = result
+    if not recs:
+        return fallback_recommendations(product_id, vehicle, 'empty')
+    if top_sellers is not None:
+        top_sellers.observe('model')
+    response = jsonify(recs)
+    response.headers['X-Reco-Profile'] = profile
+    response.headers['X-Reco-Path'] = 'model'
+    return response
+
+@app.route('/api/recommendations/<int:product_id>/explore')
+def api_recommendations_explore(product_id):
+    """API: многошаговые рекомендации «изучавшие это дошли и до…» (?top_k=, ?exclude_direct=1)"""
+    engine = get_reco_engine(wait=False)
+    if engine is None or not hasattr(engine, 'graph_recommendations'):
         return jsonify([])
 
+    top_k = max(1, min(request.args.get('top_k', 5, type=int) or 5, 50))
+    exclude_direct = request.args.get('exclude_direct', '').lower() in ('1', 'true', 'yes')
     try:
-        recs = engine.get_recommendations(product_id, top_k=5)
-        return jsonify(recs)
+        return jsonify(engine.graph_recommendations(product_id, top_k=top_k, exclude_direct=exclude_direct))
+    except Exception:
+        return jsonify([])
+
+@app.route('/api/recommendations/<int:product_id>/related')
+def api_recommendations_related(product_id):
+    """API: связанные товары и услуги автосервисов одним запросом (?top_k=, ?services_k=, ?vehicle=)"""
+    engine = get_reco_engine(wait=False)
+    if engine is None or not hasattr(engine, 'related'):
+        return jsonify({'goods': [], 'service': []})
+
+    top_k = max(1, min(request.args.get('top_k', 5, type=int) or 5, 50))
+    services_k = max(0, min(request.args.get('services_k', 3, type=int), 20))
+    vehicle = request.args.get('vehicle', '').strip() or None
+    try:
+        profile = engine.profile_for(request.args.get('profile'), session.get('user_id'))
+        return jsonify(engine.related(product_id, top_k=top_k, services_k=services_k, vehicle=vehicle, profile=profile))
+    except Exception:
+        return jsonify({'goods': [], 'service': []})
+
+@app.route('/api/recommendations/search')
+def api_recommendations_search():
+    """
+    Похожие товары по произвольному тексту (TF-IDF модель движка рекомендаций)
+    ---
+    tags:
+      - Products
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+      - name: top_k
+        in: query
+        type: integer
+        required: false
+        description: Сколько товаров вернуть (по умолчанию 10, максимум 100)
+      - name: vehicle
+        in: query
+        type: string
+        required: false
+      - name: category
+        in: query
+        type: string
+        required: false
+      - name: manufacturer
+        in: query
+        type: string
+        required: false
+    responses:
+      200:
+        description: Товары, отсортированные по косинусному сходству с запросом
+    """
+    engine = get_reco_engine(wait=False)
+    if engine is None:
+        return jsonify([])
+
+    try:
+        top_k = max(1, min(int(request.args.get('top_k', 10)), 100))
+    except Exception:
+        top_k = 10
+    filters = {k: request.args.get(k, '').strip() for k in ('vehicle', 'category', 'manufacturer')}
+    try:
+        return jsonify(engine.search(request.args.get('q', ''), top_k=top_k, filters=filters))
     except Exception:
         return jsonify([])
 
@@ -784,6 +1170,7 @@ def create_order():
         )
         conn.commit()
         conn.close()
+        notify_orders_changed()
         return jsonify({'success': True, 'message': 'Заказ создан успешно'})
     except sqlite3.Error as e:
         conn.close()
@@ -826,44 +1213,46 @@ def api_admin_model_status():
     if not app.debug and ('user_id' not in session or session.get('role') != 'admin'):
         return jsonify({'error': 'no access'}), 403
 
-    engine = get_reco_engine()
-    # RecommendationEngine was refactored to use separate matrices (matrix_text, matrix_category, matrix_manufacturer).
-    # Treat model as not-built if engine is missing or none of the matrices are present.
-    if engine is None or (
-      getattr(engine, 'matrix_text', None) is None
-      and getattr(engine, 'matrix_category', None) is None
-      and getattr(engine, 'matrix_manufacturer', None) is None
-    ):
-      return jsonify({'built': False})
-
-    # vocab from text vectorizer if available
-    vocab_size = 0
-    try:
-        if getattr(engine, 'tfidf_text', None) and getattr(engine.tfidf_text, 'vocabulary_', None):
-            vocab_size = len(engine.tfidf_text.vocabulary_)
-    except Exception:
-        vocab_size = 0
-
-    weights = {}
-    try:
-        weights = {
-            'w_text': getattr(engine, 'w_text', 0.6),
-            'w_category': getattr(engine, 'w_category', 0.2),
-            'w_manufacturer': getattr(engine, 'w_manufacturer', 0.1),
-            'w_popularity': getattr(engine, 'w_popularity', 0.1),
-            'cat_scale': getattr(engine, 'cat_scale', 1.0)
-        }
-    except Exception:
-        weights = {}
+    engine = get_reco_engine(wait=False)
+    status = engine.status() if engine is not None else {'built': False}
+    if not status.get('built'):
+      return jsonify({'built': False, 'state': reco_engine_state(), 'error': reco_engine_error})
 
     return jsonify({
-        'built': True,
-        'n_products': len(engine.products),
-        'vocab_size': vocab_size,
-        'weights': weights
+        **status,
+        # responses served by the model vs top-seller fallback (and why)
+        'fallback': top_sellers.stats() if top_sellers is not None else None,
+        'watcher': reco_watcher.status() if reco_watcher is not None else {'running': False},
+        # ?recall=N compares candidate-based recommendations with exact scoring on N products
+        'candidate_recall': (engine.candidate_recall(sample=request.args.get('recall', 50, type=int))
+                             if request.args.get('recall') else None)
     })
 
 
+@app.route('/healthz/ready')
+def healthz_ready():
+    """Readiness probe: 200 once the recommendation engine is built, 503 before that"""
+    state = reco_engine_state()
+    if state == 'failed':
+        # retry in the background; the probe keeps reporting not-ready meanwhile
+        warm_up_reco_engine()
+    if state == 'ready':
+        return jsonify({'ready': True, 'state': state, 'n_products': reco_engine.product_count()})
+    if state == 'unavailable':
+        # the app can serve without the optional engine dependencies
+        return jsonify({'ready': True, 'state': state})
+    return jsonify({'ready': False, 'state': state, 'error': reco_engine_error}), 503
+
+@app.route('/metrics')
+def metrics():
+    """Recommendation engine metrics in Prometheus text format"""
+    engine = reco_engine
+    body = '# recommendation engine not built\n'
+    if engine is not None and hasattr(engine, 'prometheus_metrics'):
+        body = engine.prometheus_metrics()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/admin/weights', methods=['GET', 'POST'])
 def api_admin_weights():
     """Get or set weights for recommendation engine"""
@@ -896,8 +1285,18 @@ def api_admin_weights():
         'w_popularity': w_popularity,
         'cat_scale': cat_scale
       }
+      if 'profiles' in data:
+        payload['profiles'] = data['profiles']
+      if 'profile_split' in data:
+        payload['profile_split'] = data['profile_split']
+      # keep settings this form does not edit (profiles, candidate generation)
+      cfg = {}
+      if os.path.exists(cfg_path):
+        with open(cfg_path, 'r', encoding='utf-8') as f:
+          cfg = json.load(f)
+      cfg.update(payload)
       with open(cfg_path, 'w', encoding='utf-8') as f:
-        json.dump(payload, f)
+        json.dump(cfg, f)
     except Exception as e:
       return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -906,8 +1305,8 @@ def api_admin_weights():
       engine = get_reco_engine()
       if engine is not None:
         try:
-          engine._load_weights()
-          engine.refresh()
+          # weights and profiles are applied per query; cat_scale rescales the built matrices
+          engine.reload_weights()
         except Exception:
           pass
 
@@ -921,7 +1320,7 @@ def api_admin_calculations(product_id):
       return jsonify({'error': 'no access'}), 403
 
     engine = get_reco_engine()
-    if engine is None or getattr(engine, 'matrix_text', None) is None or product_id not in engine.ids:
+    if engine is None:
       return jsonify({'items': []})
 
     # pagination params
@@ -934,66 +1333,7 @@ def api_admin_calculations(product_id):
     except Exception:
       per_page = 10
 
-    # compute cosine similarities
-    try:
-      from sklearn.metrics.pairwise import linear_kernel
-    except Exception:
-      return jsonify({'items': []})
-
-    idx = engine.ids.index(product_id)
-
-    # compute per-component cosine similarities
-    try:
-      sims_text = linear_kernel(engine.matrix_text[idx:idx+1], engine.matrix_text).flatten()
-    except Exception:
-      sims_text = [0.0] * len(engine.ids)
-    try:
-      sims_category = linear_kernel(engine.matrix_category[idx:idx+1], engine.matrix_category).flatten() if getattr(engine, 'matrix_category', None) is not None else [0.0] * len(engine.ids)
-    except Exception:
-      sims_category = [0.0] * len(engine.ids)
-    try:
-      sims_manufacturer = linear_kernel(engine.matrix_manufacturer[idx:idx+1], engine.matrix_manufacturer).flatten() if getattr(engine, 'matrix_manufacturer', None) is not None else [0.0] * len(engine.ids)
-    except Exception:
-      sims_manufacturer = [0.0] * len(engine.ids)
-
-    sims_text[idx] = -1
-    sims_category[idx] = -1
-    sims_manufacturer[idx] = -1
-
-    items = []
-    max_pop = max((p.get('popularity', 0) for p in engine.products), default=1)
-
-    for i in range(len(engine.ids)):
-      if i == idx:
-        continue
-      p = engine.products[i]
-      cos = float(sims_text[i])
-      cos_cat = float(sims_category[i])
-      cos_man = float(sims_manufacturer[i])
-      pop = float(p.get('popularity', 0))
-      pop_norm = pop / max_pop if max_pop > 0 else 0.0
-      final_score = (getattr(engine, 'w_text', 0.6) * cos
-                     + getattr(engine, 'w_category', 0.2) * cos_cat
-                     + getattr(engine, 'w_manufacturer', 0.1) * cos_man
-                     + getattr(engine, 'w_popularity', 0.1) * pop_norm)
-      items.append({
-        'id': p['id'],
-        'name': p['name'],
-        'cosine': float(cos),
-        'cos_category': float(cos_cat),
-        'cos_manufacturer': float(cos_man),
-        'popularity': pop,
-        'pop_norm': pop_norm,
-        'final_score': float(final_score)
-      })
-
-    # sort by final_score desc
-    items = sorted(items, key=lambda x: x['final_score'], reverse=True)
-    total = len(items)
-    start = (page - 1) * per_page
-    end = start + per_page
-    items_page = items[start:end]
-    return jsonify({'items': items_page, 'total': total, 'page': page, 'per_page': per_page})
+    return jsonify(engine.explain(product_id, page=page, per_page=per_page))
 
 
 @app.route('/api/admin/popularity')
@@ -1025,63 +1365,9 @@ def dev_api_admin_calculations(product_id):
         return jsonify({'error': 'not allowed'}), 403
 
     engine = get_reco_engine()
-    if engine is None or getattr(engine, 'matrix_text', None) is None or product_id not in engine.ids:
-        return jsonify({'items': []})
-
-    try:
-        from sklearn.metrics.pairwise import linear_kernel
-    except Exception:
+    if engine is None:
         return jsonify({'items': []})
-
-    idx = engine.ids.index(product_id)
-
-    # compute per-component cosine similarities
-    try:
-      sims_text = linear_kernel(engine.matrix_text[idx:idx+1], engine.matrix_text).flatten()
-    except Exception:
-      sims_text = [0.0] * len(engine.ids)
-    try:
-      sims_category = linear_kernel(engine.matrix_category[idx:idx+1], engine.matrix_category).flatten() if getattr(engine, 'matrix_category', None) is not None else [0.0] * len(engine.ids)
-    except Exception:
-      sims_category = [0.0] * len(engine.ids)
-    try:
-      sims_manufacturer = linear_kernel(engine.matrix_manufacturer[idx:idx+1], engine.matrix_manufacturer).flatten() if getattr(engine, 'matrix_manufacturer', None) is not None else [0.0] * len(engine.ids)
-    except Exception:
-      sims_manufacturer = [0.0] * len(engine.ids)
-
-    sims_text[idx] = -1
-    sims_category[idx] = -1
-    sims_manufacturer[idx] = -1
-
-    items = []
-    max_pop = max((p.get('popularity', 0) for p in engine.products), default=1)
-
-    for i in range(len(engine.ids)):
-      if i == idx:
-        continue
-      p = engine.products[i]
-      cos = float(sims_text[i])
-      cos_cat = float(sims_category[i])
-      cos_man = float(sims_manufacturer[i])
-      pop = float(p.get('popularity', 0))
-      pop_norm = pop / max_pop if max_pop > 0 else 0.0
-      final_score = (getattr(engine, 'w_text', 0.6) * cos
-               + getattr(engine, 'w_category', 0.2) * cos_cat
-               + getattr(engine, 'w_manufacturer', 0.1) * cos_man
-               + getattr(engine, 'w_popularity', 0.1) * pop_norm)
-      items.append({
-        'id': p['id'],
-        'name': p['name'],
-        'cosine': float(cos),
-        'cos_category': float(cos_cat),
-        'cos_manufacturer': float(cos_man),
-        'popularity': pop,
-        'pop_norm': pop_norm,
-        'final_score': float(final_score)
-      })
-
-    items = sorted(items, key=lambda x: x['final_score'], reverse=True)[:50]
-    return jsonify({'items': items})
+    return jsonify({'items': engine.explain(product_id, per_page=50)['items']})
 
 
 @app.route('/api/admin/db/<table>')
@@ -1251,6 +1537,13 @@ def add_product():
             data['warranty'],
             data['stock']
         ))
+        product_id = cursor.lastrowid
+        if manufacturers is not None:
+            manufacturer_id = manufacturers.resolve_manufacturer(conn, data['manufacturer'])
+            cursor.execute('UPDATE goods SET manufacturer_id = ? WHERE id = ?', (manufacturer_id, product_id))
+        if fitment is not None:
+            # the insert trigger queued the product; index it in the same transaction
+            fitment.sync_pending(conn)
         conn.commit()
         conn.close()
         return jsonify({'success': True, 'message': 'Товар добавлен'})
@@ -1287,6 +1580,7 @@ def delete_product(product_id):
     conn = get_db()
     cursor = conn.cursor()
     try:
+        # goods_fitment rows go with the product (trigger goods_fitment_ad)
         cursor.execute('DELETE FROM goods WHERE id = ?', (product_id,))
         conn.commit()
         conn.close()
@@ -1461,6 +1755,7 @@ def add_service():
         ''', (data['name'], data['address'], data['phone'], data['services'], data.get('description', '')))
         conn.commit()
         conn.close()
+        notify_services_changed()
         return jsonify({'success': True, 'message': 'Автосервис добавлен'})
     except sqlite3.Error as e:
         conn.close()
@@ -1518,6 +1813,7 @@ def update_service(service_id):
         ''', (data['name'], data['address'], data['phone'], data['services'], data.get('description', ''), service_id))
         conn.commit()
         conn.close()
+        notify_services_changed()
         return jsonify({'success': True, 'message': 'Автосервис обновлен'})
     except sqlite3.Error as e:
         conn.close()
@@ -1553,6 +1849,7 @@ def delete_service(service_id):
         cursor.execute('DELETE FROM services WHERE id = ?', (service_id,))
         conn.commit()
         conn.close()
+        notify_services_changed()
         return jsonify({'success': True, 'message': 'Автосервис удален'})
     except sqlite3.Error as e:
         conn.close()
@@ -1792,33 +2089,26 @@ def add_to_cart():
             conn.close()
             return jsonify({'success': False, 'message': 'Товар не найден'}), 404
         
-        # Check if already in cart
-        cursor.execute('SELECT id, quantity FROM cart WHERE user_id = ? AND product_id = ?', 
-                      (session['user_id'], product_id))
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Update quantity
-            new_quantity = existing['quantity'] + quantity
-            # Check stock availability
-            if new_quantity > product['stock']:
-                conn.close()
-                return jsonify({
-                    'success': False, 
-                    'message': f'Недостаточно товара на складе. Доступно: {product["stock"]} шт.'
-                }), 400
-            cursor.execute('UPDATE cart SET quantity = ? WHERE id = ?', (new_quantity, existing['id']))
-        else:
-            # Check stock availability for new item
-            if quantity > product['stock']:
-                conn.close()
-                return jsonify({
-                    'success': False, 
-                    'message': f'Недостаточно товара на складе. Доступно: {product["stock"]} шт.'
-                }), 400
-            # Add new item
-            cursor.execute('INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)',
-                         (session['user_id'], product_id, quantity))
+        if quantity > product['stock']:
+            conn.close()
+            return jsonify({
+                'success': False, 
+                'message': f'Недостаточно товара на складе. Доступно: {product["stock"]} шт.'
+            }), 400
+        # One statement for new and existing rows (unique cart (user_id, product_id)): concurrent
+        # adds sum their quantities; the stock limit is checked against the summed quantity
+        cursor.execute('''
+            INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            WHERE quantity + excluded.quantity <= ?
+        ''', (session['user_id'], product_id, quantity, product['stock']))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            conn.close()
+            return jsonify({
+                'success': False, 
+                'message': f'Недостаточно товара на складе. Доступно: {product["stock"]} шт.'
+            }), 400
         
         conn.commit()
         conn.close()
@@ -2086,6 +2376,7 @@ def checkout_cart():
         
         conn.commit()
         conn.close()
+        notify_orders_changed()
         
         return jsonify({'success': True, 'message': 'Заказ успешно оформлен! Мы свяжемся с вами в ближайшее время.'})
     except sqlite3.Error as e:
@@ -2175,6 +2466,7 @@ def buy_product_by_id(product_id):
         
         conn.commit()
         conn.close()
+        notify_orders_changed()
         
         return jsonify({
             'success': True, 
@@ -2185,8 +2477,13 @@ def buy_product_by_id(product_id):
         return jsonify({'success': False, 'message': str(e)}), 500
 
 if __name__ == '__main__':
+    debug = True
     setup_static_files()
     init_db()
+    _db_initialized = True
+    if RECO_EAGER_WARMUP and _is_serving_process(debug):
+        _reco_warmup_requested = True
+        warm_up_reco_engine()
     print("=" * 50)
     print("Автосалон на Python Flask")
     print("=" * 50)
@@ -2194,4 +2491,4 @@ if __name__ == '__main__':
     print("💾 База данных: data.db")
     print("📁 Статические файлы: static/")
     print("=" * 50)
-    app.run(debug=True, host='localhost', port=5000)
+    app.run(debug=debug, host='localhost', port=5000)
@@ -0,0 +1,93 @@
+"""
+Генерация кандидатов для рекомендаций.
+
+Хорошие рекомендации почти всегда делят с исходным товаром категорию,
+марку автомобиля из совместимости или производителя. Инвертированные
+индексы по этим признакам дают небольшой набор позиций, на котором
+движок считает полный взвешенный скор вместо прохода по всем N товарам.
+Набор дополняется самыми популярными товарами (popularity backfill).
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import fitment
+
+
+def top_popular(popularity: np.ndarray, k: int) -> np.ndarray:
+    """Позиции `k` самых популярных товаров (только с ненулевой популярностью)."""
+    k = min(int(k), len(popularity))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int32)
+    top = np.argsort(-popularity, kind='stable')[:k]
+    return top[popularity[top] > 0].astype(np.int32)
+
+
+def _postings(lists: Dict[str, List[int]]) -> Dict[str, np.ndarray]:
+    return {key: np.asarray(p, dtype=np.int32) for key, p in lists.items()}
+
+
+class CandidateIndex:
+    """Инвертированные индексы «признак -> позиции товаров» по позициям движка."""
+
+    def __init__(self, n: int):
+        self.n = n
+        self.by_category: Dict[str, np.ndarray] = {}
+        self.by_make: Dict[str, np.ndarray] = {}
+        self.by_manufacturer: Dict[int, np.ndarray] = {}
+        # per-product keys into the indexes above
+        self._categories: List[str] = []
+        self._makes: List[List[str]] = []
+        self._manufacturers: Optional[np.ndarray] = None
+        # most popular positions (see top_popular), appended to every candidate set
+        self.popular = np.zeros(0, dtype=np.int32)
+
+    @classmethod
+    def from_products(cls, products: List[Dict], manufacturer_ids: Optional[np.ndarray] = None,
+                      missing_manufacturer: int = -1) -> 'CandidateIndex':
+        """Построить индексы; `missing_manufacturer` — id «нет производителя» (не индексируется)."""
+        index = cls(len(products))
+        categories: Dict[str, List[int]] = {}
+        makes: Dict[str, List[int]] = {}
+        parsed = {}
+        for pos, p in enumerate(products):
+            category = str(p.get('category') or '').strip().lower()
+            index._categories.append(category)
+            if category:
+                categories.setdefault(category, []).append(pos)
+            text = p.get('compatibility')
+            if text not in parsed:
+                # universal parts ("Все модели") would put every product into every set; they
+                # are reached through category, manufacturer or the popularity backfill instead
+                parsed[text] = sorted({make for make, _ in fitment.parse_compatibility(text)
+                                       if make != fitment.UNIVERSAL})
+            index._makes.append(parsed[text])
+            for make in parsed[text]:
+                makes.setdefault(make, []).append(pos)
+        index.by_category = _postings(categories)
+        index.by_make = _postings(makes)
+        if manufacturer_ids is not None:
+            index._manufacturers = manufacturer_ids
+            order = np.argsort(manufacturer_ids, kind='stable')
+            ids, starts = np.unique(manufacturer_ids[order], return_index=True)
+            for mid, chunk in zip(ids, np.split(order, starts[1:])):
+                if mid != missing_manufacturer:
+                    index.by_manufacturer[int(mid)] = chunk.astype(np.int32)
+        return index
+
+    def for_product(self, pos: int) -> np.ndarray:
+        """Отсортированные уникальные позиции-кандидаты для товара `pos` (включая его самого)."""
+        parts = [np.asarray([pos], dtype=np.int32), self.popular]
+        category = self._categories[pos]
+        if category:
+            parts.append(self.by_category[category])
+        parts.extend(self.by_make[make] for make in self._makes[pos])
+        if self._manufacturers is not None:
+            posting = self.by_manufacturer.get(int(self._manufacturers[pos]))
+            if posting is not None:
+                parts.append(posting)
+        return np.unique(np.concatenate(parts))
+
+    def nbytes(self) -> int:
+        postings = list(self.by_category.values()) + list(self.by_make.values()) + list(self.by_manufacturer.values())
+        return int(sum(p.nbytes for p in postings) + self.popular.nbytes)
@@ -11,8 +11,11 @@ DEBUG = True
 # Для продакшена генерируйте новый ключ!
 SECRET_KEY = 'dev-key-change-in-production'
 
-# Конфигурация базы данных
+# Конфигурация базы данных (переопределяется переменной окружения DATABASE_PATH)
 DATABASE = 'data.db'
+DB_CACHE_SIZE_KB = 32768  # страничный кэш SQLite на соединение
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_BUSY_TIMEOUT_MS = 5000  # ожидание блокировки записи
 
 # Flask конфигурация
 FLASK_ENV = 'development'
@@ -1,8 +1,10 @@
-import sqlite3
 import os
 from datetime import datetime
 
-DB = 'data.db'
+import db_connection
+import migrations
+
+DB = db_connection.DB_PATH
 
 
 def create_denormalized_table(duplicate_db: str = 'site_data.db'):
@@ -15,7 +17,7 @@ def create_denormalized_table(duplicate_db: str = 'site_data.db'):
         print('❌ data.db не найден')
         return
 
-    conn = sqlite3.connect(DB)
+    conn = db_connection.connect(DB)
     cursor = conn.cursor()
 
     # Drop old table if exists
@@ -111,6 +113,9 @@ def create_denormalized_table(duplicate_db: str = 'site_data.db'):
             days, popularity, float(price or 0), stock or 0, created
         ))
 
+    # the table was recreated: index it again and refresh its planner statistics
+    cursor.execute(migrations.DENORMALIZED_INDEX)
+    cursor.execute('ANALYZE denormalized_data')
     conn.commit()
     # Read back rows for optional duplication
     cursor.execute('SELECT * FROM denormalized_data')
@@ -123,7 +128,7 @@ def create_denormalized_table(duplicate_db: str = 'site_data.db'):
     # duplicate into another DB file if requested
     if duplicate_db and duplicate_db != DB:
         try:
-            dconn = sqlite3.connect(duplicate_db)
+            dconn = db_connection.connect(duplicate_db)
             dcur = dconn.cursor()
             # drop/create schema
             dcur.execute('DROP TABLE IF EXISTS denormalized_data')
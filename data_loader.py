@@ -18,17 +18,19 @@ import os
 from datetime import datetime
 from pathlib import Path
 
+import db_connection
+
 
 class DataLoader:
     """Загрузчик тестовых данных в SQLite базу"""
     
-    def __init__(self, db_path='data.db'):
+    def __init__(self, db_path=None):
         """Инициализация загрузчика
         
         Args:
-            db_path (str): Путь к файлу базы данных
+            db_path (str): Путь к файлу базы данных (по умолчанию db_connection.DB_PATH)
         """
-        self.db_path = db_path
+        self.db_path = db_path or db_connection.DB_PATH
         self.conn = None
         self.cursor = None
         self.stats = {
@@ -42,7 +44,7 @@ class DataLoader:
     def connect(self):
         """Подключиться к базе данных"""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = db_connection.connect(self.db_path)
             self.cursor = self.conn.cursor()
             print(f"✓ Подключение к БД: {self.db_path}")
             return True
@@ -230,6 +232,7 @@ class DataLoader:
                 self.cursor.execute('''
                     INSERT INTO cart (user_id, product_id, quantity, added_at)
                     VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
                 ''', (
                     item['user_id'],
                     item['product_id'],
@@ -265,7 +268,7 @@ def main():
     print("="*50 + "\n")
     
     # Параметры по умолчанию
-    db_path = 'data.db'
+    db_path = db_connection.DB_PATH
     json_file = 'test_data.json'
     sql_file = 'test_data.sql'
     use_json = True
@@ -0,0 +1,128 @@
+"""
+Подключения к SQLite: общие настройки и повторное использование.
+
+Все соединения получают одинаковые PRAGMA:
+
+  - journal_mode=WAL      — читатели не ждут пишущих (оформление заказа),
+                            запись не блокирует каталог и движок;
+  - synchronous=NORMAL    — fsync только при checkpoint (в WAL это безопасно
+                            для целостности, теряется лишь последняя транзакция
+                            при отключении питания);
+  - cache_size, mmap_size — страничный кэш и отображение файла в память;
+  - busy_timeout          — ожидание блокировки вместо «database is locked».
+
+Путь к БД — переменная окружения DATABASE_PATH, иначе config.DATABASE.
+
+Во Flask get_db() отдаёт одно соединение на запрос (flask.g), оно
+закрывается в teardown; close() в коде обработчиков ничего не делает, так что
+вспомогательные функции могут брать то же соединение. Вне запроса (фоновые
+потоки) — одно соединение на поток. Скрипты и движок используют connect().
+"""
+import os
+import sqlite3
+import threading
+
+try:
+    import config
+except Exception:
+    config = None
+
+
+def _setting(name: str, default):
+    return getattr(config, name, default) if config is not None else default
+
+
+DB_PATH = os.environ.get('DATABASE_PATH') or _setting('DATABASE', 'data.db')
+CACHE_SIZE_KB = int(_setting('DB_CACHE_SIZE_KB', 32768))
+MMAP_SIZE = int(_setting('DB_MMAP_SIZE', 256 * 1024 * 1024))
+BUSY_TIMEOUT_MS = int(_setting('DB_BUSY_TIMEOUT_MS', 5000))
+
+_local = threading.local()
+
+
+def configure(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Применить PRAGMA к соединению (journal_mode сохраняется в самом файле БД)."""
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.Error:
+        # read-only files and in-memory databases keep their journal mode
+        pass
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    return conn
+
+
+def connect(path: str = None, **kwargs) -> sqlite3.Connection:
+    """Новое соединение с PRAGMA (закрывается вызывающим)."""
+    kwargs.setdefault('timeout', BUSY_TIMEOUT_MS / 1000)
+    return configure(sqlite3.connect(path or DB_PATH, **kwargs))
+
+
+class SharedConnection(sqlite3.Connection):
+    """Соединение запроса/потока: close() не закрывает его, закрывает release()."""
+
+    def close(self):
+        pass
+
+    def release(self):
+        if self.in_transaction:
+            self.rollback()
+        super().close()
+
+
+def _shared(path: str) -> SharedConnection:
+    conn = connect(path, factory=SharedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def thread_connection(path: str = None) -> SharedConnection:
+    """Соединение текущего потока (создаётся при первом обращении)."""
+    path = path or DB_PATH
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _shared(path)
+    return conn
+
+
+def remove_database(path: str = None):
+    """Удалить файл БД вместе с журналом WAL (-wal) и индексом разделяемой памяти (-shm)."""
+    path = path or DB_PATH
+    for name in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def close_thread_connections():
+    """Закрыть соединения текущего потока."""
+    for conn in getattr(_local, 'connections', {}).values():
+        conn.release()
+    _local.connections = {}
+
+
+def get_db() -> SharedConnection:
+    """Соединение текущего запроса Flask (вне запроса — соединение потока)."""
+    from flask import current_app, g, has_app_context
+    if not has_app_context():
+        return thread_connection()
+    conn = g.get('db')
+    if conn is None:
+        conn = g.db = _shared(current_app.config.get('DATABASE') or DB_PATH)
+    return conn
+
+
+def init_app(app):
+    """Путь к БД в app.config['DATABASE'] и закрытие соединения запроса в teardown."""
+    from flask import g
+    app.config.setdefault('DATABASE', DB_PATH)
+
+    @app.teardown_appcontext
+    def _release_db(exc):
+        conn = g.pop('db', None)
+        if conn is not None:
+            conn.release()
@@ -6,15 +6,17 @@
 import sqlite3
 import os
 
+import db_connection
+
 def reset_database():
     """Полностью сбросить базу данных"""
-    if os.path.exists('data.db'):
-        os.remove('data.db')
+    if os.path.exists(db_connection.DB_PATH):
+        db_connection.remove_database()
         print("✓ База данных удалена")
 
 def add_test_user():
     """Добавить тестового пользователя"""
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     try:
@@ -33,7 +35,7 @@ def add_test_user():
 
 def list_users():
     """Вывести всех пользователей"""
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     cursor.execute('SELECT id, login, email FROM users')
     users = cursor.fetchall()
@@ -48,7 +50,7 @@ def list_users():
 
 def list_cars():
     """Вывести все автомобили"""
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     cursor.execute('SELECT id, name, price FROM goods')
     cars = cursor.fetchall()
@@ -63,7 +65,7 @@ def list_cars():
 
 def list_orders():
     """Вывести все заказы"""
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     cursor.execute('SELECT id, fio, phone, email, product_id FROM orders')
     orders = cursor.fetchall()
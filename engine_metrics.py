@@ -0,0 +1,246 @@
+"""
+Метрики движка рекомендаций: длительность фаз построения, объём памяти,
+гистограммы задержек запросов и попадания в кэши.
+
+Фоновые работы (обновление популярности, построение графа) пишутся в
+отдельную гистограмму обслуживания, чтобы не искажать перцентили запросов.
+
+Снимок отдаётся в /api/admin/model-status, текстовый формат Prometheus — в /metrics.
+"""
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List
+
+import numpy as np
+
+# histogram bucket upper bounds, milliseconds
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# maintenance tasks run from milliseconds (popularity swap) to minutes (graph over a large catalogue)
+MAINTENANCE_BUCKETS_MS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 300000)
+
+
+def nbytes(obj) -> int:
+    """Размер массива/разреженной матрицы в байтах (0 для None)."""
+    if obj is None:
+        return 0
+    if hasattr(obj, 'indptr'):
+        # scipy CSR/CSC: data + indices + indptr
+        return int(obj.data.nbytes + obj.indices.nbytes + obj.indptr.nbytes)
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    return 0
+
+
+def records_nbytes(records: List[Dict]) -> int:
+    """Приблизительный размер списка словарей-товаров (контейнеры + значения)."""
+    total = sys.getsizeof(records)
+    for rec in records:
+        total += sys.getsizeof(rec)
+        for k, v in rec.items():
+            total += sys.getsizeof(k) + sys.getsizeof(v)
+    return total
+
+
+def timed_method(op: str):
+    """Декоратор метода движка: задержка вызова пишется в self.metrics под именем `op`."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timed(op):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class LatencyHistogram:
+    """Гистограмма задержек: накопительные бакеты + скользящее окно для перцентилей."""
+
+    def __init__(self, window: int = 1024, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, ms: float):
+        i = 0
+        while i < len(self.buckets) and ms > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self._recent.append(ms)
+
+    def snapshot(self) -> Dict:
+        recent = np.fromiter(self._recent, dtype=float) if self._recent else None
+        pct = {}
+        if recent is not None:
+            for q in (50, 95, 99):
+                pct[f'p{q}_ms'] = round(float(np.percentile(recent, q)), 3)
+        return {'count': self.count, 'avg_ms': round(self.sum_ms / self.count, 3) if self.count else 0.0,
+                'window': len(self._recent), **pct}
+
+
+class EngineMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # phases of the last completed build; the running build fills _building
+        self.build_phases: Dict[str, float] = {}
+        self._building: Dict[str, float] = {}
+        self.builds = 0
+        self.last_build_at = None
+        self.latency: Dict[str, LatencyHistogram] = {}
+        # background maintenance (popularity refresh, graph build), kept out of query latency
+        self.maintenance: Dict[str, LatencyHistogram] = {}
+        # recommendation queries scored on a candidate set vs. full scans
+        self.candidate_queries = 0
+        self.candidate_fallbacks = 0
+        self.candidate_size_sum = 0
+        # recommendation queries per scoring profile
+        self.profile_queries: Dict[str, int] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Замерить фазу построения (секунды) под именем `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._building[name] = time.perf_counter() - start
+
+    def start_build(self):
+        self._building = {}
+
+    def finish_build(self):
+        self.build_phases = self._building
+        self.builds += 1
+        self.last_build_at = time.time()
+
+    @contextmanager
+    def timed(self, op: str):
+        """Замерить запрос типа `op` в гистограмму задержек."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(op, (time.perf_counter() - start) * 1000.0)
+
+    def observe(self, op: str, ms: float):
+        with self._lock:
+            hist = self.latency.get(op)
+            if hist is None:
+                hist = self.latency[op] = LatencyHistogram()
+            hist.observe(ms)
+
+    @contextmanager
+    def timed_maintenance(self, task: str):
+        """Замерить фоновую работу `task` в гистограмму обслуживания."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_maintenance(task, (time.perf_counter() - start) * 1000.0)
+
+    def observe_maintenance(self, task: str, ms: float):
+        with self._lock:
+            hist = self.maintenance.get(task)
+            if hist is None:
+                hist = self.maintenance[task] = LatencyHistogram(window=256, buckets=MAINTENANCE_BUCKETS_MS)
+            hist.observe(ms)
+
+    def observe_candidates(self, size: int, full_scan: bool):
+        """Учесть размер набора, на котором посчитан запрос рекомендаций."""
+        with self._lock:
+            self.candidate_queries += 1
+            self.candidate_size_sum += size
+            if full_scan:
+                self.candidate_fallbacks += 1
+
+    def observe_profile(self, name: str):
+        with self._lock:
+            self.profile_queries[name] = self.profile_queries.get(name, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            latency = {op: h.snapshot() for op, h in self.latency.items()}
+            maintenance = {task: h.snapshot() for task, h in self.maintenance.items()}
+            queries = self.candidate_queries
+            profiles = dict(self.profile_queries)
+            candidates = {
+                'queries': queries,
+                'full_scans': self.candidate_fallbacks,
+                'avg_scored': round(self.candidate_size_sum / queries, 1) if queries else 0.0,
+            }
+        return {
+            'builds': self.builds,
+            'last_build_at': self.last_build_at,
+            'build_phases_s': {k: round(v, 4) for k, v in self.build_phases.items()},
+            'build_total_s': round(sum(self.build_phases.values()), 4),
+            'latency': latency,
+            'maintenance': maintenance,
+            'candidates': candidates,
+            'profiles': profiles,
+        }
+
+    @staticmethod
+    def _histogram_lines(name: str, help_text: str, label: str, hists) -> List[str]:
+        lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for key, h in hists:
+            cumulative = 0
+            for bound, cnt in zip(h.buckets, h.counts):
+                cumulative += cnt
+                lines.append(f'{name}_bucket{{{label}="{key}",le="{bound / 1000.0:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {h.count}')
+            lines.append(f'{name}_sum{{{label}="{key}"}} {h.sum_ms / 1000.0:.6f}')
+            lines.append(f'{name}_count{{{label}="{key}"}} {h.count}')
+        return lines
+
+    def prometheus(self, memory: Dict[str, int], caches: Dict[str, Dict], prefix: str = 'reco') -> str:
+        """Все метрики в текстовом формате Prometheus (exposition format 0.0.4)."""
+        lines = [
+            f'# HELP {prefix}_builds_total Completed engine builds.',
+            f'# TYPE {prefix}_builds_total counter',
+            f'{prefix}_builds_total {self.builds}',
+            f'# HELP {prefix}_build_phase_seconds Duration of each phase of the last build.',
+            f'# TYPE {prefix}_build_phase_seconds gauge',
+        ]
+        for name, sec in self.build_phases.items():
+            lines.append(f'{prefix}_build_phase_seconds{{phase="{name}"}} {sec:.6f}')
+        lines += [
+            f'# HELP {prefix}_memory_bytes Size of engine matrices and product store.',
+            f'# TYPE {prefix}_memory_bytes gauge',
+        ]
+        for name, size in memory.items():
+            lines.append(f'{prefix}_memory_bytes{{component="{name}"}} {size}')
+        lines += [
+            f'# HELP {prefix}_cache_requests_total Cache lookups by result.',
+            f'# TYPE {prefix}_cache_requests_total counter',
+        ]
+        for name, stats in caches.items():
+            lines.append(f'{prefix}_cache_requests_total{{cache="{name}",result="hit"}} {stats.get("hits", 0)}')
+            lines.append(f'{prefix}_cache_requests_total{{cache="{name}",result="miss"}} {stats.get("misses", 0)}')
+        lines += [
+            f'# HELP {prefix}_candidate_queries_total Recommendation queries by scoring path.',
+            f'# TYPE {prefix}_candidate_queries_total counter',
+            f'{prefix}_candidate_queries_total{{path="candidates"}} {self.candidate_queries - self.candidate_fallbacks}',
+            f'{prefix}_candidate_queries_total{{path="full_scan"}} {self.candidate_fallbacks}',
+            f'# HELP {prefix}_candidate_scored_products_total Products scored across recommendation queries.',
+            f'# TYPE {prefix}_candidate_scored_products_total counter',
+            f'{prefix}_candidate_scored_products_total {self.candidate_size_sum}',
+        ]
+        lines += [
+            f'# HELP {prefix}_profile_queries_total Recommendation queries by scoring profile.',
+            f'# TYPE {prefix}_profile_queries_total counter',
+        ]
+        for name, count in list(self.profile_queries.items()):
+            lines.append(f'{prefix}_profile_queries_total{{profile="{name}"}} {count}')
+        with self._lock:
+            lines += self._histogram_lines(f'{prefix}_query_latency_seconds', 'Engine query latency.',
+                                           'op', list(self.latency.items()))
+            lines += self._histogram_lines(f'{prefix}_build_seconds', 'Background maintenance task duration.',
+                                           'task', list(self.maintenance.items()))
+        return '\n'.join(lines) + '\n'
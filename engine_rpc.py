@@ -0,0 +1,450 @@
+"""
+Движок рекомендаций в отдельном процессе: сервер и клиент через Unix-сокет.
+
+Сервер держит единственный экземпляр RecommendationEngine (и его watcher),
+Flask-процессы подключаются клиентом EngineClient — без scikit-learn/NumPy
+и без собственной копии матриц. Клиент повторяет методы движка, которыми
+пользуется app.py, поэтому get_reco_engine() может вернуть его вместо движка.
+
+Кадр (запрос и ответ): длина тела uint32 + код uint8 + тело, big-endian.
+
+  OP_QUERY  q product_id, H top_k, ? use_candidates, str vehicle, str profile,
+            str user_id — профиль выбирается и наличие товара проверяется на
+            сервере (RecommendationEngine.recommend_for), один обмен на запрос
+  OP_BATCH  H top_k, str vehicle, str profile, H n, n x q product_id
+  OP_CALL   JSON {"method", "args", "kwargs"} — explain, search, статус и
+            прочие редкие вызовы из CALL_METHODS
+
+Ответ: код STATUS_OK / STATUS_ERROR (тело — текст ошибки) /
+STATUS_UNKNOWN_PRODUCT (OP_QUERY: товара нет в модели, тело пустое).
+Рекомендации кодируются двоично: H n, затем на товар q id, d score,
+val name, val price, val image; str — H длина + UTF-8 (0xFFFF — None),
+val — B тип (None / str / q int / d float) и значение: колонки goods
+приходят клиенту того же типа, что и из движка в процессе.
+Ответ OP_QUERY — str профиль + рекомендации, OP_BATCH — H n списков,
+каждый: q product_id + рекомендации. Ответ OP_CALL — JSON.
+
+Сокет открывает доступ и к админским методам (refresh, reload_weights),
+поэтому он создаётся в личном каталоге пользователя (0700): по умолчанию
+$XDG_RUNTIME_DIR/reco-engine.sock, иначе /tmp/reco-engine-<uid>/; сервер
+не запускается в каталоге, доступном другим пользователям.
+
+Запуск сервера: python engine_rpc.py --db data.db
+"""
+import argparse
+import json
+import numbers
+import os
+import queue
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import db_connection
+
+OP_QUERY = 1
+OP_BATCH = 2
+OP_CALL = 3
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_UNKNOWN_PRODUCT = 2
+
+# engine methods reachable through OP_CALL
+CALL_METHODS = frozenset({
+    'profile_for', 'has_product', 'product_count', 'search', 'graph_recommendations', 'explain',
+    'related', 'status', 'metrics_snapshot', 'prometheus_metrics', 'candidate_recall', 'profiles_summary',
+    'refresh', 'reload_weights', 'update_products', 'schedule_popularity_refresh', 'refresh_services',
+})
+
+
+def default_socket() -> str:
+    """Путь сокета в личном каталоге пользователя (см. описание модуля)."""
+    base = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), f'reco-engine-{os.getuid()}')
+    return os.path.join(base, 'reco-engine.sock')
+
+
+_HEADER = struct.Struct('!IB')
+_STR_LEN = struct.Struct('!H')
+_COUNT = struct.Struct('!H')
+_ID = struct.Struct('!q')
+_ITEM = struct.Struct('!qd')
+_QUERY = struct.Struct('!qH?')
+_NONE = 0xFFFF
+# longer strings are cut to fit the uint16 length
+_MAX_STR = 0xFFFE
+# type tags of item values (val)
+_TAG = struct.Struct('!B')
+_FLOAT = struct.Struct('!d')
+_T_NONE, _T_STR, _T_INT, _T_FLOAT = range(4)
+
+
+class EngineRPCError(Exception):
+    """Сервер недоступен или вернул ошибку."""
+
+
+class UnknownProductError(EngineRPCError):
+    """OP_QUERY для товара, которого нет в модели (STATUS_UNKNOWN_PRODUCT)."""
+
+
+def _pack_str(value) -> bytes:
+    if value is None:
+        return _STR_LEN.pack(_NONE)
+    data = str(value).encode('utf-8')[:_MAX_STR]
+    return _STR_LEN.pack(len(data)) + data
+
+
+def _unpack_str(buf: bytes, offset: int) -> Tuple[Optional[str], int]:
+    (n,) = _STR_LEN.unpack_from(buf, offset)
+    offset += _STR_LEN.size
+    if n == _NONE:
+        return None, offset
+    return buf[offset:offset + n].decode('utf-8', 'replace'), offset + n
+
+
+def _pack_value(value) -> bytes:
+    if value is None:
+        return _TAG.pack(_T_NONE)
+    if isinstance(value, numbers.Integral) and -(1 << 63) <= value < (1 << 63):
+        return _TAG.pack(_T_INT) + _ID.pack(int(value))
+    if isinstance(value, numbers.Real):
+        return _TAG.pack(_T_FLOAT) + _FLOAT.pack(float(value))
+    return _TAG.pack(_T_STR) + _pack_str(value)
+
+
+def _unpack_value(buf: bytes, offset: int):
+    (tag,) = _TAG.unpack_from(buf, offset)
+    offset += _TAG.size
+    if tag == _T_INT:
+        return _ID.unpack_from(buf, offset)[0], offset + _ID.size
+    if tag == _T_FLOAT:
+        return _FLOAT.unpack_from(buf, offset)[0], offset + _FLOAT.size
+    if tag == _T_STR:
+        return _unpack_str(buf, offset)
+    return None, offset
+
+
+def pack_items(items: List[Dict]) -> bytes:
+    parts = [_COUNT.pack(len(items))]
+    for item in items:
+        parts.append(_ITEM.pack(int(item['id']), float(item['score'])))
+        parts.append(_pack_value(item.get('name')))
+        parts.append(_pack_value(item.get('price')))
+        parts.append(_pack_value(item.get('image')))
+    return b''.join(parts)
+
+
+def unpack_items(buf: bytes, offset: int = 0) -> Tuple[List[Dict], int]:
+    (n,) = _COUNT.unpack_from(buf, offset)
+    offset += _COUNT.size
+    items = []
+    for _ in range(n):
+        product_id, score = _ITEM.unpack_from(buf, offset)
+        offset += _ITEM.size
+        name, offset = _unpack_value(buf, offset)
+        price, offset = _unpack_value(buf, offset)
+        image, offset = _unpack_value(buf, offset)
+        items.append({'id': product_id, 'name': name, 'price': price, 'image': image, 'score': score})
+    return items, offset
+
+
+def _json_default(value):
+    # numpy scalars / arrays and sets in metric dictionaries
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    chunks = []
+    while n:
+        chunk = sock.recv(n)
+        if not chunk:
+            raise ConnectionError('connection closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_frame(sock: socket.socket, code: int, body: bytes):
+    sock.sendall(_HEADER.pack(len(body), code) + body)
+
+
+def recv_frame(sock: socket.socket) -> Tuple[int, bytes]:
+    length, code = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return code, _recv_exact(sock, length) if length else b''
+
+
+# ---------------------------------------------------------------- server
+
+def handle_request(engine, op: int, body: bytes) -> bytes:
+    """Выполнить запрос `op` над движком; вернуть тело ответа."""
+    if op == OP_QUERY:
+        product_id, top_k, use_candidates = _QUERY.unpack_from(body, 0)
+        vehicle, offset = _unpack_str(body, _QUERY.size)
+        profile, offset = _unpack_str(body, offset)
+        user_id, offset = _unpack_str(body, offset)
+        result = engine.recommend_for(product_id, top_k=top_k, vehicle=vehicle, use_candidates=use_candidates,
+                                      profile=profile, user_id=user_id)
+        if result is None:
+            raise UnknownProductError(product_id)
+        name, items = result
+        return _pack_str(name) + pack_items(items)
+    if op == OP_BATCH:
+        (top_k,) = _COUNT.unpack_from(body, 0)
+        vehicle, offset = _unpack_str(body, _COUNT.size)
+        profile, offset = _unpack_str(body, offset)
+        (n,) = _COUNT.unpack_from(body, offset)
+        ids = struct.unpack_from(f'!{n}q', body, offset + _COUNT.size)
+        lists = engine.recommend_many(list(ids), top_k=top_k, vehicle=vehicle, profile=profile)
+        return _COUNT.pack(n) + b''.join(_ID.pack(pid) + pack_items(lists[pid]) for pid in ids)
+    if op == OP_CALL:
+        request = json.loads(body.decode('utf-8'))
+        method = request.get('method')
+        if method not in CALL_METHODS:
+            raise ValueError(f'unknown method {method!r}')
+        result = getattr(engine, method)(*request.get('args', ()), **request.get('kwargs', {}))
+        return json.dumps(result, default=_json_default, ensure_ascii=False).encode('utf-8')
+    raise ValueError(f'unknown op {op}')
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # one connection carries any number of requests (pooled clients keep it open)
+        while True:
+            try:
+                op, body = recv_frame(self.request)
+            except (ConnectionError, OSError, struct.error):
+                return
+            try:
+                reply = (STATUS_OK, handle_request(self.server.engine, op, body))
+            except UnknownProductError:
+                reply = (STATUS_UNKNOWN_PRODUCT, b'')
+            except Exception as e:
+                reply = (STATUS_ERROR, f'{type(e).__name__}: {e}'.encode('utf-8'))
+            try:
+                send_frame(self.request, *reply)
+            except OSError:
+                return
+
+
+def _private_dir(path: str):
+    """Создать каталог сокета с правами 0700; отказать, если он чужой или доступен другим."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) & 0o077:
+        raise EngineRPCError(f'socket directory {path} must be owned by uid {os.getuid()} with mode 0700')
+
+
+class EngineServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Многопоточный сервер движка на Unix-сокете `path` (в личном каталоге, см. описание модуля)."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str, engine):
+        self.engine = engine
+        _private_dir(os.path.dirname(os.path.abspath(path)))
+        if os.path.exists(path):
+            # stale socket of a previous run
+            os.unlink(path)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+
+
+# ---------------------------------------------------------------- client
+
+class EngineClient:
+    """Клиент сервера движка с пулом соединений; методы повторяют RecommendationEngine."""
+
+    def __init__(self, path: str = None, pool_size: int = 8, timeout: float = 10.0):
+        self.path = path or default_socket()
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise EngineRPCError(f'engine server at {self.path} unavailable: {e}')
+        return sock
+
+    def _request(self, op: int, body: bytes) -> bytes:
+        # a pooled connection may have been closed by a server restart: retry once on a fresh one
+        for attempt in range(2):
+            try:
+                sock = self._idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                sock = self._connect()
+                reused = False
+            try:
+                send_frame(sock, op, body)
+                status, reply = recv_frame(sock)
+            except (ConnectionError, OSError, struct.error) as e:
+                sock.close()
+                if reused and attempt == 0:
+                    continue
+                raise EngineRPCError(f'engine server request failed: {e}')
+            try:
+                self._idle.put_nowait(sock)
+            except queue.Full:
+                sock.close()
+            if status == STATUS_UNKNOWN_PRODUCT:
+                raise UnknownProductError('product is not in the model')
+            if status != STATUS_OK:
+                raise EngineRPCError(reply.decode('utf-8', 'replace'))
+            return reply
+        raise EngineRPCError('engine server request failed')
+
+    def _call(self, method: str, *args, **kwargs):
+        body = json.dumps({'method': method, 'args': args, 'kwargs': kwargs}).encode('utf-8')
+        return json.loads(self._request(OP_CALL, body).decode('utf-8'))
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def wait_ready(self, timeout: float = 300.0, interval: float = 0.5) -> bool:
+        """Дождаться, пока сервер начнёт отвечать (он открывает сокет после загрузки движка)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.product_count()
+                return True
+            except EngineRPCError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(interval)
+
+    def recommend_for(self, product_id: int, top_k: int = 5, vehicle: str = None, use_candidates: bool = True,
+                      profile: str = None, user_id=None) -> Optional[Tuple[str, List[Dict]]]:
+        body = (_QUERY.pack(int(product_id), int(top_k), bool(use_candidates)) + _pack_str(vehicle)
+                + _pack_str(profile) + _pack_str(None if user_id is None else str(user_id)))
+        try:
+            reply = self._request(OP_QUERY, body)
+        except UnknownProductError:
+            return None
+        name, offset = _unpack_str(reply, 0)
+        return name, unpack_items(reply, offset)[0]
+
+    def get_recommendations(self, product_id: int, top_k: int = 5, vehicle: str = None,
+                            use_candidates: bool = True, profile: str = None) -> List[Dict]:
+        result = self.recommend_for(product_id, top_k=top_k, vehicle=vehicle, use_candidates=use_candidates,
+                                    profile=profile)
+        return result[1] if result is not None else []
+
+    def recommend_many(self, product_ids: List[int], top_k: int = 5, vehicle: str = None,
+                       profile: str = None) -> Dict[int, List[Dict]]:
+        ids = [int(pid) for pid in product_ids]
+        body = (_COUNT.pack(int(top_k)) + _pack_str(vehicle) + _pack_str(profile)
+                + _COUNT.pack(len(ids)) + struct.pack(f'!{len(ids)}q', *ids))
+        reply = self._request(OP_BATCH, body)
+        (n,) = _COUNT.unpack_from(reply, 0)
+        offset = _COUNT.size
+        result = {}
+        for _ in range(n):
+            (pid,) = _ID.unpack_from(reply, offset)
+            result[pid], offset = unpack_items(reply, offset + _ID.size)
+        return result
+
+    def explain(self, product_id: int, page: int = 1, per_page: int = 10) -> Dict:
+        return self._call('explain', product_id, page=page, per_page=per_page)
+
+    def related(self, product_id: int, top_k: int = 5, services_k: int = 3, vehicle: str = None,
+                profile: str = None) -> Dict[str, List[Dict]]:
+        return self._call('related', product_id, top_k=top_k, services_k=services_k, vehicle=vehicle, profile=profile)
+
+    def profile_for(self, profile: str = None, user_id=None) -> str:
+        return self._call('profile_for', profile, user_id)
+
+    def has_product(self, product_id: int) -> bool:
+        return self._call('has_product', product_id)
+
+    def product_count(self) -> int:
+        return self._call('product_count')
+
+    def search(self, text: str, top_k: int = 10, filters: Dict = None) -> List[Dict]:
+        return self._call('search', text, top_k=top_k, filters=filters)
+
+    def graph_recommendations(self, product_id: int, top_k: int = 5, exclude_direct: bool = False) -> List[Dict]:
+        return self._call('graph_recommendations', product_id, top_k=top_k, exclude_direct=exclude_direct)
+
+    def status(self) -> Dict:
+        return self._call('status')
+
+    def metrics_snapshot(self) -> Dict:
+        return self._call('metrics_snapshot')
+
+    def prometheus_metrics(self) -> str:
+        return self._call('prometheus_metrics')
+
+    def candidate_recall(self, sample: int = 50, top_k: int = 5, seed: int = 0, profile: str = None) -> Dict:
+        return self._call('candidate_recall', sample=sample, top_k=top_k, seed=seed, profile=profile)
+
+    def profiles_summary(self) -> Dict[str, Dict[str, float]]:
+        return self._call('profiles_summary')
+
+    def refresh(self):
+        return self._call('refresh')
+
+    def reload_weights(self):
+        return self._call('reload_weights')
+
+    def update_products(self) -> str:
+        return self._call('update_products')
+
+    def schedule_popularity_refresh(self):
+        return self._call('schedule_popularity_refresh')
+
+    def refresh_services(self):
+        return self._call('refresh_services')
+
+
+# ---------------------------------------------------------------- entry point
+
+def main(argv=None):
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Recommendation engine server over a Unix socket')
+    parser.add_argument('--socket', default=os.environ.get('RECO_ENGINE_SOCKET') or default_socket())
+    parser.add_argument('--db', default=db_connection.DB_PATH)
+    parser.add_argument('--snapshot', default=os.path.join(here, 'prebuilt', 'engine'))
+    parser.add_argument('--no-watch', action='store_true', help='do not follow DB / reco_config.json changes')
+    args = parser.parse_args(argv)
+
+    # refuse a shared socket directory before spending minutes on loading the engine
+    _private_dir(os.path.dirname(os.path.abspath(args.socket)))
+    from recommendations import RecommendationEngine
+    engine = RecommendationEngine.load_or_build(args.db, args.snapshot)
+    watcher = None
+    if not args.no_watch:
+        from engine_watcher import EngineWatcher
+        watcher = EngineWatcher(lambda: engine, args.db, os.path.join(here, 'reco_config.json'))
+        watcher.start()
+    server = EngineServer(args.socket, engine)
+    print(f'engine server: {len(engine.ids)} products on {args.socket}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if watcher is not None:
+            watcher.stop()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
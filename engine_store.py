@@ -0,0 +1,248 @@
+"""
+Переносимый формат снимка движка рекомендаций (без pickle).
+
+Снимок — каталог из четырёх файлов (и необязательного пятого):
+
+  manifest.json  версия формата, веса, параметры векторизаторов, словарь
+                 производителей и SHA-256 каждого файла снимка;
+  arrays.npz     CSR-матрицы (data / indices / indptr / shape), idf,
+                 сходство производителей, id производителей по товарам,
+                 кластеры почти-дубликатов (near_duplicates.py), отпечатки
+                 текстовых полей товаров (RecommendationEngine.update_products),
+                 число заказов по товарам;
+  vocab.json     словари TF-IDF (термин -> номер столбца; у hashing-сборки их нет);
+  products.json  метаданные товаров по колонкам;
+  tokens.json.gz кэш токенизации (tokenization.TokenCache) по blake2b-хэшу
+                 текста документа — ускоряет переобучение после загрузки.
+
+Формат не зависит от версий Python/scikit-learn/numpy (нет pickle), а
+загрузка не требует переобучения: векторизаторы восстанавливаются из
+словаря и idf, матрицы — из массивов. Несовпадение версии формата или
+контрольной суммы — SnapshotError, вызывающая сторона перестраивает движок.
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+from typing import Dict
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from hashing_build import HashedTfidf
+from near_duplicates import DuplicateClusters
+
+FORMAT_NAME = 'reco-engine'
+FORMAT_VERSION = 1
+
+MANIFEST = 'manifest.json'
+ARRAYS = 'arrays.npz'
+VOCAB = 'vocab.json'
+PRODUCTS = 'products.json'
+TOKENS = 'tokens.json.gz'
+
+# vectorizer attributes of RecommendationEngine -> matrix attributes
+_VECTORIZERS = {'text': ('tfidf_text', 'matrix_text'), 'category': ('tfidf_category', 'matrix_category')}
+_JSON_TYPES = (str, int, float, bool, type(None))
+
+
+class SnapshotError(Exception):
+    """Снимок отсутствует, повреждён или записан несовместимой версией формата."""
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _vectorizer_params(vec: TfidfVectorizer) -> Dict:
+    # only plain constructor settings; dtype, tokenizer callables etc. keep their defaults
+    params = {}
+    for k, v in vec.get_params().items():
+        if k == 'vocabulary':
+            continue
+        if isinstance(v, (list, tuple)) and all(isinstance(x, _JSON_TYPES) for x in v):
+            params[k] = list(v)
+        elif isinstance(v, _JSON_TYPES):
+            params[k] = v
+    return params
+
+
+def _restore_vectorizer(params: Dict, vocabulary: Dict[str, int], idf: np.ndarray) -> TfidfVectorizer:
+    params = dict(params)
+    if 'ngram_range' in params:
+        params['ngram_range'] = tuple(params['ngram_range'])
+    vec = TfidfVectorizer(**params, vocabulary=vocabulary)
+    # transform() needs the fitted vocabulary_ and idf_; set them without refitting
+    vec.vocabulary_ = vocabulary
+    vec.fixed_vocabulary_ = True
+    vec.idf_ = idf
+    return vec
+
+
+def save(engine, path: str) -> Dict:
+    """Записать движок в каталог `path`; вернуть манифест."""
+    os.makedirs(path, exist_ok=True)
+    arrays = {}
+    vocab = {}
+    vectorizers = {}
+    for name, (vec_attr, mat_attr) in _VECTORIZERS.items():
+        vec = getattr(engine, vec_attr)
+        mat = getattr(engine, mat_attr)
+        if vec is None or mat is None:
+            continue
+        mat = sparse.csr_matrix(mat)
+        arrays[f'{name}_data'] = mat.data
+        arrays[f'{name}_indices'] = mat.indices
+        arrays[f'{name}_indptr'] = mat.indptr
+        arrays[f'{name}_shape'] = np.asarray(mat.shape, dtype=np.int64)
+        arrays[f'{name}_idf'] = np.asarray(vec.idf_)
+        if isinstance(vec, HashedTfidf):
+            # hashing build: no vocabulary, the column is the token hash
+            vectorizers[name] = {'hashing_features': vec.n_features}
+            continue
+        vocab[name] = {term: int(i) for term, i in vec.vocabulary_.items()}
+        vectorizers[name] = _vectorizer_params(vec)
+    if engine.manufacturer_sim is not None:
+        arrays['manufacturer_sim'] = engine.manufacturer_sim
+        arrays['manufacturer_ids'] = engine.manufacturer_ids
+    if engine.duplicates is not None:
+        arrays['duplicates_cluster'] = engine.duplicates.cluster
+    signatures = getattr(engine, '_text_signatures', None)
+    if signatures is not None:
+        arrays['text_signatures'] = np.asarray(signatures, dtype=np.int64)
+    arrays['popularity'] = np.asarray(engine.popularity, dtype=np.float64)
+
+    columns = list(engine.products[0].keys()) if engine.products else []
+    products = {'columns': columns, 'data': {c: [p.get(c) for p in engine.products] for c in columns}}
+
+    # numpy.savez writes plain .npy members; no object arrays, so it loads with allow_pickle=False
+    np.savez(os.path.join(path, ARRAYS), **arrays)
+    with open(os.path.join(path, VOCAB), 'w', encoding='utf-8') as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(os.path.join(path, PRODUCTS), 'w', encoding='utf-8') as f:
+        json.dump(products, f, ensure_ascii=False)
+    files = [ARRAYS, VOCAB, PRODUCTS]
+    token_caches = getattr(engine, 'token_caches', None)
+    if token_caches:
+        with gzip.open(os.path.join(path, TOKENS), 'wt', encoding='utf-8') as f:
+            json.dump({name: cache.to_dict() for name, cache in token_caches.items()}, f, ensure_ascii=False)
+        files.append(TOKENS)
+
+    manifest = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'created_at': time.time(),
+        'n_products': len(engine.ids),
+        'weights': {'w_text': engine.w_text, 'w_category': engine.w_category,
+                    'w_manufacturer': engine.w_manufacturer, 'w_popularity': engine.w_popularity},
+        # matrices are stored already scaled by the cat_scale they were built with
+        'built_cat_scale': getattr(engine, '_built_cat_scale', engine.cat_scale),
+        'vectorizers': vectorizers,
+        'manufacturer_keys': list(engine.manufacturer_keys),
+        'manufacturer_aliases': dict(engine.manufacturer_aliases),
+        # threshold the clusters were found with; null — duplicates were not collapsed
+        'duplicate_threshold': getattr(engine, '_duplicates_threshold', None),
+        'files': {name: _sha256(os.path.join(path, name)) for name in files},
+    }
+    with open(os.path.join(path, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def read_manifest(path: str) -> Dict:
+    """Прочитать и проверить манифест и контрольные суммы файлов снимка."""
+    try:
+        with open(os.path.join(path, MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f'cannot read manifest: {e}')
+    if manifest.get('format') != FORMAT_NAME or manifest.get('version') != FORMAT_VERSION:
+        raise SnapshotError(f"unsupported snapshot {manifest.get('format')} v{manifest.get('version')}")
+    for name, digest in manifest.get('files', {}).items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path):
+            raise SnapshotError(f'missing {name}')
+        if _sha256(file_path) != digest:
+            raise SnapshotError(f'checksum mismatch for {name}')
+    return manifest
+
+
+def load_into(engine, path: str) -> Dict:
+    """Заполнить пустое состояние модели движка (или сам движок) из снимка `path`; вернуть манифест.
+
+    Кластеры почти-дубликатов восстанавливаются из массива (MinHash не
+    пересчитывается); остальные производные структуры (fitment-индекс,
+    кандидаты, стратегия скоринга) движок строит из метаданных товаров
+    при первом обращении.
+    """
+    manifest = read_manifest(path)
+    try:
+        with np.load(os.path.join(path, ARRAYS), allow_pickle=False) as npz:
+            arrays = {k: npz[k] for k in npz.files}
+        with open(os.path.join(path, VOCAB), 'r', encoding='utf-8') as f:
+            vocab = json.load(f)
+        with open(os.path.join(path, PRODUCTS), 'r', encoding='utf-8') as f:
+            products = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f'cannot read snapshot: {e}')
+
+    columns = products['columns']
+    data = products['data']
+    n = manifest['n_products']
+    engine.products = [{c: data[c][i] for c in columns} for i in range(n)]
+    engine.ids = [p['id'] for p in engine.products]
+    if 'popularity' in arrays:
+        engine.popularity = arrays['popularity']
+    else:
+        # older snapshots kept order counts in the product rows
+        engine.popularity = np.array([float(p.pop('popularity', 0) or 0) for p in engine.products])
+
+    for name, (vec_attr, mat_attr) in _VECTORIZERS.items():
+        if name not in manifest['vectorizers']:
+            setattr(engine, vec_attr, None)
+            setattr(engine, mat_attr, None)
+            continue
+        shape = tuple(int(x) for x in arrays[f'{name}_shape'])
+        mat = sparse.csr_matrix(
+            (arrays[f'{name}_data'], arrays[f'{name}_indices'], arrays[f'{name}_indptr']), shape=shape)
+        setattr(engine, mat_attr, mat)
+        params = manifest['vectorizers'][name]
+        if 'hashing_features' in params:
+            setattr(engine, vec_attr, HashedTfidf(params['hashing_features'], arrays[f'{name}_idf']))
+        else:
+            setattr(engine, vec_attr, _restore_vectorizer(params, vocab[name], arrays[f'{name}_idf']))
+
+    engine.manufacturer_keys = manifest['manufacturer_keys']
+    engine.manufacturer_aliases = manifest['manufacturer_aliases']
+    engine.manufacturer_sim = arrays.get('manufacturer_sim')
+    engine.manufacturer_ids = arrays.get('manufacturer_ids')
+    engine._built_cat_scale = manifest['built_cat_scale']
+    if 'duplicate_threshold' in manifest:
+        cluster = arrays.get('duplicates_cluster')
+        engine.duplicates = DuplicateClusters(cluster) if cluster is not None else None
+        engine._duplicates_threshold = manifest['duplicate_threshold']
+    if 'text_signatures' in arrays:
+        engine._text_signatures = arrays['text_signatures'].tolist()
+    return manifest
+
+
+def load_tokens(token_caches: Dict, path: str, manifest: Dict = None) -> int:
+    """Заполнить кэши токенизации из снимка `path` (если он их содержит); вернуть число документов.
+
+    Кэш — только ускорение: его отсутствие или порча не мешают загрузке снимка.
+    """
+    manifest = manifest or read_manifest(path)
+    if TOKENS not in manifest.get('files', {}):
+        return 0
+    try:
+        with gzip.open(os.path.join(path, TOKENS), 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return sum(cache.update_from(data.get(name)) for name, cache in token_caches.items())
@@ -0,0 +1,217 @@
+"""
+Фоновое отслеживание изменений БД и reco_config.json для движка рекомендаций.
+
+Поток опрашивает `PRAGMA data_version` (меняется, когда БД записал кто-то
+другой: data_loader.py, scripts/auto_populate.py, админка), счётчики
+изменений по таблицам и mtime reco_config.json. Серия изменений
+«схлопывается» (debounce), после чего выполняется самое дешёвое
+достаточное действие:
+
+  - изменился только конфиг          -> engine.reload_weights()
+  - изменились только заказы         -> engine.refresh_popularity() (без ожидания debounce)
+  - изменились товары                -> engine.update_products() (метаданные или полная перестройка)
+  - изменилась denormalized_data     -> engine.refresh()
+
+При изменении товаров поток также переиндексирует применимость
+(goods_fitment) товаров, поставленных в очередь триггерами fitment.py.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import db_connection
+import fitment
+import migrations
+
+# tables whose writes are counted by triggers (created by migration 'change_counters')
+COUNTED_TABLES = migrations.COUNTED_TABLES
+
+
+def has_change_counters(conn: sqlite3.Connection) -> bool:
+    """Есть ли table_versions и все триггеры-счётчики (без них — сигнатуры по COUNT/MAX(id))."""
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+    return 'table_versions' in names and all(
+        f'{table}_version_{op}' in names
+        for table in COUNTED_TABLES if table in names for op in ('insert', 'update', 'delete'))
+
+
+def table_signatures(conn: sqlite3.Connection, counters: bool = True) -> Dict[str, tuple]:
+    """Текущие «версии» отслеживаемых таблиц.
+
+    goods/orders — счётчик из table_versions (`counters`=False, если миграции
+    change_counters нет: тогда (COUNT, MAX(id))); denormalized_data пересоздаётся
+    целиком (DROP/CREATE), поэтому для неё берётся (COUNT, MAX(id)).
+    """
+    cur = conn.cursor()
+    sigs = {}
+    if counters:
+        try:
+            cur.execute('SELECT name, version FROM table_versions')
+            sigs.update({name: (version,) for name, version in cur.fetchall()})
+        except sqlite3.Error:
+            pass
+    for table in COUNTED_TABLES:
+        if table not in sigs:
+            try:
+                cur.execute(f'SELECT COUNT(*), MAX(id) FROM {table}')
+                sigs[table] = tuple(cur.fetchone())
+            except sqlite3.Error:
+                sigs[table] = None
+    try:
+        cur.execute('SELECT COUNT(*), MAX(id) FROM denormalized_data')
+        sigs['denormalized_data'] = tuple(cur.fetchone())
+    except sqlite3.Error:
+        sigs['denormalized_data'] = None
+    return sigs
+
+
+class EngineWatcher:
+    """Поток, перестраивающий движок при изменении данных или конфигурации."""
+
+    def __init__(self, get_engine: Callable, db_path: str, config_path: str,
+                 interval: float = 2.0, debounce: float = 5.0, max_delay: float = 60.0,
+                 popularity_debounce: float = 0.0):
+        self.get_engine = get_engine
+        self.db_path = db_path
+        self.config_path = config_path
+        self.interval = interval
+        # quiet period after the last change before acting, and an upper bound for busy periods
+        self.debounce = debounce
+        self.max_delay = max_delay
+        # popularity refresh is cheap, so orders-only changes need a much shorter quiet period
+        self.popularity_debounce = popularity_debounce
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version = None
+        self._sigs: Dict[str, tuple] = {}
+        self._config_mtime = None
+        self._pending = set()
+        self._first_change = None
+        self._last_change = None
+        self.last_action = None
+        self.last_action_at = None
+        self.last_error = None
+        # False on a database without the change_counters migration (slower signatures)
+        self.change_counters = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='engine-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 2)
+
+    def status(self) -> Dict:
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'pending': sorted(self._pending),
+            'last_action': self.last_action,
+            'last_action_at': self.last_action_at,
+            'last_error': self.last_error,
+            'change_counters': self.change_counters,
+        }
+
+    def _config_mtime_now(self):
+        try:
+            return os.path.getmtime(self.config_path)
+        except OSError:
+            return None
+
+    def _open(self):
+        # one long-lived connection: data_version only moves for writes by *other* connections
+        self._conn = db_connection.connect(self.db_path, check_same_thread=False)
+        self.change_counters = has_change_counters(self._conn)
+        self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        self._sigs = table_signatures(self._conn, self.change_counters)
+        self._config_mtime = self._config_mtime_now()
+
+    def _run(self):
+        try:
+            self._open()
+        except sqlite3.Error as e:
+            self.last_error = str(e)
+            return
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.last_error = str(e)
+        self._conn.close()
+
+    def poll(self):
+        """Один цикл опроса; действие выполняется, когда изменения «затихли»."""
+        now = time.time()
+        changed = set()
+
+        mtime = self._config_mtime_now()
+        if mtime != self._config_mtime:
+            self._config_mtime = mtime
+            changed.add('config')
+
+        version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            sigs = table_signatures(self._conn, self.change_counters)
+            changed.update(t for t, sig in sigs.items() if self._sigs.get(t) != sig)
+            self._sigs = sigs
+
+        if changed:
+            self._pending |= changed
+            self._last_change = now
+            if self._first_change is None:
+                self._first_change = now
+
+        if not self._pending:
+            return
+        debounce = self.popularity_debounce if self._pending == {'orders'} else self.debounce
+        quiet = now - self._last_change >= debounce
+        overdue = now - self._first_change >= self.max_delay
+        if quiet or overdue:
+            pending, self._pending = self._pending, set()
+            self._first_change = self._last_change = None
+            self.apply(pending)
+
+    def sync_fitment(self):
+        """Переиндексировать применимость товаров, поставленных в очередь триггерами goods_fitment."""
+        if self._conn is None:
+            return
+        try:
+            if fitment.sync_pending(self._conn):
+                self._conn.commit()
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            self.last_error = f'fitment: {e}'
+
+    def apply(self, pending) -> Optional[str]:
+        """Выполнить самое дешёвое действие, покрывающее набор изменений `pending`."""
+        if 'goods' in pending:
+            self.sync_fitment()
+        engine = self.get_engine()
+        if engine is None:
+            return None
+        if 'denormalized_data' in pending:
+            engine.refresh()
+            action = 'rebuild'
+        else:
+            action = None
+            if 'goods' in pending:
+                action = engine.update_products()
+            if 'orders' in pending and action != 'rebuild':
+                engine.refresh_popularity()
+                action = action or 'popularity'
+            if 'config' in pending:
+                # weights are re-read after any rebuild too, so reload them unconditionally
+                engine.reload_weights()
+                action = action or 'reweight'
+        self.last_action = action
+        self.last_action_at = time.time()
+        self.last_error = None
+        return action
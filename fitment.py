@@ -0,0 +1,259 @@
+"""
+Применимость запчастей к автомобилям (fitment).
+
+`goods.compatibility` — свободный текст вида "BMW X5, Mercedes GLE" или
+"Все модели". Модуль разбирает его в пары (марка, модель), хранит их в
+нормализованных таблицах `vehicles` / `goods_fitment` и строит in-memory
+инвертированный индекс «автомобиль -> товары» для движка рекомендаций.
+
+Правило совпадения для запроса (марка, модель):
+  - универсальные товары ("Все модели") подходят всегда;
+  - товар, указанный для марки без модели ("BMW"), подходит любой модели марки;
+  - товар для конкретной модели подходит только ей;
+  - запрос только по марке ("BMW") находит все товары этой марки.
+"""
+import re
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+UNIVERSAL = '*'
+
+_UNIVERSAL_PHRASES = {'все модели', 'all models', 'универсальный', 'универсальная', 'universal', 'любые'}
+# makes that span several words; matched before falling back to "first word is the make"
+_MULTIWORD_MAKES = ('land rover', 'range rover', 'alfa romeo', 'aston martin', 'mercedes benz', 'rolls royce')
+_MAKE_ALIASES = {
+    'mercedes benz': 'mercedes',
+    'vw': 'volkswagen',
+    'бмв': 'bmw',
+    'мерседес': 'mercedes',
+    'ауди': 'audi',
+}
+_MODEL_NOISE = {'series', 'серия', 'серии'}
+
+_PUNCT_RE = re.compile(r"[^a-z0-9а-яё\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _clean(text) -> str:
+    s = str(text or '').lower().replace('-', ' ')
+    s = _PUNCT_RE.sub(' ', s)
+    return _SPACE_RE.sub(' ', s).strip()
+
+
+def parse_vehicle(text, default_make: str = '') -> Optional[Tuple[str, str]]:
+    """Разобрать одно упоминание автомобиля в (марка, модель).
+
+    Упоминание, начинающееся с цифры ("5 Series" в "BMW 3,5 Series"),
+    наследует марку предыдущего упоминания через `default_make`.
+    """
+    s = _clean(text)
+    if not s:
+        return None
+    if s in _UNIVERSAL_PHRASES:
+        return (UNIVERSAL, '')
+    if s[0].isdigit() and default_make:
+        make, rest = default_make, s
+    else:
+        make = next((m for m in _MULTIWORD_MAKES if s == m or s.startswith(m + ' ')), None)
+        if make is None:
+            make = s.split(' ', 1)[0]
+        rest = s[len(make):].strip()
+        make = _MAKE_ALIASES.get(make, make)
+    model = ' '.join(w for w in rest.split(' ') if w and w not in _MODEL_NOISE)
+    return (make, model)
+
+
+def parse_compatibility(text) -> List[Tuple[str, str]]:
+    """Список уникальных (марка, модель) из строки совместимости."""
+    result = []
+    make = ''
+    for segment in str(text or '').split(','):
+        vehicle = parse_vehicle(segment, default_make=make)
+        if vehicle is None:
+            continue
+        if vehicle[0] != UNIVERSAL:
+            make = vehicle[0]
+        if vehicle not in result:
+            result.append(vehicle)
+    return result
+
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Создать таблицы vehicles / goods_fitment, очередь goods_fitment_pending и её триггеры (идемпотентно).
+
+    Разбор compatibility выполняется в Python, поэтому триггеры на goods только
+    ставят вставленные и изменённые товары в очередь, а sync_pending() их
+    переиндексирует; удаление товара сразу удаляет его применимость.
+    """
+    cur = conn.cursor()
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            make TEXT NOT NULL,
+            model TEXT NOT NULL DEFAULT '',
+            UNIQUE (make, model)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS goods_fitment (
+            product_id INTEGER NOT NULL,
+            vehicle_id INTEGER NOT NULL,
+            PRIMARY KEY (product_id, vehicle_id),
+            FOREIGN KEY (product_id) REFERENCES goods (id),
+            FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
+        )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_goods_fitment_vehicle ON goods_fitment (vehicle_id)')
+    cur.execute('CREATE TABLE IF NOT EXISTS goods_fitment_pending (product_id INTEGER PRIMARY KEY)')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_fitment_ai AFTER INSERT ON goods BEGIN
+            INSERT OR IGNORE INTO goods_fitment_pending (product_id) VALUES (new.id);
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_fitment_au AFTER UPDATE OF compatibility ON goods BEGIN
+            INSERT OR IGNORE INTO goods_fitment_pending (product_id) VALUES (new.id);
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_fitment_ad AFTER DELETE ON goods BEGIN
+            DELETE FROM goods_fitment WHERE product_id = old.id;
+            DELETE FROM goods_fitment_pending WHERE product_id = old.id;
+        END
+    ''')
+
+
+def _vehicle_id(cur, make: str, model: str) -> int:
+    cur.execute('INSERT OR IGNORE INTO vehicles (make, model) VALUES (?, ?)', (make, model))
+    cur.execute('SELECT id FROM vehicles WHERE make = ? AND model = ?', (make, model))
+    return cur.fetchone()[0]
+
+
+def index_product(conn: sqlite3.Connection, product_id: int, compatibility):
+    """(Пере)записать применимость одного товара."""
+    cur = conn.cursor()
+    cur.execute('DELETE FROM goods_fitment WHERE product_id = ?', (product_id,))
+    for make, model in parse_compatibility(compatibility):
+        cur.execute('INSERT OR IGNORE INTO goods_fitment (product_id, vehicle_id) VALUES (?, ?)',
+                    (product_id, _vehicle_id(cur, make, model)))
+
+
+def sync_goods(conn: sqlite3.Connection, only_missing: bool = False) -> int:
+    """Заполнить goods_fitment по goods.compatibility; вернуть число обработанных товаров.
+
+    `only_missing=True` обрабатывает только товары, которых ещё нет в goods_fitment.
+    """
+    ensure_schema(conn)
+    cur = conn.cursor()
+    if only_missing:
+        cur.execute('SELECT id, compatibility FROM goods WHERE id NOT IN (SELECT product_id FROM goods_fitment)')
+    else:
+        cur.execute('DELETE FROM goods_fitment')
+        cur.execute('DELETE FROM goods_fitment_pending')
+        cur.execute('SELECT id, compatibility FROM goods')
+    rows = cur.fetchall()
+    parsed = {}
+    for product_id, compatibility in rows:
+        if compatibility not in parsed:
+            parsed[compatibility] = [_vehicle_id(cur, make, model) for make, model in parse_compatibility(compatibility)]
+        cur.executemany('INSERT OR IGNORE INTO goods_fitment (product_id, vehicle_id) VALUES (?, ?)',
+                        [(product_id, vid) for vid in parsed[compatibility]])
+    return len(rows)
+
+
+def sync_pending(conn: sqlite3.Connection) -> int:
+    """Переиндексировать товары из очереди goods_fitment_pending; вернуть их число.
+
+    Изменения не фиксируются: commit — за вызывающим.
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT 1 FROM goods_fitment_pending LIMIT 1')
+    if cur.fetchone() is None:
+        # read paths call this on every request: an empty queue must not take the write lock
+        return 0
+    # claiming the queue is the first write, so a concurrent edit re-queues after this transaction
+    cur.execute('DELETE FROM goods_fitment_pending RETURNING product_id')
+    ids = [r[0] for r in cur.fetchall()]
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        cur.execute(f'SELECT id, compatibility FROM goods WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+        for product_id, compatibility in cur.fetchall():
+            index_product(conn, product_id, compatibility)
+    return len(ids)
+
+
+def filter_clause(vehicle, column: str = 'id') -> Optional[Tuple[str, tuple]]:
+    """SQL-условие "товар подходит автомобилю `vehicle`" для WHERE по goods.
+
+    Возвращает (sql, params) или None, если строку не удалось разобрать.
+    """
+    parsed = parse_vehicle(vehicle)
+    if parsed is None or parsed[0] == UNIVERSAL:
+        return None
+    make, model = parsed
+    sql = f'''{column} IN (
+        SELECT gf.product_id FROM goods_fitment gf
+        JOIN vehicles v ON v.id = gf.vehicle_id
+        WHERE v.make = ? OR (v.make = ? AND (? = '' OR v.model = '' OR v.model = ?))
+    )'''
+    return sql, (UNIVERSAL, make, model, model)
+
+
+def product_ids_for(conn: sqlite3.Connection, vehicle) -> Optional[List[int]]:
+    """id товаров, подходящих автомобилю `vehicle` (строка вида "BMW X5")."""
+    clause = filter_clause(vehicle)
+    if clause is None:
+        return None
+    sql, params = clause
+    cur = conn.cursor()
+    cur.execute(f'SELECT id FROM goods WHERE {sql}', params)
+    return [r[0] for r in cur.fetchall()]
+
+
+class FitmentIndex:
+    """In-memory индекс «автомобиль -> битовая маска товаров» по позициям движка."""
+
+    def __init__(self, n: int):
+        self.n = n
+        self.universal = np.zeros(n, dtype=bool)
+        # make -> {model -> sorted product positions}; model '' means "any model of the make"
+        self._postings: Dict[str, Dict[str, np.ndarray]] = {}
+
+    @classmethod
+    def from_compatibility(cls, values: List[str]) -> 'FitmentIndex':
+        index = cls(len(values))
+        lists: Dict[str, Dict[str, List[int]]] = {}
+        parsed = {}
+        for pos, text in enumerate(values):
+            if text not in parsed:
+                parsed[text] = parse_compatibility(text)
+            for make, model in parsed[text]:
+                if make == UNIVERSAL:
+                    index.universal[pos] = True
+                else:
+                    lists.setdefault(make, {}).setdefault(model, []).append(pos)
+        index._postings = {
+            make: {model: np.asarray(p, dtype=np.int32) for model, p in models.items()}
+            for make, models in lists.items()
+        }
+        return index
+
+    def nbytes(self) -> int:
+        return int(self.universal.nbytes + sum(p.nbytes for models in self._postings.values() for p in models.values()))
+
+    def vehicles(self) -> List[str]:
+        return sorted(f'{make} {model}'.strip() for make, models in self._postings.items() for model in models)
+
+    def mask(self, vehicle) -> Optional[np.ndarray]:
+        """Булева маска длины n для автомобиля; None — фильтр не задан/не разобран."""
+        parsed = parse_vehicle(vehicle)
+        if parsed is None or parsed[0] == UNIVERSAL:
+            return None
+        make, model = parsed
+        mask = self.universal.copy()
+        for m, positions in self._postings.get(make, {}).items():
+            if not model or not m or m == model:
+                mask[positions] = True
+        return mask
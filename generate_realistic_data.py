@@ -8,10 +8,12 @@ import os
 import random
 from datetime import datetime, timedelta
 
+import db_connection
+
 def generate_test_data(num_users=100, num_orders=500, num_cart_items=200):
     """Генерирует реалистичные тестовые данные"""
     
-    if not os.path.exists('data.db'):
+    if not os.path.exists(db_connection.DB_PATH):
         print("❌ База данных data.db не найдена!")
         print("   Сначала запустите init_db.py")
         return
@@ -24,7 +26,7 @@ def generate_test_data(num_users=100, num_orders=500, num_cart_items=200):
     print(f"   📦 Заказов: {num_orders}")
     print(f"   🛒 Товаров в корзине: {num_cart_items}")
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     # Получаем все товары
@@ -135,6 +137,7 @@ def generate_test_data(num_users=100, num_orders=500, num_cart_items=200):
             cursor.execute('''
                 INSERT INTO cart (user_id, product_id, quantity, created_at)
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
             ''', (user_id, product_id, quantity, created_at))
         except sqlite3.IntegrityError:
             pass
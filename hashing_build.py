@@ -0,0 +1,139 @@
+"""
+Построение TF-IDF матриц движка вне памяти (out-of-core) для больших каталогов.
+
+Вместо TfidfVectorizer (весь корпус списком строк + словарь в памяти):
+
+  - товары читаются из курсора SQLite порциями;
+  - токены хэшируются в фиксированное число столбцов (HashingVectorizer),
+    словарь не хранится;
+  - частоты порции сразу дописываются в CSR-файлы на диске, попутно
+    накапливается документная частота (df) по столбцам;
+  - после прохода idf считается по df, и веса/нормировка строк
+    применяются на месте через np.memmap, тоже порциями.
+
+Пиковая память — одна порция плюс векторы длины n_features; готовая
+матрица отображается с диска (memmap) и читается страницами по запросу.
+"""
+import os
+import shutil
+import time
+from typing import Iterable, List
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+DATA_DTYPE = np.float64
+INDEX_DTYPE = np.int32
+
+
+class HashedTfidf:
+    """TF-IDF поверх хэширования токенов; совместим с tfidf_text.transform() движка."""
+
+    def __init__(self, n_features: int, idf: np.ndarray = None):
+        self.n_features = int(n_features)
+        # same tokenization as TfidfVectorizer defaults: lowercase, word token_pattern
+        self._hasher = HashingVectorizer(n_features=self.n_features, alternate_sign=False, norm=None)
+        self.idf_ = idf
+
+    def counts(self, docs: List[str]) -> sparse.csr_matrix:
+        return self._hasher.transform(docs).tocsr()
+
+    def transform(self, docs: List[str]) -> sparse.csr_matrix:
+        X = self.counts(docs)
+        X.data *= self.idf_[X.indices]
+        return normalize(X, norm='l2', copy=False)
+
+
+def smooth_idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+    """idf как у TfidfTransformer(smooth_idf=True): ln((1 + n) / (1 + df)) + 1."""
+    return np.log((1.0 + n_docs) / (1.0 + df)) + 1.0
+
+
+class CSRWriter:
+    """Построчная запись CSR-матрицы в файлы `<name>.data/.indices/.indptr` каталога `path`."""
+
+    def __init__(self, path: str, name: str, n_features: int):
+        self.path = path
+        self.name = name
+        self.n_features = n_features
+        self.n_rows = 0
+        self.nnz = 0
+        self.df = np.zeros(n_features, dtype=np.int64)
+        self._indptr = [np.zeros(1, dtype=np.int64)]
+        self._data = open(self._file('data'), 'wb')
+        self._indices = open(self._file('indices'), 'wb')
+
+    def _file(self, part: str) -> str:
+        return os.path.join(self.path, f'{self.name}.{part}')
+
+    def append(self, chunk: sparse.csr_matrix):
+        """Дописать строки порции (сырые частоты) и учесть их в df."""
+        chunk.sum_duplicates()
+        np.asarray(chunk.data, dtype=DATA_DTYPE).tofile(self._data)
+        np.asarray(chunk.indices, dtype=INDEX_DTYPE).tofile(self._indices)
+        self.df += np.bincount(chunk.indices, minlength=self.n_features)
+        self._indptr.append(self.nnz + chunk.indptr[1:].astype(np.int64))
+        self.nnz += chunk.nnz
+        self.n_rows += chunk.shape[0]
+
+    def finish(self, chunk_rows: int = 10000, scale: float = 1.0):
+        """Применить idf и l2-нормировку на месте; вернуть (csr-матрица на memmap, idf)."""
+        self._data.close()
+        self._indices.close()
+        # int32 indptr keeps scipy from upcasting (and copying) the memmapped indices
+        indptr = np.concatenate(self._indptr)
+        if self.nnz < np.iinfo(np.int32).max:
+            indptr = indptr.astype(np.int32)
+        np.save(self._file('indptr.npy'), indptr)
+        self._indptr = None
+        idf = smooth_idf(self.df, self.n_rows)
+        shape = (self.n_rows, self.n_features)
+        if self.nnz == 0:
+            return sparse.csr_matrix(shape, dtype=DATA_DTYPE), idf
+
+        data = np.memmap(self._file('data'), dtype=DATA_DTYPE, mode='r+', shape=(self.nnz,))
+        indices = np.memmap(self._file('indices'), dtype=INDEX_DTYPE, mode='r', shape=(self.nnz,))
+        for start in range(0, self.n_rows, chunk_rows):
+            stop = min(start + chunk_rows, self.n_rows)
+            lo, hi = int(indptr[start]), int(indptr[stop])
+            block = data[lo:hi]
+            block *= idf[indices[lo:hi]]
+            # row ids of every stored value in the block, for per-row norms
+            rows = np.repeat(np.arange(stop - start), np.diff(indptr[start:stop + 1]))
+            norms = np.sqrt(np.bincount(rows, weights=block * block, minlength=stop - start))
+            norms[norms == 0] = 1.0
+            block /= norms[rows]
+            if scale != 1.0:
+                block *= scale
+        data.flush()
+        del data
+        return open_matrix(self.path, self.name, shape), idf
+
+
+def open_matrix(path: str, name: str, shape) -> sparse.csr_matrix:
+    """Открыть записанную CSRWriter матрицу только для чтения (memmap)."""
+    indptr = np.load(os.path.join(path, f'{name}.indptr.npy'))
+    nnz = int(indptr[-1])
+    data = np.memmap(os.path.join(path, f'{name}.data'), dtype=DATA_DTYPE, mode='r', shape=(nnz,))
+    indices = np.memmap(os.path.join(path, f'{name}.indices'), dtype=INDEX_DTYPE, mode='r', shape=(nnz,))
+    return sparse.csr_matrix((data, indices, indptr), shape=tuple(shape), copy=False)
+
+
+def new_generation(root: str) -> str:
+    """Новый каталог для файлов очередной сборки внутри `root`."""
+    path = os.path.join(root, f'build-{time.time_ns()}')
+    os.makedirs(path)
+    return path
+
+
+def remove_generations(root: str, keep: Iterable[str]):
+    """Удалить каталоги прошлых сборок (открытые memmap остаются валидны до закрытия)."""
+    keep = {os.path.abspath(p) for p in keep}
+    if not os.path.isdir(root):
+        return
+    for entry in os.listdir(root):
+        path = os.path.abspath(os.path.join(root, entry))
+        if entry.startswith('build-') and path not in keep:
+            shutil.rmtree(path, ignore_errors=True)
@@ -3,25 +3,27 @@
 Автоматически создает таблицы и заполняет тестовыми данными
 """
 
-import sqlite3
 import os
 
+import db_connection
+import migrations
+
 def init_database():
     """Создание и инициализация базы данных с тестовыми данными"""
     
     # Удаляем старую базу если она существует
-    if os.path.exists('data.db'):
+    if os.path.exists(db_connection.DB_PATH):
         print("⚠️  Найдена существующая база данных")
         response = input("Удалить и создать новую? (y/n): ")
         if response.lower() != 'y':
             print("❌ Отменено")
             return
-        os.remove('data.db')
+        db_connection.remove_database()
         print("🗑️  Старая база данных удалена")
     
     print("📦 Создание новой базы данных...")
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     # Создание таблицы пользователей
@@ -171,6 +173,7 @@ def init_database():
         INSERT INTO goods (name, price, image, description, category, compatibility, manufacturer, warranty, stock) 
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', parts_data)
+
     
     # Добавление тестовых салонов
     print("🏢 Добавление салонов...")
@@ -206,6 +209,11 @@ def init_database():
     ''', ('Петр Петров', '+79997654321', 'petr@test.ru', 'Срочно', 3, 2, 2, 'выполнен'))
     
     conn.commit()
+    
+    # Справочник производителей, применимость, полнотекстовый индекс, индексы (общие с app.init_db)
+    print("🗂️  Применение миграций схемы...")
+    applied = migrations.migrate(conn)
+    print(f"   применено: {', '.join(applied) or 'нет'}")
     conn.close()
     
     print("\n" + "="*50)
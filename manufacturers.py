@@ -0,0 +1,153 @@
+"""
+Канонический справочник производителей.
+
+Таблица `manufacturers` хранит нормализованные имена, `manufacturer_aliases` —
+исходные написания (как они пришли из фидов/админки), а `goods.manufacturer_id`
+ссылается на каноническую запись. Используется движком рекомендаций и
+скриптом scripts/normalize_manufacturers.py.
+"""
+import re
+import sqlite3
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# compiled once at import: common company suffixes, punctuation and whitespace runs
+_SUFFIX_RE = re.compile(r"\b(llc|ltd|inc|corp|corporation|gmbh|srl|oy|sa|limited)\b")
+_PUNCT_RE = re.compile(r"[^a-z0-9а-яё\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_manufacturer(name) -> str:
+    """Нормализованный ключ производителя ('Bosch GmbH' -> 'bosch')."""
+    if not name:
+        return ''
+    s = str(name).lower()
+    s = _SUFFIX_RE.sub("", s)
+    s = _PUNCT_RE.sub(" ", s)
+    s = _SPACE_RE.sub(" ", s).strip()
+    return s
+
+
+def _alias_key(name) -> str:
+    return str(name or '').strip().lower()
+
+
+def ensure_schema(conn: sqlite3.Connection):
+    """Создать таблицы справочника и колонку goods.manufacturer_id (идемпотентно)."""
+    cur = conn.cursor()
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS manufacturers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            display_name TEXT NOT NULL
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS manufacturer_aliases (
+            alias TEXT PRIMARY KEY,
+            manufacturer_id INTEGER NOT NULL,
+            FOREIGN KEY (manufacturer_id) REFERENCES manufacturers (id)
+        )
+    ''')
+    cur.execute("PRAGMA table_info('goods')")
+    cols = [r[1] for r in cur.fetchall()]
+    if cols and 'manufacturer_id' not in cols:
+        cur.execute('ALTER TABLE goods ADD COLUMN manufacturer_id INTEGER')
+
+
+def resolve_manufacturer(conn: sqlite3.Connection, name, create: bool = True) -> Optional[int]:
+    """Вернуть id канонического производителя для произвольного написания.
+
+    Сначала ищется точный алиас, затем нормализованный ключ. При `create=True`
+    недостающие записи (производитель и алиас) добавляются.
+    """
+    alias = _alias_key(name)
+    if not alias:
+        return None
+    cur = conn.cursor()
+    cur.execute('SELECT manufacturer_id FROM manufacturer_aliases WHERE alias = ?', (alias,))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+
+    key = normalize_manufacturer(name)
+    if not key:
+        return None
+    cur.execute('SELECT id FROM manufacturers WHERE name = ?', (key,))
+    row = cur.fetchone()
+    if row:
+        mid = row[0]
+    elif create:
+        cur.execute('INSERT INTO manufacturers (name, display_name) VALUES (?, ?)', (key, key.title()))
+        mid = cur.lastrowid
+    else:
+        return None
+    if create:
+        cur.execute('INSERT OR IGNORE INTO manufacturer_aliases (alias, manufacturer_id) VALUES (?, ?)', (alias, mid))
+    return mid
+
+
+def add_alias(conn: sqlite3.Connection, alias, canonical) -> int:
+    """Привязать написание `alias` к производителю `canonical` (создаётся при необходимости)."""
+    mid = resolve_manufacturer(conn, canonical)
+    if mid is None:
+        raise ValueError(f'empty canonical manufacturer: {canonical!r}')
+    conn.execute('INSERT OR REPLACE INTO manufacturer_aliases (alias, manufacturer_id) VALUES (?, ?)',
+                 (_alias_key(alias), mid))
+    return mid
+
+
+def sync_goods(conn: sqlite3.Connection) -> int:
+    """Проставить goods.manufacturer_id по справочнику; вернуть число обновлённых строк."""
+    ensure_schema(conn)
+    cur = conn.cursor()
+    cur.execute('SELECT DISTINCT manufacturer FROM goods')
+    updated = 0
+    for (raw,) in cur.fetchall():
+        mid = resolve_manufacturer(conn, raw)
+        if mid is None:
+            continue
+        res = conn.execute('UPDATE goods SET manufacturer_id = ? WHERE manufacturer = ? AND manufacturer_id IS NOT ?',
+                           (mid, raw, mid))
+        updated += res.rowcount
+    return updated
+
+
+def load_aliases(conn: sqlite3.Connection) -> Dict[str, str]:
+    """alias -> канонический ключ; пустой словарь, если справочника ещё нет."""
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT a.alias, m.name FROM manufacturer_aliases a
+            JOIN manufacturers m ON m.id = a.manufacturer_id
+        ''')
+        return {r[0]: r[1] for r in cur.fetchall()}
+    except sqlite3.Error:
+        return {}
+
+
+def canonical_key(name, aliases: Dict[str, str]) -> str:
+    """Канонический ключ для написания `name` с учётом алиасов."""
+    return aliases.get(_alias_key(name)) or normalize_manufacturer(name)
+
+
+def similarity_matrix(keys: List[str]) -> np.ndarray:
+    """Плотная матрица (M+1)x(M+1) нечёткого сходства канонических имён.
+
+    Сходство — косинус TF-IDF по символьным 3–6-граммам (как раньше считалось
+    для каждого товара). Последняя строка/столбец нулевые: это слот
+    «производитель не указан», он ни с чем не совпадает.
+    """
+    m = len(keys)
+    sim = np.zeros((m + 1, m + 1), dtype=np.float64)
+    if m == 0:
+        return sim
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import linear_kernel
+    vec = TfidfVectorizer(analyzer='char_wb', ngram_range=(3, 6), lowercase=True, max_features=200)
+    mat = vec.fit_transform(keys)
+    sim[:m, :m] = linear_kernel(mat, mat)
+    # names too short to produce any n-gram still match themselves exactly
+    np.fill_diagonal(sim[:m, :m], 1.0)
+    return sim
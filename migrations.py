@@ -0,0 +1,173 @@
+"""
+Версионированные миграции схемы SQLite.
+
+Обе точки инициализации (init_db.py и app.init_db) создают таблицы своими
+CREATE TABLE, затем вызывают migrate(). Оно по порядку применяет миграции,
+номеров которых ещё нет в schema_migrations, каждую в своей транзакции
+(BEGIN IMMEDIATE: несколько процессов приложения не применят одну миграцию
+дважды), а после изменений обновляет статистику планировщика (ANALYZE).
+
+Новая миграция — функция, добавленная в конец MIGRATIONS со следующим
+номером; уже применённые миграции не меняются.
+"""
+import sqlite3
+from typing import Callable, List, Tuple
+
+import fitment
+import manufacturers
+import product_search
+
+# tables whose writes bump a counter in table_versions (read by engine_watcher)
+COUNTED_TABLES = ('goods', 'orders')
+
+# covering index for the engine's per-product GROUP_CONCAT over denormalized_data;
+# create_denormalized_table.py recreates the table and runs it again
+DENORMALIZED_INDEX = ('CREATE INDEX IF NOT EXISTS idx_denormalized_product '
+                      'ON denormalized_data (product_id, user_login, order_status)')
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info('{table}')")]
+
+
+def _manufacturers(conn: sqlite3.Connection):
+    """Справочник производителей, goods.manufacturer_id и триггеры, ведущие его за goods.manufacturer.
+
+    При любой вставке/правке (админка, скрипты, загрузчики) написание ищется в
+    manufacturer_aliases (lower() в SQLite меняет регистр только у ASCII);
+    ненайденное даёт NULL, и движок нормализует его сам, пока
+    manufacturers.sync_goods / resolve_manufacturer не заведут алиас.
+    """
+    if not _columns(conn, 'goods'):
+        return
+    manufacturers.ensure_schema(conn)
+    lookup = ('UPDATE goods SET manufacturer_id = (SELECT manufacturer_id FROM manufacturer_aliases '
+              'WHERE alias = lower(trim(NEW.manufacturer))) WHERE id = NEW.id;')
+    conn.execute(f'CREATE TRIGGER IF NOT EXISTS goods_manufacturer_id_insert AFTER INSERT ON goods '
+                 f'BEGIN {lookup} END')
+    conn.execute(f'CREATE TRIGGER IF NOT EXISTS goods_manufacturer_id_update AFTER UPDATE OF manufacturer ON goods '
+                 f'BEGIN {lookup} END')
+    manufacturers.sync_goods(conn)
+
+
+def _goods_fitment(conn: sqlite3.Connection):
+    """vehicles / goods_fitment по goods.compatibility и триггеры их актуальности (fitment.py)."""
+    if _columns(conn, 'goods'):
+        fitment.sync_goods(conn)
+
+
+def _goods_fts(conn: sqlite3.Connection):
+    """Полнотекстовый индекс goods_fts с триггерами синхронизации (product_search.py)."""
+    if _columns(conn, 'goods'):
+        product_search.ensure_schema(conn)
+
+
+def _change_counters(conn: sqlite3.Connection):
+    """table_versions и триггеры, увеличивающие счётчик таблицы при любой записи в неё."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table in COUNTED_TABLES:
+        if not _columns(conn, table):
+            continue
+        conn.execute('INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 0)', (table,))
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{op.lower()} AFTER {op} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+
+def _orders_columns(conn: sqlite3.Connection):
+    """orders из app.init_db без user_id / quantity / status (их пишет оформление корзины)."""
+    columns = _columns(conn, 'orders')
+    if not columns:
+        return
+    if 'user_id' not in columns:
+        conn.execute('ALTER TABLE orders ADD COLUMN user_id INTEGER REFERENCES users (id)')
+    if 'quantity' not in columns:
+        conn.execute('ALTER TABLE orders ADD COLUMN quantity INTEGER DEFAULT 1')
+    if 'status' not in columns:
+        conn.execute("ALTER TABLE orders ADD COLUMN status TEXT DEFAULT 'в разработке'")
+
+
+def _hot_path_indexes(conn: sqlite3.Connection):
+    """Индексы под частые запросы; users.email уже проиндексирован ограничением UNIQUE."""
+    if _columns(conn, 'orders'):
+        # popularity / top sellers: GROUP BY product_id and joins to goods read only the index
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_product ON orders (product_id)')
+        # "my orders": WHERE user_id = ? ORDER BY created_at DESC
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)')
+        # admin order list: ORDER BY created_at DESC
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)')
+    if _columns(conn, 'cart'):
+        # one row per (user, product): merge duplicates left by concurrent adds first
+        conn.execute('''
+            UPDATE cart SET quantity = (
+                SELECT SUM(COALESCE(c.quantity, 1)) FROM cart c
+                WHERE c.user_id = cart.user_id AND c.product_id = cart.product_id)
+            WHERE id IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id HAVING COUNT(*) > 1)
+        ''')
+        conn.execute('DELETE FROM cart WHERE id NOT IN (SELECT MIN(id) FROM cart GROUP BY user_id, product_id)')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_user_product ON cart (user_id, product_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_cart_product ON cart (product_id)')
+    if _columns(conn, 'denormalized_data'):
+        conn.execute(DENORMALIZED_INDEX)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, 'manufacturers', _manufacturers),
+    (2, 'goods_fitment', _goods_fitment),
+    (3, 'goods_fts', _goods_fts),
+    (4, 'change_counters', _change_counters),
+    (5, 'orders_user_columns', _orders_columns),
+    (6, 'hot_path_indexes', _hot_path_indexes),
+]
+
+
+def _ensure_table(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    _ensure_table(conn)
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations').fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> List[str]:
+    """Применить недостающие миграции; вернуть имена применённых (незавершённые изменения вызывающего
+    должны быть зафиксированы до вызова)."""
+    _ensure_table(conn)
+    done = {r[0] for r in conn.execute('SELECT version FROM schema_migrations')}
+    applied = []
+    for version, name, apply in MIGRATIONS:
+        if version in done:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,)).fetchone():
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(name)
+    if applied:
+        conn.execute('ANALYZE')
+        conn.commit()
+    return applied
@@ -0,0 +1,136 @@
+"""
+Поиск почти-дубликатов товаров (MinHash + LSH).
+
+Клоны из scripts/expand_goods_to_1000.py и scripts/auto_populate.py
+(«… — sample N») и повторы из фидов поставщиков отличаются парой символов
+в названии. Текст товара (название, описание, категория, совместимость,
+производитель) разбивается на символьные n-граммы (шинглы); MinHash-подпись
+оценивает долю общих шинглов (Jaccard) двух товаров, а LSH по полосам
+подписи находит пары-кандидаты без сравнения всех со всеми. Пары с оценкой
+не ниже порога объединяются в кластеры (union-find).
+
+Представитель кластера — товар с наименьшей позицией (исходный, клоны
+добавляются позже); движок при запросе оставляет в выдаче только
+представителей и не рекомендует клоны самого товара.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+
+TEXT_FIELDS = ('name', 'description', 'category', 'compatibility', 'manufacturer')
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MASK = np.uint64(0xFFFFFFFF)
+_EMPTY = np.iinfo(np.uint32).max
+
+
+def product_text(row: Dict) -> str:
+    return ' '.join(str(row.get(k) or '') for k in TEXT_FIELDS)
+
+
+def shingle_matrix(texts: List[str], ngram: int = 5) -> sparse.csr_matrix:
+    """Бинарная матрица «товар x хэш шингла» (символьные n-граммы внутри слов)."""
+    vec = HashingVectorizer(analyzer='char_wb', ngram_range=(ngram, ngram), n_features=2 ** 30,
+                            alternate_sign=False, norm=None, binary=True)
+    return vec.transform(texts).tocsr()
+
+
+def signatures(shingles: sparse.csr_matrix, num_perm: int = 128, seed: int = 1,
+               chunk_rows: int = 20000) -> np.ndarray:
+    """MinHash-подписи (n x num_perm, uint32); у товаров без шинглов — все _EMPTY."""
+    rng = np.random.default_rng(seed)
+    # a, b < 2**32 and x < 2**32 keep a * x + b inside uint64
+    a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    n = shingles.shape[0]
+    sig = np.full((n, num_perm), _EMPTY, dtype=np.uint32)
+    for start in range(0, n, chunk_rows):
+        block = shingles[start:start + chunk_rows]
+        lengths = np.diff(block.indptr)
+        rows = np.flatnonzero(lengths)
+        if not len(rows):
+            continue
+        x = block.indices.astype(np.uint64)
+        # reduceat over starts of non-empty rows: each segment is exactly one row
+        starts = block.indptr[:-1][rows]
+        for j in range(num_perm):
+            h = ((a[j] * x + b[j]) % _PRIME) & _MASK
+            sig[start + rows, j] = np.minimum.reduceat(h, starts).astype(np.uint32)
+    return sig
+
+
+class DuplicateClusters:
+    """Кластеры почти-дубликатов по позициям движка."""
+
+    def __init__(self, cluster: np.ndarray):
+        # representative (smallest) position of each product's cluster
+        self.cluster = cluster
+        self.is_representative = cluster == np.arange(len(cluster))
+        sizes = np.bincount(cluster, minlength=len(cluster))
+        self.n_clusters = int((sizes > 1).sum())
+        self.n_duplicates = int(len(cluster) - self.is_representative.sum())
+        # positions grouped by cluster, for members()
+        self._order = np.argsort(cluster, kind='stable').astype(np.int32)
+        self._starts = np.searchsorted(cluster[self._order], np.arange(len(cluster) + 1))
+
+    def members(self, pos: int) -> np.ndarray:
+        """Все позиции кластера, в который входит `pos` (включая его самого)."""
+        c = self.cluster[pos]
+        return self._order[self._starts[c]:self._starts[c + 1]]
+
+    def nbytes(self) -> int:
+        return int(self.cluster.nbytes + self.is_representative.nbytes + self._order.nbytes + self._starts.nbytes)
+
+    def stats(self) -> Dict:
+        return {'clusters': self.n_clusters, 'collapsed_products': self.n_duplicates}
+
+
+def find_clusters(products: List[Dict], threshold: float = 0.8, num_perm: int = 128,
+                  bands: int = 32, ngram: int = 5) -> Optional[DuplicateClusters]:
+    """Кластеры товаров с оценкой Jaccard >= threshold; None — дубликатов нет."""
+    if len(products) < 2:
+        return None
+    sig = signatures(shingle_matrix([product_text(p) for p in products], ngram=ngram), num_perm=num_perm)
+    return clusters_from_signatures(sig, threshold, bands=bands)
+
+
+def clusters_from_signatures(sig: np.ndarray, threshold: float = 0.8, bands: int = 32) -> Optional[DuplicateClusters]:
+    """Кластеры по готовым MinHash-подписям (n x num_perm); `sig` может быть np.memmap —
+    подписи, посчитанные порциями при out-of-core сборке, читаются по полосам."""
+    n, num_perm = sig.shape
+    if n < 2:
+        return None
+    rows_per_band = num_perm // bands
+    has_text = sig[:, 0] != _EMPTY
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    candidates = np.flatnonzero(has_text)
+    for band in range(bands):
+        keys = np.ascontiguousarray(sig[candidates, band * rows_per_band:(band + 1) * rows_per_band])
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * rows_per_band))).ravel()
+        _, bucket = np.unique(keys, return_inverse=True)
+        order = np.argsort(bucket, kind='stable')
+        bounds = np.flatnonzero(np.diff(bucket[order])) + 1
+        for group in np.split(candidates[order], bounds):
+            if len(group) < 2:
+                continue
+            # verify against the bucket's first member; transitivity links the rest
+            first = group[0]
+            agree = (sig[group[1:]] == sig[first]).mean(axis=1)
+            for other in group[1:][agree >= threshold]:
+                ra, rb = find(int(first)), find(int(other))
+                if ra != rb:
+                    # the smaller position becomes the root: the cluster's representative
+                    parent[max(ra, rb)] = min(ra, rb)
+    cluster = np.fromiter((find(i) for i in range(n)), dtype=np.int64, count=n)
+    if (cluster == np.arange(n)).all():
+        return None
+    return DuplicateClusters(cluster)
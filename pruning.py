@@ -0,0 +1,104 @@
+"""
+Прореживание TF-IDF матрицы при сборке.
+
+Длинные описания и обогащение (пользователи, статусы заказов) дают строки
+matrix_text с сотнями ненулевых весов, а стоимость запроса и память растут
+с nnz. prune_rows оставляет в каждой строке не больше `top_terms` самых
+весомых терминов, отбрасывает веса ниже `min_weight` и заново нормирует
+строки (косинус остаётся косинусом). Самый весомый термин строки
+сохраняется всегда, чтобы товар не потерял текстовое сходство целиком.
+
+Матрицы out-of-core сборки (hashing_build.py) прореживаются порциями в
+файлы каталога сборки, а не в память.
+"""
+import os
+from typing import Dict
+
+import numpy as np
+from scipy import sparse
+
+import hashing_build
+
+
+def prune_rows(matrix: sparse.csr_matrix, top_terms: int = 0, min_weight: float = 0.0,
+               chunk_rows: int = 10000, path: str = None, name: str = 'pruned') -> sparse.csr_matrix:
+    """Новая CSR-матрица: top_terms / min_weight на строку, l2-нормировка (0 — ограничение выключено).
+
+    С `path` порции пишутся в файлы `<name>.*` этого каталога, результат открывается
+    через memmap (hashing_build.open_matrix); в памяти — только одна порция и indptr.
+    """
+    n_rows, n_cols = matrix.shape
+    data_parts, index_parts, row_nnz = [], [], []
+    if path is not None:
+        data_file = open(os.path.join(path, f'{name}.data'), 'wb')
+        indices_file = open(os.path.join(path, f'{name}.indices'), 'wb')
+    for start in range(0, n_rows, chunk_rows):
+        # slicing copies the block, so memmapped hashing-build matrices are read chunk by chunk
+        block = matrix[start:start + chunk_rows]
+        rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        # per row by weight descending; equal weights keep column order (indices are sorted)
+        order = np.lexsort((-block.data, rows))
+        rank = np.empty(block.nnz, dtype=np.int64)
+        rank[order] = np.arange(block.nnz) - block.indptr[rows[order]]
+        keep = np.ones(block.nnz, dtype=bool)
+        if top_terms > 0:
+            keep &= rank < top_terms
+        if min_weight > 0:
+            keep &= block.data >= min_weight
+        keep |= rank == 0
+        data = block.data[keep].astype(np.float64)
+        kept_rows = rows[keep]
+        norms = np.sqrt(np.bincount(kept_rows, weights=data * data, minlength=block.shape[0]))
+        norms[norms == 0] = 1.0
+        data /= norms[kept_rows]
+        indices = block.indices[keep].astype(np.int32)
+        row_nnz.append(np.bincount(kept_rows, minlength=block.shape[0]))
+        if path is not None:
+            data.astype(hashing_build.DATA_DTYPE).tofile(data_file)
+            indices.astype(hashing_build.INDEX_DTYPE).tofile(indices_file)
+            continue
+        data_parts.append(data)
+        index_parts.append(indices)
+    indptr = np.concatenate([[0]] + row_nnz).cumsum()
+    nnz = int(indptr[-1])
+    indptr = indptr.astype(np.int32 if nnz < np.iinfo(np.int32).max else np.int64)
+    if path is not None:
+        data_file.close()
+        indices_file.close()
+        np.save(os.path.join(path, f'{name}.indptr.npy'), indptr)
+        if nnz == 0:
+            return sparse.csr_matrix((n_rows, n_cols))
+        return hashing_build.open_matrix(path, name, (n_rows, n_cols))
+    if not data_parts:
+        return sparse.csr_matrix((n_rows, n_cols))
+    return sparse.csr_matrix((np.concatenate(data_parts), np.concatenate(index_parts), indptr),
+                             shape=(n_rows, n_cols))
+
+
+def overlap_report(engine, unpruned: sparse.csr_matrix, sample: int = 50, top_k: int = 5,
+                   seed: int = 0) -> Dict:
+    """Средняя доля совпадения top_k рекомендаций движка (прореженная matrix_text) с непрореженной.
+
+    Остальные компоненты скора одинаковы, поэтому непрореженный скор получается
+    из текущего добавлением w_text * (разница текстовых сходств).
+    """
+    n = len(engine.ids)
+    if n == 0 or sample <= 0:
+        return {'sample': 0, 'top_k': top_k, 'overlap': None}
+    rng = np.random.default_rng(seed)
+    positions = rng.choice(n, size=min(sample, n), replace=False)
+    w_text = engine.weights()['w_text']
+    pruned = engine.matrix_text
+    total = 0.0
+    for idx in positions:
+        idx = int(idx)
+        scores = engine._weighted_scores(idx)
+        diff = (unpruned[idx:idx + 1] @ unpruned.T).toarray().ravel() - (pruned[idx:idx + 1] @ pruned.T).toarray().ravel()
+        diff[idx] = 0.0
+        reference = engine._top_positions(scores + w_text * diff, None, top_k)
+        if not reference:
+            total += 1.0
+            continue
+        got = engine._top_positions(scores, None, top_k)
+        total += len(set(got) & set(reference)) / len(reference)
+    return {'sample': len(positions), 'top_k': top_k, 'overlap': round(total / len(positions), 4)}
@@ -0,0 +1,184 @@
+"""
+Запасные рекомендации без модели: хиты продаж по orders.
+
+Используются, когда движок не успел ответить в отведённое время, ещё
+строится, или товара нет в модели (добавлен после сборки). Списки
+считаются заранее одним запросом к SQLite и отдаются из памяти:
+
+  - хиты той же категории, что и товар;
+  - общие хиты магазина (добивают список, если в категории мало продаж).
+
+После новых заказов списки помечаются устаревшими и пересчитываются в
+фоне; до пересчёта отдаются прежние.
+"""
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import db_connection
+import fitment
+
+SOURCE_CATEGORY = 'category'
+SOURCE_GLOBAL = 'global'
+
+
+def _category_key(value) -> str:
+    return str(value or '').strip().lower()
+
+
+class TopSellers:
+    """Предпосчитанные хиты продаж: по категориям и по магазину."""
+
+    def __init__(self, db_path: str = 'data.db', per_category: int = 20, global_size: int = 50,
+                 max_age: float = 300.0):
+        self.db_path = db_path
+        self.per_category = per_category
+        self.global_size = global_size
+        # lists older than this are recomputed in the background even without new orders
+        self.max_age = max_age
+        self.loaded_at = None
+        self.served: Dict[str, int] = {}
+        # product pool (union of all lists), positions into it per category / globally
+        self._pool: List[Dict] = []
+        self._by_category: Dict[str, np.ndarray] = {}
+        self._global = np.zeros(0, dtype=np.int32)
+        self._fitment = None
+        # product id -> category key for every product in goods
+        self._category_of: Dict[int, str] = {}
+        self._stale = True
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def refresh(self):
+        """Пересчитать списки по goods и orders."""
+        conn = db_connection.connect(self.db_path)
+        try:
+            conn.row_factory = sqlite3.Row
+            cur = conn.cursor()
+            cur.execute('SELECT id, category FROM goods')
+            category_of = {r['id']: _category_key(r['category']) for r in cur.fetchall()}
+            cur.execute('''
+                SELECT g.id, g.name, g.price, g.image, g.category, g.compatibility, COUNT(*) AS sold
+                FROM orders o JOIN goods g ON g.id = o.product_id
+                GROUP BY g.id ORDER BY sold DESC, g.id
+            ''')
+            sellers = [dict(r) for r in cur.fetchall()]
+        except sqlite3.Error:
+            category_of, sellers = {}, []
+        finally:
+            conn.close()
+
+        pool: List[Dict] = []
+        pool_pos: Dict[int, int] = {}
+        lists: Dict[str, List[int]] = {}
+
+        def add(row) -> int:
+            if row['id'] not in pool_pos:
+                pool_pos[row['id']] = len(pool)
+                pool.append(row)
+            return pool_pos[row['id']]
+
+        top = sellers[0]['sold'] if sellers else 1
+        for row in sellers:
+            row['score'] = row['sold'] / top
+            posting = lists.setdefault(_category_key(row['category']), [])
+            if len(posting) < self.per_category:
+                posting.append(add(row))
+        global_list = [add(row) for row in sellers[:self.global_size]]
+
+        fit = fitment.FitmentIndex.from_compatibility([p.get('compatibility') for p in pool])
+        with self._lock:
+            self._pool = pool
+            self._by_category = {k: np.asarray(v, dtype=np.int32) for k, v in lists.items()}
+            self._global = np.asarray(global_list, dtype=np.int32)
+            self._fitment = fit
+            self._category_of = category_of
+            self.loaded_at = time.time()
+
+    def mark_stale(self):
+        """Списки устарели (новые заказы); пересчёт — при следующем обращении, в фоне."""
+        self._stale = True
+
+    def _ensure_fresh(self):
+        if self.loaded_at is None:
+            self._stale = False
+            self.refresh()
+            return
+        if not self._stale and time.time() - self.loaded_at < self.max_age:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stale = False
+            self._thread = threading.Thread(target=self._refresh_quietly, name='reco-top-sellers', daemon=True)
+            self._thread.start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception:
+            self._stale = True
+
+    def _category_for(self, product_id: int) -> Optional[str]:
+        category = self._category_of.get(product_id)
+        if category is not None:
+            return category
+        # added after the last refresh
+        try:
+            conn = db_connection.connect(self.db_path)
+            try:
+                row = conn.execute('SELECT category FROM goods WHERE id = ?', (product_id,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+        return _category_key(row[0]) if row else None
+
+    def recommend(self, product_id: int, top_k: int = 5, vehicle: str = None) -> Tuple[List[Dict], str]:
+        """(список в формате get_recommendations, источник: 'category' или 'global').
+
+        Сначала хиты категории товара, затем общие хиты; сам товар и
+        не подходящие автомобилю `vehicle` товары пропускаются.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            pool, global_list, fit = self._pool, self._global, self._fitment
+            by_category = self._by_category
+        category = self._category_for(product_id)
+        mask = fit.mask(vehicle) if fit is not None and vehicle else None
+        results: List[Dict] = []
+        seen = {product_id}
+        source = SOURCE_GLOBAL
+        for name, positions in ((SOURCE_CATEGORY, by_category.get(category) if category else None),
+                                (SOURCE_GLOBAL, global_list)):
+            if positions is None:
+                continue
+            for pos in positions:
+                if len(results) >= top_k:
+                    break
+                p = pool[pos]
+                if p['id'] in seen or (mask is not None and not mask[pos]):
+                    continue
+                seen.add(p['id'])
+                if not results:
+                    source = name
+                results.append({'id': p['id'], 'name': p['name'], 'price': p.get('price', ''),
+                                'image': p.get('image', ''), 'score': float(p['score'])})
+        return results, source
+
+    def observe(self, path: str):
+        """Учесть ответ, отданный путём `path` (для model-status)."""
+        with self._lock:
+            self.served[path] = self.served.get(path, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'loaded_at': self.loaded_at,
+                'categories': len(self._by_category),
+                'global': len(self._global),
+                'served': dict(self.served),
+            }
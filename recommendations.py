@@ -1,231 +1,1729 @@
+import copy
+import hashlib
+import queue
 import sqlite3
-from typing import List, Dict
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Optional, Set, Tuple
 from scipy.sparse import hstack
 import numpy as np
 import json
 import os
-import re
 
+import candidates
+import db_connection
+import engine_store
+import fitment
+import hashing_build
+import manufacturers
+import near_duplicates
+import pruning
+import reco_graph
+import scoring_backend
+from engine_metrics import EngineMetrics, nbytes, records_nbytes, timed_method
+from tokenization import TokenCache
 
-class RecommendationEngine:
-    def __init__(self, db_path: str = 'data.db'):
-        self.db_path = db_path
+
+def _config_flag(value) -> bool:
+    """true/false из reco_config.json (строка "false" — ошибка, а не True)."""
+    if isinstance(value, bool) or value in (0, 1):
+        return bool(value)
+    raise ValueError('expected true or false')
+
+
+def _config_path(value) -> Optional[str]:
+    if value is not None and not isinstance(value, str):
+        raise ValueError('expected a path string or null')
+    return value
+
+
+class _LRUCache:
+    """Потокобезопасный LRU-кэш фиксированного размера."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def items(self) -> List:
+        """Снимок содержимого, от давно использованных к недавним."""
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+class _ModelState:
+    """Модель одной сборки: товары и всё, что построено по их позициям.
+
+    Сборка заполняет новый объект и публикует его одним присваиванием под
+    блокировкой движка (RecommendationEngine._install). Запрос берёт ссылку
+    на состояние один раз и дальше читает только её, поэтому не смешивает
+    товары одной сборки с матрицами или индексами другой. Опубликованное
+    состояние не изменяется: правки (популярность, услуги, cat_scale) идут
+    через копию (replace) и публикуются так же.
+
+    Производные поля можно отложить (defer): они строятся один раз при первом
+    чтении — так загрузка снимка не ждёт индексов, которые нужны лишь запросам.
+    """
+    FIELDS = ('ids', 'products', '_positions', 'tfidf_text', 'tfidf_category', 'matrix_text', 'matrix_category',
+              'services', 'service_matrix_text', 'manufacturer_keys', 'manufacturer_aliases', 'manufacturer_ids',
+              'manufacturer_sim', 'fitment', 'candidates', 'duplicates', 'backend', 'backend_info',
+              'popularity', 'popularity_norm', 'query_cache', '_text_signatures', '_built_cat_scale',
+              '_duplicates_threshold')
+
+    def __init__(self):
         self.ids = []
         self.products = []
+        # product id -> position in ids / matrix rows
+        self._positions: Dict[int, int] = {}
         # vectorizers / matrices
         self.tfidf_text = None
         self.tfidf_category = None
-        self.tfidf_manufacturer = None
         self.matrix_text = None
         self.matrix_category = None
-        self.matrix_manufacturer = None
+        # services (installation, diagnostics, ...) in the same text feature space as goods
+        self.services: List[Dict] = []
+        self.service_matrix_text = None
+        # manufacturer similarity: per-product canonical id + dense id x id matrix
+        self.manufacturer_keys = []
+        self.manufacturer_aliases = {}
+        self.manufacturer_ids = None
+        self.manufacturer_sim = None
+        # vehicle -> products inverted index over goods.compatibility
+        self.fitment = None
+        # category / make / manufacturer -> products, narrows get_recommendations scoring
+        self.candidates = None
+        # near-duplicate clusters (near_duplicates.py), collapsed to one product per cluster in results
+        self.duplicates = None
+        # scoring strategy picked at build time (scoring_backend.py): None for 'sparse'
+        self.backend = None
+        self.backend_info: Dict = {}
+        # order counts per product position and counts / max
+        self.popularity = np.zeros(0)
+        self.popularity_norm = np.zeros(0)
+        # free-text query -> vector transformed by tfidf_text; belongs to this build's vocabulary
+        self.query_cache = _LRUCache(maxsize=1024)
+        # fingerprints of the fields the model is fitted on (see update_products)
+        self._text_signatures = None
+        # cat_scale the category / manufacturer matrices are scaled by
+        self._built_cat_scale = None
+        # duplicate_threshold the clusters were built with (None: not built)
+        self._duplicates_threshold = None
+        # deferred field -> (build(state) filling it, lock shared by the fields of one build)
+        self._deferred: Dict[str, tuple] = {}
+
+    def defer(self, build: Callable[['_ModelState'], None], *names: str):
+        """Построить поля `names` вызовом build(state) при первом чтении любого из них."""
+        lock = threading.Lock()
+        deferred = dict(self._deferred)
+        for name in names:
+            self.__dict__.pop(name, None)
+            deferred[name] = (build, lock)
+        # copies made by replace() share the old dict; never change it in place
+        self._deferred = deferred
+
+    def is_deferred(self, name: str) -> bool:
+        """Поле отложено и ещё не построено."""
+        return name in self._deferred and name not in self.__dict__
+
+    def __getattr__(self, name):
+        # only called for attributes missing from __dict__: deferred fields not built yet
+        entry = self.__dict__.get('_deferred', {}).get(name)
+        if entry is None:
+            raise AttributeError(name)
+        build, lock = entry
+        with lock:
+            if name not in self.__dict__:
+                build(self)
+        return self.__dict__[name]
+
+    def replace(self, **changes) -> '_ModelState':
+        """Копия состояния с заменёнными полями (матрицы и индексы общие)."""
+        state = copy.copy(self)
+        for name, value in changes.items():
+            setattr(state, name, value)
+        return state
+
+
+class RecommendationEngine:
+    # TfidfVectorizer settings of the two fitted text components
+    TEXT_VECTORIZER = {'stop_words': None, 'max_features': 5000}
+    CATEGORY_VECTORIZER = {'stop_words': None, 'max_features': 300}
+    # per-request weights of a scoring profile; the top-level config weights are profile 'default'
+    WEIGHT_KEYS = ('w_text', 'w_category', 'w_manufacturer', 'w_popularity')
+    DEFAULT_PROFILE = 'default'
+    # products per denormalized_data enrichment query (bound parameters of one IN list)
+    ENRICHMENT_BATCH = 500
+    # goods rows per fetch when update_products compares them with the model
+    SIGNATURE_CHUNK = 2000
+    # product columns kept in memory by the out-of-core build: results, filters and indexes (no description)
+    HASHED_ROW_COLUMNS = ('id', 'name', 'category', 'compatibility', 'manufacturer', 'manufacturer_id', 'price', 'image')
+    # fields the model is fitted on; a change in any of them means a rebuild (see update_products)
+    SIGNATURE_FIELDS = ('name', 'description', 'category', 'compatibility', 'manufacturer', 'manufacturer_id')
+    # reco_config.json keys, each read into the attribute of the same name by its parser
+    CONFIG_KEYS = (
+        ('w_text', float), ('w_popularity', float), ('w_category', float), ('w_manufacturer', float),
+        # scaling factor for category/manufacturer vectors
+        ('cat_scale', float),
+        ('use_candidates', _config_flag), ('candidate_min', int), ('candidate_backfill', int),
+        ('graph_k', int), ('graph_co_weight', float), ('graph_damping', float), ('graph_max_iter', int),
+        ('graph_tol', float),
+        ('build_mode', str), ('hashing_features', int), ('hashing_category_features', int),
+        ('hashing_chunk_size', int), ('hashing_dir', _config_path),
+        ('scoring_backend', str), ('dense_budget_mb', float), ('ann_min_products', int), ('ann_nprobe', int),
+        ('prune_top_terms', int), ('prune_min_weight', float), ('prune_sample', int),
+        ('collapse_duplicates', _config_flag), ('duplicate_threshold', float),
+        ('warmup_top_n', int), ('prefetch_neighbors', _config_flag),
+    )
+    # names the first config versions used for the same settings
+    CONFIG_LEGACY_KEYS = {'w_text': 'alpha', 'w_popularity': 'beta', 'cat_scale': 'cat_weight'}
+    # entity types of related(): goods rows (ids / matrix_text) and services rows (service_matrix_text)
+    ENTITY_GOODS = 'goods'
+    ENTITY_SERVICE = 'service'
+
+    def __init__(self, db_path: str = 'data.db', build: bool = True):
+        self.db_path = db_path
+        # published model (see _ModelState); engine.ids, engine.matrix_text, ... read its fields
+        self._state = _ModelState()
+        self.popularity_updated_at = None
+        # background popularity refresh requested by checkouts (see schedule_popularity_refresh)
+        self._popularity_guard = threading.Lock()
+        self._popularity_dirty = False
+        self._popularity_thread = None
+        # cache warm-up after every build: top warmup_top_n products by orders, every profile in
+        # profile_split (see schedule_warmup); progress is reported in status()
+        self.warmup_top_n = 200
+        self.warmup: Dict = {'state': 'idle'}
+        self._warmup_guard = threading.Lock()
+        self._warmup_pending = False
+        self._warmup_thread = None
+        # neighbor prefetch: products shown in a freshly computed list get their own lists
+        # computed in the background (users click through recommendation rows)
+        self.prefetch_neighbors = True
+        self._prefetch_queue = queue.Queue(maxsize=1024)
+        self._prefetch_guard = threading.Lock()
+        self._prefetch_thread = None
+        self.prefetch_stats = {'queued': 0, 'computed': 0, 'dropped': 0}
+        # get_recommendations results as (popularity version, list); after a rebuild only entries
+        # whose lists changed are replaced, after a popularity refresh entries are rescored on read
+        self.result_cache = _LRUCache(maxsize=4096)
+        self._result_generation = 0
+        self._popularity_version = 0
+        self.popularity_rescored = {'rescored': 0, 'changed': 0}
+        self._tracking_depth = 0
+        # last rebuild's delta and callbacks receiving the changed product ids (external caches, CDN)
+        self.last_result_delta: Dict = {}
+        self.result_listeners: List[Callable[[Set[int]], None]] = []
+        # multi-hop graph (reco_graph.py): built in the background once first requested, then again
+        # after every model or orders change; queries read the last published (state, graph) pair
+        # meanwhile. The similarity part is reused while its matrices, weights and graph_k are the same
+        self._graph_published = None
+        self._graph_similarity = None
+        self._graph_guard = threading.Lock()
+        self._graph_wanted = False
+        self._graph_dirty = False
+        self._graph_thread = None
+        # seed position -> (graph, ranking); entries of an older graph are ignored
+        self.graph_cache = _LRUCache(maxsize=2048)
+        # document tokens by content hash, kept across rebuilds so refits only re-tokenize changed products
+        self.token_caches = {'text': TokenCache(**self.TEXT_VECTORIZER),
+                             'category': TokenCache(**self.CATEGORY_VECTORIZER)}
+        # serializes rebuilds coming from admin requests and the background watcher, and state swaps
+        self._lock = threading.RLock()
+        # build-phase timings and query latency histograms
+        self.metrics = EngineMetrics()
         # default weights (four components: text, category, manufacturer, popularity)
         self.w_text = 0.6
         self.w_category = 0.2
         self.w_manufacturer = 0.1
         self.w_popularity = 0.1
+        # named weight variants over the same matrices: name -> {w_text, w_category, ...}
+        self.profiles: Dict[str, Dict[str, float]] = {}
+        # profiles users are spread across by hash of user id (see profile_for)
+        self.profile_split: List[str] = []
         # scaling for categorical sparse matrices
         self.cat_scale = 1.0
+        # candidate generation: smaller candidate sets fall back to scoring every product
+        self.use_candidates = True
+        self.candidate_min = 50
+        self.candidate_backfill = 20
+        # multi-hop graph: neighbors per node, restart probability 1 - damping, power-iteration bounds
+        self.graph_k = 10
+        self.graph_co_weight = 1.0
+        self.graph_damping = 0.85
+        self.graph_max_iter = 60
+        self.graph_tol = 1e-4
+        # 'tfidf' (in-memory TfidfVectorizer) or 'hashing' (out-of-core, see hashing_build.py)
+        self.build_mode = 'tfidf'
+        self.hashing_features = 2 ** 18
+        self.hashing_category_features = 2 ** 12
+        self.hashing_chunk_size = 2000
+        # matrix files of the hashing build; default: "<db_path>.reco/" next to the database
+        self.hashing_dir = None
+        # 'auto' (by catalog size, nnz and free memory), 'dense', 'sparse' or 'ann'
+        self.scoring_backend = 'auto'
+        self.dense_budget_mb = 256
+        self.ann_min_products = 200000
+        self.ann_nprobe = 8
+        # matrix_text pruning: at most prune_top_terms terms per product, weights below
+        # prune_min_weight dropped (0 — off); the last build's nnz / overlap report
+        self.prune_top_terms = 0
+        self.prune_min_weight = 0.0
+        self.prune_sample = 50
+        self.pruning: Dict = {}
+        # MinHash near-duplicates: estimated Jaccard at or above the threshold means "same product"
+        self.collapse_duplicates = True
+        self.duplicate_threshold = 0.8
         self._load_weights()
-        self._build()
+        if build:
+            self._build()
 
     def _load_weights(self):
+        """Прочитать reco_config.json: каждый ключ разбирается отдельно, некорректное значение
+        печатается и не меняет текущее."""
+        cfg_path = os.path.join(os.path.dirname(__file__), 'reco_config.json')
+        if not os.path.exists(cfg_path):
+            return
         try:
-            cfg_path = os.path.join(os.path.dirname(__file__), 'reco_config.json')
-            if os.path.exists(cfg_path):
-                with open(cfg_path, 'r', encoding='utf-8') as f:
-                    cfg = json.load(f)
-                    # new explicit weights
-                    self.w_text = float(cfg.get('w_text', cfg.get('alpha', self.w_text)))
-                    self.w_popularity = float(cfg.get('w_popularity', cfg.get('beta', self.w_popularity)))
-                    self.w_category = float(cfg.get('w_category', self.w_category))
-                    self.w_manufacturer = float(cfg.get('w_manufacturer', self.w_manufacturer))
-                    # scaling factor for category/manufacturer vectors
-                    self.cat_scale = float(cfg.get('cat_scale', cfg.get('cat_weight', 1.0)))
-        except Exception:
-            pass
+            with open(cfg_path, 'r', encoding='utf-8') as f:
+                cfg = json.load(f)
+            if not isinstance(cfg, dict):
+                raise ValueError('expected a JSON object')
+        except (OSError, ValueError) as e:
+            print(f'reco_config.json не прочитан ({e}), настройки движка не изменены')
+            return
+        for key, parse in self.CONFIG_KEYS:
+            # former key names are read when the current one is missing
+            name = key if key in cfg else self.CONFIG_LEGACY_KEYS.get(key)
+            if name not in cfg:
+                continue
+            try:
+                setattr(self, key, parse(cfg[name]))
+            except (TypeError, ValueError) as e:
+                print(f'reco_config.json: {name}={cfg[name]!r} пропущен ({e}), оставлено {getattr(self, key)!r}')
+        # "profiles": {"name": {"w_text": ...}}; missing weights come from the default profile
+        profiles = {}
+        for name, weights in (cfg.get('profiles') or {}).items():
+            if name == self.DEFAULT_PROFILE:
+                continue
+            try:
+                profiles[name] = {k: float(weights.get(k, getattr(self, k))) for k in self.WEIGHT_KEYS}
+            except (AttributeError, TypeError, ValueError) as e:
+                print(f'reco_config.json: профиль {name!r} пропущен ({e})')
+        self.profiles = profiles
+        split = cfg.get('profile_split')
+        if split is None:
+            split = [self.DEFAULT_PROFILE] + sorted(profiles)
+        elif not isinstance(split, list):
+            print(f'reco_config.json: profile_split={split!r} пропущен (ожидается список профилей)')
+            split = [self.DEFAULT_PROFILE] + sorted(profiles)
+        self.profile_split = [name for name in split if name == self.DEFAULT_PROFILE or name in profiles]
+
+    def weights(self, profile: str = None) -> Dict[str, float]:
+        """Веса профиля `profile`; неизвестный профиль или None — веса по умолчанию."""
+        weights = self.profiles.get(profile) if profile else None
+        if weights is None:
+            return {k: getattr(self, k) for k in self.WEIGHT_KEYS}
+        return weights
+
+    def profile_for(self, profile: str = None, user_id=None) -> str:
+        """Имя профиля для запроса: явно заданный, иначе по хэшу id пользователя.
+
+        Хэш детерминирован (не зависит от процесса), поэтому пользователь всегда
+        попадает в один и тот же профиль из profile_split.
+        """
+        if profile and (profile == self.DEFAULT_PROFILE or profile in self.profiles):
+            return profile
+        if user_id is not None and len(self.profile_split) > 1:
+            digest = hashlib.md5(str(user_id).encode('utf-8')).digest()
+            return self.profile_split[int.from_bytes(digest[:4], 'big') % len(self.profile_split)]
+        return self.DEFAULT_PROFILE
+
+    def profiles_summary(self) -> Dict[str, Dict[str, float]]:
+        return {self.DEFAULT_PROFILE: self.weights(), **self.profiles}
 
     def _connect(self):
-        conn = sqlite3.connect(self.db_path)
+        conn = db_connection.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         return conn
 
+    @staticmethod
+    def _products_query(conn) -> str:
+        """SELECT товаров модели; с справочником производителей — и канонический ключ по goods.manufacturer_id."""
+        columns = 'g.id, g.name, g.description, g.category, g.compatibility, g.manufacturer, g.price, g.image'
+        goods = {r[1] for r in conn.execute("PRAGMA table_info('goods')")}
+        if 'manufacturer_id' not in goods or not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'manufacturers'").fetchone():
+            return f'SELECT {columns} FROM goods g'
+        return (f'SELECT {columns}, g.manufacturer_id, m.name AS manufacturer_key '
+                f'FROM goods g LEFT JOIN manufacturers m ON m.id = g.manufacturer_id')
+
+    @staticmethod
+    def _manufacturer_key(row: Dict, aliases: Dict[str, str], key_cache: Dict[str, str]) -> str:
+        """Канонический ключ производителя товара: по goods.manufacturer_id, а если он не проставлен
+        (нет справочника, новое написание) — нормализацией написания, один раз на написание."""
+        key = row.pop('manufacturer_key', None)
+        if key:
+            return key
+        raw = row.get('manufacturer', '')
+        if raw not in key_cache:
+            key_cache[raw] = manufacturers.canonical_key(raw, aliases)
+        return key_cache[raw]
+
     def _fetch_products(self):
         conn = self._connect()
         cur = conn.cursor()
-        cur.execute('SELECT id, name, description, category, compatibility, manufacturer, price, image FROM goods')
+        cur.execute(self._products_query(conn))
         rows = [dict(r) for r in cur.fetchall()]
         conn.close()
         return rows
 
+    def _product_chunks(self, conn, size: int):
+        """Товары модели порциями по `size` строк из одного курсора (вся goods в память не читается)."""
+        cur = conn.cursor()
+        cur.execute(self._products_query(conn))
+        while True:
+            chunk = [dict(r) for r in cur.fetchmany(size)]
+            if not chunk:
+                return
+            yield chunk
+
+    def _fetch_services(self) -> List[Dict]:
+        try:
+            conn = self._connect()
+            try:
+                cur = conn.cursor()
+                cur.execute('SELECT id, name, address, phone, services, description FROM services')
+                return [dict(r) for r in cur.fetchall()]
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            # older databases have no services table
+            return []
+
+    @staticmethod
+    def _service_text(row) -> str:
+        return ' '.join(str(row.get(k) or '') for k in ('name', 'services', 'description'))
+
+    @staticmethod
+    def _set_services(state: _ModelState, services: List[Dict], matrix):
+        state.services = services
+        state.service_matrix_text = matrix if services else None
+
+    def refresh_services(self):
+        """Перечитать services и перевести их в признаковое пространство текущей модели (без переобучения)."""
+        with self._lock:
+            state = self._state.replace()
+            self._load_services(state)
+            self._install(state)
+
+    def _load_services(self, state: _ModelState):
+        services = self._fetch_services()
+        matrix = None
+        if services and state.tfidf_text is not None:
+            matrix = state.tfidf_text.transform([self._service_text(r) for r in services])
+        self._set_services(state, services, matrix)
+
+    def _defer(self, state: _ModelState, build: Callable[[_ModelState], None], *names: str):
+        """Отложить поля `names` состояния до первого чтения; время постройки — в maintenance."""
+        def run(st: _ModelState):
+            with self.metrics.timed_maintenance(f'index_{names[0]}'):
+                build(st)
+        state.defer(run, *names)
+
+    def _reset_empty(self):
+        state = _ModelState()
+        state._text_signatures = []
+        self._install(state)
+        self.metrics.finish_build()
+
+    def _install(self, state: _ModelState):
+        """Опубликовать состояние модели: одно присваивание, запросы видят старое или новое целиком."""
+        with self._lock:
+            self._state = state
+
+    def model_state(self) -> _ModelState:
+        """Текущее состояние модели — согласованный снимок для серии чтений (не изменять)."""
+        return self._state
+
     def _build(self):
-        rows = self._fetch_products()
+        with self._tracking_results():
+            self._fit()
+        self._invalidate_graph()
+        self.schedule_warmup()
+
+    def _fit(self):
+        if self.build_mode == 'hashing':
+            self._build_hashed()
+            return
+        self.metrics.start_build()
+        with self.metrics.phase('fetch'):
+            rows = self._fetch_products()
         if not rows:
-            self.ids = []
-            self.products = []
-            self.matrix = None
+            self._reset_empty()
             return
 
-        self.ids = [r['id'] for r in rows]
-        self.products = rows
+        # built aside and published at the end (_finish_build); queries keep reading the old model
+        state = _ModelState()
+        state.ids = [r['id'] for r in rows]
+        state.products = rows
 
-        corpus = []
-        # separate categorical text for category/manufacturer/compatibility
-        cat_corpus = []
-        manuf_corpus = []
-        conn = self._connect()
-        def _normalize_manufacturer(name: str) -> str:
-            if not name:
-                return ''
-            s = str(name).lower()
-            # remove common company suffixes and punctuation
-            s = re.sub(r"\b(llc|ltd|inc|corp|corporation|gmbh|srl|oy|sa|limited)\b", "", s)
-            s = re.sub(r"[^a-z0-9а-яё\s]", " ", s)
-            s = re.sub(r"\s+", " ", s).strip()
-            return s
-
-        for r in rows:
-            parts = [str(r.get('name', '')), str(r.get('description', '')),
-                     str(r.get('category', '')), str(r.get('compatibility', '')),
-                     str(r.get('manufacturer', ''))]
-
-            # Enrich corpus with denormalized_data related to this product (user_login, order_status)
-            try:
-                cur = conn.cursor()
-                cur.execute('SELECT GROUP_CONCAT(DISTINCT user_login, " ") as users, GROUP_CONCAT(DISTINCT order_status, " ") as statuses FROM denormalized_data WHERE product_id = ?', (r['id'],))
-                extra = cur.fetchone()
-                if extra:
-                    users = extra['users'] or '' if isinstance(extra, dict) else (extra[0] or '')
-                    statuses = extra['statuses'] or '' if isinstance(extra, dict) else (extra[1] or '')
-                    parts.append(str(users))
-                    parts.append(str(statuses))
-            except Exception:
-                # denormalized_data might not exist yet
-                pass
+        with self.metrics.phase('enrichment'):
+            corpus = []
+            # separate categorical text for category/compatibility
+            cat_corpus = []
+            conn = self._connect()
+            # manufacturers are resolved through the canonical dictionary (see manufacturers.py)
+            aliases = manufacturers.load_aliases(conn)
+            state.manufacturer_aliases = aliases
+            key_cache = {}
+            manuf_index = {}
+            manuf_ids = []
 
-            corpus.append(' '.join(parts))
-            # build small categorical text blob (short, repeated)
-            # category + compatibility as word-level tokens
-            cat_parts = [str(r.get('category', '')), str(r.get('compatibility', ''))]
-            cat_corpus.append(' '.join(cat_parts).lower())
-            # normalize manufacturer for fuzzy matching (use char n-grams later)
-            mnorm = _normalize_manufacturer(r.get('manufacturer', ''))
-            # avoid treating empty manufacturer as identical across many products
-            if not mnorm:
-                mnorm = f'__no_manufacturer_{r.get("id")}'
-            manuf_corpus.append(mnorm)
-        conn.close()
+            # Enrich corpus with denormalized_data related to each product (user_login, order_status)
+            extras = self._enrichment(conn, [r['id'] for r in rows])
+
+            for r in rows:
+                parts = [str(r.get('name', '')), str(r.get('description', '')),
+                         str(r.get('category', '')), str(r.get('compatibility', '')),
+                         str(r.get('manufacturer', ''))]
+                parts.extend(extras.get(r['id'], ()))
+
+                corpus.append(' '.join(parts))
+                # build small categorical text blob (short, repeated)
+                # category + compatibility as word-level tokens
+                cat_parts = [str(r.get('category', '')), str(r.get('compatibility', ''))]
+                cat_corpus.append(' '.join(cat_parts).lower())
+                # map manufacturer to a canonical id (goods.manufacturer_id when it is set)
+                key = self._manufacturer_key(r, aliases, key_cache)
+                # empty manufacturer gets no id so it never matches other products
+                manuf_ids.append(manuf_index.setdefault(key, len(manuf_index)) if key else -1)
+            conn.close()
+
+        # services are fitted together with goods: one vocabulary / idf for both entity types
+        services = self._fetch_services()
+        service_docs = [self._service_text(r) for r in services]
 
         # Vectorize main textual corpus
-        self.tfidf_text = TfidfVectorizer(stop_words=None, max_features=5000)
-        matrix_text = self.tfidf_text.fit_transform(corpus)
-        self.matrix_text = matrix_text
-
-        # Vectorize category (category + compatibility) and manufacturer separately
-        self.tfidf_category = TfidfVectorizer(stop_words=None, max_features=300)
-        matrix_category = self.tfidf_category.fit_transform(cat_corpus)
-        # manufacturer: use character n-grams to allow partial/fuzzy matches between similar names
-        self.tfidf_manufacturer = TfidfVectorizer(analyzer='char_wb', ngram_range=(3,6), lowercase=True, max_features=200)
-        matrix_manufacturer = self.tfidf_manufacturer.fit_transform(manuf_corpus)
-
-        # scale categorical matrices by configured factor
+        with self.metrics.phase('fit_text'):
+            state.tfidf_text, matrix_text = self.token_caches['text'].fit_tfidf(corpus + service_docs)
+        service_matrix = None
+        if service_docs:
+            matrix_text, service_matrix = matrix_text[:len(corpus)], matrix_text[len(corpus):]
+        state.matrix_text = matrix_text
+        self._set_services(state, services, service_matrix)
+
+        # Vectorize category (category + compatibility) separately
+        with self.metrics.phase('fit_category'):
+            state.tfidf_category, matrix_category = self.token_caches['category'].fit_tfidf(cat_corpus)
+
+        # scale categorical matrix by configured factor
         try:
             matrix_category = matrix_category.multiply(self.cat_scale)
-            matrix_manufacturer = matrix_manufacturer.multiply(self.cat_scale)
         except Exception:
             pass
+        state.matrix_category = matrix_category
+        self._finish_build(state, manuf_index, manuf_ids)
+
+    def _build_hashed(self):
+        """Out-of-core сборка: товары читаются порциями из курсора, матрицы пишутся на диск.
+
+        Корпус целиком в памяти не собирается; словаря нет (хэширование токенов),
+        idf считается по накопленной документной частоте (см. hashing_build.py).
+        В памяти остаются только HASHED_ROW_COLUMNS товаров; MinHash-подписи
+        почти-дубликатов и прореженная matrix_text тоже пишутся в каталог сборки.
+        """
+        self.metrics.start_build()
+        root = self.hashing_dir or os.path.abspath(self.db_path) + '.reco'
+        out = hashing_build.new_generation(root)
+        text_vec = hashing_build.HashedTfidf(self.hashing_features)
+        cat_vec = hashing_build.HashedTfidf(self.hashing_category_features)
+        text_writer = hashing_build.CSRWriter(out, 'text', text_vec.n_features)
+        cat_writer = hashing_build.CSRWriter(out, 'category', cat_vec.n_features)
+
+        state = _ModelState()
+        rows = []
+        signatures = []
+        threshold = self._wanted_duplicates_threshold()
+        minhash_path = os.path.join(out, 'minhash.u32')
+        minhash_file = open(minhash_path, 'wb') if threshold is not None else None
+        conn = self._connect()
+        aliases = manufacturers.load_aliases(conn)
+        state.manufacturer_aliases = aliases
+        key_cache = {}
+        manuf_index = {}
+        manuf_ids = []
+        with self.metrics.phase('stream'):
+            for chunk in self._product_chunks(conn, self.hashing_chunk_size):
+                extras = self._enrichment(conn, [r['id'] for r in chunk])
+                docs = []
+                cat_docs = []
+                for r in chunk:
+                    parts = [str(r.get('name', '')), str(r.get('description', '')),
+                             str(r.get('category', '')), str(r.get('compatibility', '')),
+                             str(r.get('manufacturer', ''))]
+                    parts.extend(extras.get(r['id'], ()))
+                    docs.append(' '.join(parts))
+                    cat_docs.append(' '.join([str(r.get('category', '')), str(r.get('compatibility', ''))]).lower())
+                    key = self._manufacturer_key(r, aliases, key_cache)
+                    manuf_ids.append(manuf_index.setdefault(key, len(manuf_index)) if key else -1)
+                    signatures.append(self._text_signature(r))
+                text_writer.append(text_vec.counts(docs))
+                cat_writer.append(cat_vec.counts(cat_docs))
+                if minhash_file is not None:
+                    near_duplicates.signatures(near_duplicates.shingle_matrix(
+                        [near_duplicates.product_text(r) for r in chunk])).tofile(minhash_file)
+                rows.extend({k: r[k] for k in self.HASHED_ROW_COLUMNS if k in r} for r in chunk)
+        conn.close()
+        if minhash_file is not None:
+            minhash_file.close()
+        if not rows:
+            self._reset_empty()
+            hashing_build.remove_generations(root, keep=[])
+            return
+
+        state._text_signatures = signatures
+        if threshold is not None:
+            with self.metrics.phase('duplicates'):
+                sig = np.memmap(minhash_path, dtype=np.uint32, mode='r').reshape(len(rows), -1)
+                state.duplicates = near_duplicates.clusters_from_signatures(sig, threshold)
+                del sig
+            os.remove(minhash_path)
+        state._duplicates_threshold = threshold
+
+        with self.metrics.phase('idf'):
+            matrix_text, text_vec.idf_ = text_writer.finish()
+            matrix_category, cat_vec.idf_ = cat_writer.finish(scale=self.cat_scale)
+        state.ids = [r['id'] for r in rows]
+        state.products = rows
+        state.tfidf_text, state.matrix_text = text_vec, matrix_text
+        state.tfidf_category, state.matrix_category = cat_vec, matrix_category
+        # same hashed feature space; idf comes from goods only
+        services = self._fetch_services()
+        self._set_services(state, services,
+                           text_vec.transform([self._service_text(r) for r in services]) if services else None)
+        self._finish_build(state, manuf_index, manuf_ids, out=out)
+        # files of older builds; memmaps still held by in-flight queries stay readable
+        hashing_build.remove_generations(root, keep=[out])
+
+    @classmethod
+    def _enrichment(cls, conn, product_ids: List[int]) -> Dict[int, tuple]:
+        """(users, statuses) из denormalized_data для товаров `product_ids`, запросом на каждые ENRICHMENT_BATCH id."""
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'denormalized_data'").fetchone():
+            # denormalized_data might not exist yet
+            return {}
+        extras = {}
+        cur = conn.cursor()
+        for start in range(0, len(product_ids), cls.ENRICHMENT_BATCH):
+            batch = product_ids[start:start + cls.ENRICHMENT_BATCH]
+            # DISTINCT aggregates take one argument: default ',' separator, a token boundary for the vectorizers
+            cur.execute(f'SELECT product_id, GROUP_CONCAT(DISTINCT user_login), GROUP_CONCAT(DISTINCT order_status) '
+                        f'FROM denormalized_data WHERE product_id IN ({",".join("?" * len(batch))}) GROUP BY product_id',
+                        batch)
+            extras.update((r[0], (str(r[1] or ''), str(r[2] or ''))) for r in cur.fetchall())
+        return extras
+
+    def _finish_build(self, state: _ModelState, manuf_index: Dict[str, int], manuf_ids: List[int],
+                      out: str = None):
+        # out: directory of an out-of-core build, the pruned matrix is written there
+        unpruned = self._prune_text(state, out)
+        # manufacturer: small dense M x M similarity between canonical names;
+        # missing manufacturer (-1) maps to the trailing all-zero slot
+        state.manufacturer_keys = list(manuf_index)
+        ids_arr = np.asarray(manuf_ids, dtype=np.int32)
+        ids_arr[ids_arr < 0] = len(state.manufacturer_keys)
+        state.manufacturer_ids = ids_arr
+        # cat_scale applied on both sides, same as the former scaled sparse vectors
+        with self.metrics.phase('fit_manufacturer'):
+            state.manufacturer_sim = manufacturers.similarity_matrix(state.manufacturer_keys) * (self.cat_scale ** 2)
+
+        self._index_products(state)
+        state._built_cat_scale = self.cat_scale
+        self._setup_backend(state)
+
+        with self.metrics.phase('popularity'):
+            self._load_popularity(state)
+        self._install(state)
+        if unpruned is not None:
+            with self.metrics.phase('prune_report'):
+                self.pruning.update(pruning.overlap_report(self, unpruned, sample=self.prune_sample))
+        self.metrics.finish_build()
+
+    def _prune_text(self, state: _ModelState, out: str = None):
+        """Проредить matrix_text (см. pruning.py) — в память или, с `out`, в файлы каталога сборки;
+        вернуть исходную матрицу или None, если прореживание выключено."""
+        nnz = state.matrix_text.nnz if state.matrix_text is not None else 0
+        if state.matrix_text is None or (self.prune_top_terms <= 0 and self.prune_min_weight <= 0):
+            self.pruning = {'enabled': False, 'nnz': nnz}
+            return None
+        unpruned = state.matrix_text
+        with self.metrics.phase('prune'):
+            state.matrix_text = pruning.prune_rows(unpruned, self.prune_top_terms, self.prune_min_weight, path=out)
+        self.pruning = {
+            'enabled': True,
+            'top_terms': self.prune_top_terms,
+            'min_weight': self.prune_min_weight,
+            'nnz_before': nnz,
+            'nnz_after': state.matrix_text.nnz,
+            'ratio': round(state.matrix_text.nnz / nnz, 4) if nnz else 1.0,
+        }
+        return unpruned
+
+    def save(self, path: str) -> Dict:
+        """Сохранить обученный движок в каталог `path` (формат engine_store, без pickle)."""
+        with self._lock:
+            return engine_store.save(self, path)
+
+    @classmethod
+    def load(cls, path: str, db_path: str = 'data.db', validate: bool = True) -> 'RecommendationEngine':
+        """Загрузить движок из снимка без переобучения.
+
+        С `validate=True` снимок сверяется с текущей goods (при расхождении —
+        полная перестройка, см. update_products), а популярность перечитывается
+        из orders. Повреждённый или несовместимый снимок — engine_store.SnapshotError.
+        """
+        engine = cls(db_path, build=False)
+        engine.metrics.start_build()
+        state = _ModelState()
+        with engine.metrics.phase('load_snapshot'):
+            manifest = engine_store.load_into(state, path)
+            # a rebuild right after loading (goods changed since the snapshot) re-tokenizes only changed products
+            engine_store.load_tokens(engine.token_caches, path, manifest)
+        # indexes derived from the snapshot are built on first use (the warm-up below gets to them first)
+        engine._index_products(state, lazy=True)
+        engine._setup_backend(state, lazy=True)
+        engine._defer(state, engine._load_services, 'services', 'service_matrix_text')
+        engine._apply_popularity(state)
+        engine._install(state)
+        engine.metrics.finish_build()
+        # reco_config.json may have changed cat_scale since the snapshot was written
+        engine.reload_weights()
+        if validate:
+            if engine.update_products() != 'rebuild':
+                engine.refresh_popularity()
+        engine.schedule_warmup()
+        return engine
+
+    @classmethod
+    def load_or_build(cls, db_path: str = 'data.db', snapshot_dir: str = None) -> 'RecommendationEngine':
+        """Движок из снимка `snapshot_dir` (если он есть и цел), иначе обучение по БД.
+
+        Общая точка запуска для app.py, сервера engine_rpc.py и выгрузки user_recommendations.py.
+        """
+        if snapshot_dir and os.path.exists(os.path.join(snapshot_dir, engine_store.MANIFEST)):
+            try:
+                # the snapshot is checked against current goods and refitted if they differ
+                return cls.load(snapshot_dir, db_path)
+            except Exception as e:
+                print(f'Снимок движка не загружен ({e}), строим заново')
+        return cls(db_path)
+
+    def _index_products(self, state: _ModelState, lazy: bool = False):
+        """Индексы, выводимые из метаданных товаров: fitment, кандидаты, дубликаты, отпечатки полей.
+
+        `lazy=True` — fitment, кандидаты и (если их нет в снимке) дубликаты строятся при первом обращении.
+        """
+        state._positions = {product_id: i for i, product_id in enumerate(state.ids)}
+        if lazy:
+            self._defer(state, self._index_fitment, 'fitment')
+            self._defer(state, self._index_candidates, 'candidates')
+        else:
+            with self.metrics.phase('fitment'):
+                self._index_fitment(state)
+            with self.metrics.phase('candidates'):
+                self._index_candidates(state)
+        if state._duplicates_threshold != self._wanted_duplicates_threshold():
+            self._index_duplicates(state, lazy=lazy)
+        if state._text_signatures is None:
+            state._text_signatures = [self._text_signature(p) for p in state.products]
+
+    @staticmethod
+    def _index_fitment(state: _ModelState):
+        # "parts that fit my car": parsed once per distinct compatibility string
+        state.fitment = fitment.FitmentIndex.from_compatibility([p.get('compatibility') for p in state.products])
+
+    def _index_candidates(self, state: _ModelState):
+        index = candidates.CandidateIndex.from_products(
+            state.products, state.manufacturer_ids, missing_manufacturer=len(state.manufacturer_keys))
+        # deferred builds run after popularity is set (see _set_popularity); in a fresh build it is still empty
+        index.popular = candidates.top_popular(state.popularity, self.candidate_backfill)
+        state.candidates = index
+
+    def _wanted_duplicates_threshold(self) -> Optional[float]:
+        return self.duplicate_threshold if self.collapse_duplicates else None
+
+    def _index_duplicates(self, state: _ModelState, lazy: bool = False):
+        """Кластеры почти-дубликатов (только при включённом collapse_duplicates)."""
+        state._duplicates_threshold = self._wanted_duplicates_threshold()
+        if not self.collapse_duplicates:
+            state.duplicates = None
+            return
+        threshold = self.duplicate_threshold
+
+        def build(st: _ModelState):
+            st.duplicates = near_duplicates.find_clusters(st.products, threshold=threshold)
+
+        if lazy:
+            self._defer(state, build, 'duplicates')
+            return
+        with self.metrics.phase('duplicates'):
+            build(state)
+
+    def _setup_backend(self, state: _ModelState, lazy: bool = False):
+        """Выбрать и построить стратегию скоринга (см. scoring_backend.py) под матрицы состояния.
 
-        self.matrix_category = matrix_category
-        self.matrix_manufacturer = matrix_manufacturer
-        # load popularity from denormalized table if exists
+        `lazy=True` — при первом запросе (плотная матрица сходства или IVF-индекс строятся долго).
+        """
+        if lazy:
+            self._defer(state, self._build_backend, 'backend', 'backend_info')
+            return
+        with self.metrics.phase('backend'):
+            self._build_backend(state)
+
+    def _build_backend(self, state: _ModelState):
+        n = len(state.ids)
+        nnz = sum(m.nnz for m in (state.matrix_text, state.matrix_category) if m is not None)
+        memory = scoring_backend.available_memory()
+        name, reason = scoring_backend.choose(
+            n, nnz, self.scoring_backend, dense_budget=int(self.dense_budget_mb * (1 << 20)),
+            ann_min_products=self.ann_min_products, memory=memory,
+            allow_dense=not isinstance(state.tfidf_text, hashing_build.HashedTfidf))
+        backend = scoring_backend.build(name, state.matrix_text, state.matrix_category, nprobe=self.ann_nprobe)
+        state.backend = backend
+        state.backend_info = scoring_backend.describe(name, reason, n, nnz, backend, memory)
+
+    @classmethod
+    def _text_signature(cls, row) -> int:
+        # stable across processes (unlike hash()): signatures are stored in the snapshot
+        text = '\x1f'.join(str(row.get(k) or '') for k in cls.SIGNATURE_FIELDS)
+        return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+    def _popularity_counts(self) -> Dict[int, int]:
+        # load popularity from orders
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = db_connection.connect(self.db_path)
             cur = conn.cursor()
             cur.execute("SELECT product_id, COUNT(*) as cnt FROM orders GROUP BY product_id")
             counts = {r[0]: r[1] for r in cur.fetchall()}
             conn.close()
         except Exception:
             counts = {}
+        return counts
 
-        # attach popularity to products
-        for p in self.products:
-            p['popularity'] = counts.get(p['id'], 0)
+    def _load_popularity(self, state: _ModelState):
+        counts = self._popularity_counts()
+        self._set_popularity(state, self._popularity_state(np.array([float(counts.get(i, 0)) for i in state.ids])))
+
+    def _apply_popularity(self, state: _ModelState):
+        """Нормировка и backfill по уже известным state.popularity (например, из снимка)."""
+        self._set_popularity(state, self._popularity_state(np.asarray(state.popularity, dtype=float)))
+
+    def _popularity_state(self, popularity: np.ndarray):
+        """(counts, normalized counts, top positions for candidate backfill)."""
+        max_pop = popularity.max() if len(popularity) else 0
+        norm = popularity / max_pop if max_pop > 0 else np.zeros(len(popularity))
+        return popularity, norm, candidates.top_popular(popularity, self.candidate_backfill)
+
+    def _set_popularity(self, state: _ModelState, popularity_state):
+        state.popularity, state.popularity_norm, popular = popularity_state
+        self.popularity_updated_at = time.time()
+        if state.is_deferred('candidates'):
+            # the deferred build takes the backfill from state.popularity itself
+            return
+        if state.candidates is not None:
+            # postings are shared with the published state; only the backfill list differs
+            state.candidates = copy.copy(state.candidates)
+            state.candidates.popular = popular
 
     def refresh(self):
         """Перестроить векторную модель (например, после обновления БД)."""
-        self._build()
+        with self._lock:
+            self._build()
 
-    def get_recommendations(self, product_id: int, top_k: int = 5) -> List[Dict]:
-        """Вернуть список рекомендованных товаров (JSON-сериализуемый)."""
-        if product_id not in self.ids:
-            return []
+    def refresh_popularity(self) -> bool:
+        """Обновить только популярность (после новых заказов), без переобучения.
 
-        idx = self.ids.index(product_id)
+        Запрос к orders и расчёт нормировки выполняются без блокировки; под
+        блокировкой движка только публикуется копия состояния с новыми векторами.
+        Закэшированные списки не пересчитываются здесь: версия популярности
+        увеличивается, и запись пересчитывается при следующем чтении.
+        False — за это время движок перестроился (и уже прочитал свежую популярность).
+        """
+        start = time.perf_counter()
+        # a rebuild publishes a new ids list; metadata updates keep it
+        ids = self._state.ids
+        counts = self._popularity_counts()
+        popularity = self._popularity_state(np.array([float(counts.get(i, 0)) for i in ids]))
+        with self._lock:
+            swap_start = time.perf_counter()
+            current = self._state
+            swapped = current.ids is ids
+            if swapped:
+                state = current.replace()
+                self._set_popularity(state, popularity)
+                self._install(state)
+                # cached lists are rescored lazily, on their next read (_cached_recommendations)
+                self._popularity_version += 1
+            self.metrics.observe_maintenance('popularity_swap', (time.perf_counter() - swap_start) * 1000.0)
+        self.metrics.observe_maintenance('popularity_refresh', (time.perf_counter() - start) * 1000.0)
+        if swapped:
+            # co-purchase edges come from the same orders; the similarity part is reused
+            self._invalidate_graph()
+        return swapped
 
-        # compute per-component cosine similarities (text / category / manufacturer)
-        sims_text = np.zeros(len(self.ids))
-        sims_category = np.zeros(len(self.ids))
-        sims_manufacturer = np.zeros(len(self.ids))
-        try:
-            if self.matrix_text is not None:
-                sims_text = linear_kernel(self.matrix_text[idx:idx+1], self.matrix_text).flatten()
-        except Exception:
-            sims_text = np.zeros(len(self.ids))
+    def schedule_popularity_refresh(self):
+        """Обновить популярность в фоне (например, после оформления заказа).
+
+        Вызовы во время работающего обновления схлопываются в одно повторное.
+        """
+        with self._popularity_guard:
+            self._popularity_dirty = True
+            if self._popularity_thread is not None:
+                return
+            self._popularity_thread = threading.Thread(target=self._popularity_worker,
+                                                       name='reco-popularity', daemon=True)
+            self._popularity_thread.start()
+
+    def _popularity_worker(self):
+        while True:
+            with self._popularity_guard:
+                if not self._popularity_dirty:
+                    self._popularity_thread = None
+                    return
+                self._popularity_dirty = False
+            try:
+                self.refresh_popularity()
+            except Exception:
+                pass
+
+    def schedule_warmup(self):
+        """Заполнить result_cache для самых продаваемых товаров в фоне (после сборки/загрузки).
+
+        Новая сборка во время прогрева прерывает его и запускает заново.
+        """
+        if self.warmup_top_n <= 0:
+            return
+        with self._warmup_guard:
+            self._warmup_pending = True
+            if self._warmup_thread is not None:
+                return
+            self._warmup_thread = threading.Thread(target=self._warmup_worker, name='reco-warmup-cache', daemon=True)
+            self._warmup_thread.start()
+
+    def _warmup_worker(self):
+        while True:
+            with self._warmup_guard:
+                if not self._warmup_pending:
+                    self._warmup_thread = None
+                    return
+                self._warmup_pending = False
+            try:
+                self._warm_cache()
+            except Exception as e:
+                self.warmup = {**self.warmup, 'state': 'failed', 'error': str(e)}
+
+    def _warm_cache(self):
+        state = self._state
+        ids, popularity = state.ids, state.popularity
+        positions = candidates.top_popular(popularity, self.warmup_top_n) if len(popularity) == len(ids) else []
+        profiles = [None if name == self.DEFAULT_PROFILE else name for name in (self.profile_split or [self.DEFAULT_PROFILE])]
+        started = time.time()
+        self.warmup = {'state': 'running', 'top_n': self.warmup_top_n, 'total': len(positions) * len(profiles),
+                       'done': 0, 'computed': 0, 'started_at': started}
+        for pos in positions:
+            for profile in profiles:
+                if self._warmup_pending:
+                    # a newer build is waiting; the worker starts over with it
+                    self.warmup['state'] = 'restarting'
+                    return
+                # same key as the product page request (top_k=5, no vehicle)
+                _, computed = self._cached_recommendations((ids[int(pos)], 5, None, profile, True))
+                self.warmup['done'] += 1
+                self.warmup['computed'] += int(computed)
+        self.warmup.update(state='done', finished_at=time.time(), seconds=round(time.time() - started, 3))
+
+    def _enqueue_prefetch(self, key, results: List[Dict]):
+        _, top_k, vehicle, profile, use_candidates = key
+        for r in results:
+            try:
+                self._prefetch_queue.put_nowait((r['id'], top_k, vehicle, profile, use_candidates))
+                self.prefetch_stats['queued'] += 1
+            except queue.Full:
+                self.prefetch_stats['dropped'] += 1
+        with self._prefetch_guard:
+            if self._prefetch_thread is None:
+                self._prefetch_thread = threading.Thread(target=self._prefetch_worker, name='reco-prefetch', daemon=True)
+                self._prefetch_thread.start()
+
+    def _prefetch_worker(self):
+        while True:
+            try:
+                key = self._prefetch_queue.get(timeout=5.0)
+            except queue.Empty:
+                with self._prefetch_guard:
+                    if self._prefetch_queue.empty():
+                        self._prefetch_thread = None
+                        return
+                continue
+            try:
+                # no further prefetch from here: neighbors of neighbors are left to real views
+                _, computed = self._cached_recommendations(key)
+                self.prefetch_stats['computed'] += int(computed)
+            except Exception:
+                pass
+
+    def reload_weights(self):
+        """Перечитать reco_config.json без переобучения.
+
+        Веса применяются при каждом запросе; изменение cat_scale пересчитывается
+        масштабированием уже построенных матриц.
+        """
+        with self._lock, self._tracking_results():
+            self._load_weights()
+            state = self._state.replace()
+            changed = False
+            if state.ids and state._duplicates_threshold != self._wanted_duplicates_threshold():
+                if self.build_mode == 'hashing':
+                    # signatures are streamed from goods during the build; product rows have no description
+                    self._build()
+                    return
+                self._index_duplicates(state)
+                changed = True
+            old_scale = state._built_cat_scale if state._built_cat_scale is not None else self.cat_scale
+            if old_scale != self.cat_scale:
+                if old_scale == 0:
+                    # scaled-to-zero matrices cannot be rescaled back
+                    self._build()
+                    return
+                factor = self.cat_scale / old_scale
+                if state.matrix_category is not None:
+                    state.matrix_category = state.matrix_category.multiply(factor).tocsr()
+                if state.manufacturer_sim is not None:
+                    state.manufacturer_sim = state.manufacturer_sim * (factor ** 2)
+                state._built_cat_scale = self.cat_scale
+                self._setup_backend(state)
+                changed = True
+            if changed:
+                self._install(state)
+            # weights and graph settings may have changed
+            self._invalidate_graph()
+
+    def update_products(self) -> str:
+        """Подхватить изменения goods самым дешёвым способом.
 
+        Если набор товаров и их текстовые поля не изменились (например, поменялись
+        только цены или остатки), обновляются лишь метаданные товаров — 'metadata':
+        изменившиеся товары копируются, и копия состояния публикуется целиком.
+        Иначе выполняется полная перестройка — 'rebuild'.
+        """
+        with self._lock:
+            state = self._state
+            old_ids, old_sigs = state.ids, state._text_signatures
+            products = list(state.products)
+            changed = False
+            same = old_sigs is not None
+            n = 0
+            if same:
+                # rows are compared as they stream in; the first difference stops the scan
+                conn = self._connect()
+                try:
+                    for chunk in self._product_chunks(conn, self.SIGNATURE_CHUNK):
+                        for r in chunk:
+                            if n >= len(old_ids) or r['id'] != old_ids[n] or self._text_signature(r) != old_sigs[n]:
+                                same = False
+                                break
+                            meta = {k: r.get(k) for k in ('price', 'image')}
+                            if any(products[n].get(k) != v for k, v in meta.items()):
+                                # the published dicts are shared with in-flight queries and cached results
+                                products[n] = dict(products[n], **meta)
+                                changed = True
+                            n += 1
+                        if not same:
+                            break
+                finally:
+                    conn.close()
+            if not same or n != len(old_ids):
+                self._build()
+                return 'rebuild'
+            if changed:
+                with self._tracking_results():
+                    self._install(state.replace(products=products))
+            return 'metadata'
+
+    @contextmanager
+    def _tracking_results(self):
+        """Обернуть изменение модели: затем перепроверить закэшированные рекомендации.
+
+        Вложенные вызовы (reload_weights -> _build) перепроверяют кэш один раз, в конце.
+        """
+        self._tracking_depth += 1
+        outer = self._tracking_depth == 1
+        if outer:
+            before = self.result_cache.items()
+            old_ids = set(self.ids)
+            # results computed by in-flight queries against the old model are not cached
+            self._result_generation += 1
         try:
-            if self.matrix_category is not None:
-                sims_category = linear_kernel(self.matrix_category[idx:idx+1], self.matrix_category).flatten()
-        except Exception:
-            sims_category = np.zeros(len(self.ids))
+            yield
+        finally:
+            self._tracking_depth -= 1
+        if outer:
+            self._recheck_results(before, old_ids)
+
+    def _recheck_results(self, before, old_ids: Set[int]) -> Set[int]:
+        """Пересчитать закэшированные рекомендации после изменения модели.
+
+        Товары, у которых видимый список (id, название, цена, картинка) не
+        изменился, сохраняют запись кэша с обновлёнными скорами; остальные, а
+        также добавленные и удалённые товары, попадают в last_result_delta и
+        передаются result_listeners для точечной инвалидации внешних кэшей.
+        """
+        start = time.perf_counter()
+        self._result_generation += 1
+        new_ids = set(self.ids)
+        added = new_ids - old_ids
+        removed = old_ids - new_ids
+        changed = set()
+        version = self._popularity_version
+        for key, (_, old) in before:
+            product_id = key[0]
+            if product_id not in new_ids:
+                self.result_cache.pop(key)
+                continue
+            new = self._compute_recommendations(*key)
+            if [self._visible(r) for r in new] != [self._visible(r) for r in old]:
+                changed.add(product_id)
+            self.result_cache.put(key, (version, new))
+        delta = changed | added | removed
+        self.last_result_delta = {
+            'at': time.time(),
+            'checked': len(before),
+            'changed': sorted(changed),
+            'added': len(added),
+            'removed': len(removed),
+            'duration_s': round(time.perf_counter() - start, 4),
+        }
+        self._notify_listeners(delta)
+        return delta
+
+    def _notify_listeners(self, delta: Set[int]):
+        if delta:
+            for listener in list(self.result_listeners):
+                try:
+                    listener(delta)
+                except Exception:
+                    pass
+
+    @staticmethod
+    def _visible(item: Dict) -> tuple:
+        return item['id'], item['name'], item.get('price'), item.get('image')
+
+    def component_scores(self, idx: int, state: _ModelState = None):
+        """Сходство товара `idx` со всеми товарами по компонентам (text, category, manufacturer).
+
+        Сам товар получает -1 во всех компонентах.
+        """
+        st = state or self._state
+        n = len(st.ids)
+        sims_text = np.zeros(n)
+        sims_category = np.zeros(n)
+        sims_manufacturer = np.zeros(n)
+        if isinstance(st.backend, scoring_backend.DenseBackend):
+            # small catalog: rows of the precomputed N x N similarities
+            dense_text, dense_category = st.backend.rows(idx)
+            if dense_text is not None:
+                sims_text = dense_text
+            if dense_category is not None:
+                sims_category = dense_category
+        else:
+            # plain sparse products (same result as linear_kernel) also work on memmapped hashing-build matrices
+            try:
+                if st.matrix_text is not None:
+                    sims_text = (st.matrix_text[idx:idx+1] @ st.matrix_text.T).toarray().ravel()
+            except Exception:
+                sims_text = np.zeros(n)
+
+            try:
+                if st.matrix_category is not None:
+                    sims_category = (st.matrix_category[idx:idx+1] @ st.matrix_category.T).toarray().ravel()
+            except Exception:
+                sims_category = np.zeros(n)
 
         try:
-            if self.matrix_manufacturer is not None:
-                sims_manufacturer = linear_kernel(self.matrix_manufacturer[idx:idx+1], self.matrix_manufacturer).flatten()
+            if st.manufacturer_sim is not None:
+                # one gather from the precomputed manufacturer x manufacturer matrix
+                sims_manufacturer = st.manufacturer_sim[st.manufacturer_ids[idx], st.manufacturer_ids]
         except Exception:
-            sims_manufacturer = np.zeros(len(self.ids))
+            sims_manufacturer = np.zeros(n)
 
         # exclude itself
         sims_text[idx] = -1
         sims_category[idx] = -1
         sims_manufacturer[idx] = -1
+        return sims_text, sims_category, sims_manufacturer
+
+    def _result_item(self, i: int, score: float, state: _ModelState = None) -> Dict:
+        p = (state or self._state).products[i]
+        return {
+            'id': p['id'],
+            'name': p['name'],
+            'price': p.get('price', ''),
+            'image': p.get('image', ''),
+            'score': float(score)
+        }
+
+    def _filter_mask(self, filters: Dict = None, state: _ModelState = None):
+        """Маска товаров по фильтрам search(): vehicle, category, manufacturer."""
+        if not filters:
+            return None
+        st = state or self._state
+        mask = None
+        vehicle_mask = self.fitment_mask(filters.get('vehicle'), st)
+        if vehicle_mask is not None:
+            mask = vehicle_mask
+        category = (filters.get('category') or '').strip().lower()
+        if category:
+            cat_mask = np.array([str(p.get('category') or '').lower() == category for p in st.products])
+            mask = cat_mask if mask is None else mask & cat_mask
+        manufacturer = filters.get('manufacturer')
+        if manufacturer and st.manufacturer_ids is not None:
+            key = manufacturers.canonical_key(manufacturer, st.manufacturer_aliases)
+            pos = st.manufacturer_keys.index(key) if key in st.manufacturer_keys else -1
+            man_mask = st.manufacturer_ids == pos
+            mask = man_mask if mask is None else mask & man_mask
+        return mask
+
+    def _query_vector(self, text: str, state: _ModelState = None):
+        st = state or self._state
+        key = ' '.join(str(text).lower().split())
+        vec = st.query_cache.get(key)
+        if vec is None:
+            vec = st.tfidf_text.transform([key])
+            st.query_cache.put(key, vec)
+        return vec
+
+    def memory_footprint(self) -> Dict[str, int]:
+        """Размер матриц и хранилища товаров в байтах."""
+        st = self._state
+        graph = self.graph
+        return {
+            'matrix_text': nbytes(st.matrix_text),
+            'matrix_category': nbytes(st.matrix_category),
+            'manufacturer_sim': nbytes(st.manufacturer_sim),
+            'manufacturer_ids': nbytes(st.manufacturer_ids),
+            'fitment': st.fitment.nbytes() if st.fitment is not None else 0,
+            'candidates': st.candidates.nbytes() if st.candidates is not None else 0,
+            'duplicates': st.duplicates.nbytes() if st.duplicates is not None else 0,
+            'services': nbytes(st.service_matrix_text) + records_nbytes(st.services),
+            'popularity': nbytes(st.popularity) + nbytes(st.popularity_norm),
+            'graph': graph.nbytes() if graph is not None else 0,
+            'backend': st.backend.nbytes() if st.backend is not None else 0,
+            'products': records_nbytes(st.products),
+        }
 
-        # popularity normalization
-        max_pop = max((p.get('popularity', 0) for p in self.products), default=1)
+    def cache_stats(self) -> Dict[str, Dict]:
+        stats = {'query_vectors': self.query_cache.stats(), 'results': self.result_cache.stats(),
+                 'graph_rankings': self.graph_cache.stats()}
+        for name, cache in self.token_caches.items():
+            stats[f'tokens_{name}'] = cache.stats()
+        return stats
 
-        # compute final score as weighted sum of four components
+    def metrics_snapshot(self) -> Dict:
+        """Фазы построения, память, задержки и кэши одним словарём (для model-status)."""
+        snap = self.metrics.snapshot()
+        memory = self.memory_footprint()
+        snap['memory_bytes'] = memory
+        snap['memory_total_bytes'] = sum(memory.values())
+        snap['caches'] = self.cache_stats()
+        graph = self.graph
+        snap['graph'] = graph.stats() if graph is not None else None
+        snap['backend'] = dict(self.backend_info)
+        snap['pruning'] = dict(self.pruning)
+        duplicates = self.duplicates
+        snap['duplicates'] = duplicates.stats() if duplicates is not None else None
+        return snap
+
+    def prometheus_metrics(self) -> str:
+        return self.metrics.prometheus(self.memory_footprint(), self.cache_stats())
+
+    def product_count(self) -> int:
+        return len(self.ids)
+
+    def status(self) -> Dict:
+        """Состояние модели для model-status: размер, веса, профили, стратегия, метрики."""
+        built = self.matrix_text is not None or self.matrix_category is not None or self.manufacturer_sim is not None
+        if not built:
+            return {'built': False}
+        vocabulary = getattr(self.tfidf_text, 'vocabulary_', None)
+        return {
+            'built': True,
+            'n_products': len(self.products),
+            'vocab_size': len(vocabulary) if vocabulary else 0,
+            'weights': {**self.weights(), 'cat_scale': self.cat_scale},
+            'profiles': self.profiles_summary(),
+            'profile_split': list(self.profile_split),
+            'popularity_updated_at': self.popularity_updated_at,
+            # products whose cached recommendation lists changed in the last rebuild / reweight
+            'result_delta': self.last_result_delta,
+            # cached lists rescored on read after popularity refreshes, and how many of them changed
+            'popularity_rescored': dict(self.popularity_rescored),
+            # dense / sparse / ann and why it was picked for this catalog
+            'backend': dict(self.backend_info),
+            'warmup': dict(self.warmup),
+            'prefetch': {**self.prefetch_stats, 'pending': self._prefetch_queue.qsize()},
+            'metrics': self.metrics_snapshot(),
+        }
+
+    @timed_method('search')
+    def search(self, text: str, top_k: int = 10, filters: Dict = None) -> List[Dict]:
+        """Товары, наиболее похожие на произвольный текст запроса.
+
+        Запрос переводится в вектор тем же обученным `tfidf_text` и сравнивается
+        с `matrix_text` (косинус). `filters` — необязательные vehicle / category /
+        manufacturer. Почти-дубликаты сворачиваются до представителя кластера.
+        """
+        st = self._state
+        if not text or not str(text).strip() or st.matrix_text is None or st.tfidf_text is None:
+            return []
+        qvec = self._query_vector(text, st)
+        if qvec.nnz == 0:
+            # no query word is in the fitted vocabulary
+            return []
+        scores = np.asarray((st.matrix_text @ qvec.T).todense()).ravel()
+        mask = self._filter_mask(filters, st)
+        if st.duplicates is not None and self.collapse_duplicates:
+            # one product per near-duplicate cluster, same as recommendations
+            mask = st.duplicates.is_representative if mask is None else mask & st.duplicates.is_representative
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        k = min(int(top_k), len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [self._result_item(int(i), scores[i], st) for i in top if scores[i] > 0]
+
+    def has_product(self, product_id: int) -> bool:
+        """Товар есть в модели (добавленные после сборки — нет, до перестройки)."""
+        return product_id in self._positions
+
+    def fitment_mask(self, vehicle, state: _ModelState = None):
+        """Булева маска товаров, подходящих автомобилю, или None (фильтр не задан)."""
+        index = (state or self._state).fitment
+        if not vehicle or index is None:
+            return None
+        return index.mask(vehicle)
+
+    def _collapse_mask(self, idx: int, state: _ModelState = None):
+        """Маска «товар может быть в выдаче для `idx`»: по одному представителю на кластер
+        почти-дубликатов, без кластера самого товара; None — дубликатов нет или сворачивание выключено."""
+        duplicates = (state or self._state).duplicates
+        if duplicates is None or not self.collapse_duplicates:
+            return None
+        mask = duplicates.is_representative.copy()
+        mask[duplicates.members(idx)] = False
+        return mask
+
+    def _candidate_positions(self, idx: int, fit_mask=None, state: _ModelState = None):
+        """Позиции для полного скоринга товара `idx`; None — считать по всем товарам.
+
+        Полный проход выполняется, если кандидаты выключены или их (после
+        фильтра по автомобилю и сворачивания дубликатов) меньше candidate_min, а также для стратегии
+        'dense'. Стратегия 'ann' берёт кандидатов из IVF-индекса вместо
+        инвертированных индексов.
+        """
+        st = state or self._state
+        if not self.use_candidates or st.candidates is None or len(st.ids) <= self.candidate_min:
+            return None
+        backend = st.backend
+        if isinstance(backend, scoring_backend.DenseBackend):
+            # a row of the dense similarity is already cheaper than gathering candidates
+            return None
+        if isinstance(backend, scoring_backend.AnnBackend):
+            positions = np.unique(np.concatenate([[idx], st.candidates.popular, backend.candidates(idx)]))
+        else:
+            positions = st.candidates.for_product(idx)
+        if fit_mask is not None:
+            # masked-out positions could never be returned: do not score them at all
+            positions = positions[fit_mask[positions]]
+        if len(positions) < self.candidate_min:
+            return None
+        return positions
+
+    def _weighted_scores(self, idx: int, positions=None, weights: Dict[str, float] = None,
+                         state: _ModelState = None) -> np.ndarray:
+        """Итоговый скор (четыре компонента) товаров `positions` (None — всех) относительно `idx`.
+
+        Компонентные сходства общие для всех профилей; `weights` (см. weights()) лишь
+        задаёт их взвешивание.
+        """
+        st = state or self._state
+        if positions is None:
+            sims_text, sims_category, sims_manufacturer = self.component_scores(idx, st)
+            pop_norm = st.popularity_norm
+        else:
+            m = len(positions)
+            sims_text = np.zeros(m)
+            sims_category = np.zeros(m)
+            sims_manufacturer = np.zeros(m)
+            # plain sparse products: linear_kernel's input validation costs more than the dot itself here
+            if st.matrix_text is not None:
+                sims_text = (st.matrix_text[idx:idx+1] @ st.matrix_text[positions].T).toarray().ravel()
+            if st.matrix_category is not None:
+                sims_category = (st.matrix_category[idx:idx+1] @ st.matrix_category[positions].T).toarray().ravel()
+            if st.manufacturer_sim is not None:
+                sims_manufacturer = st.manufacturer_sim[st.manufacturer_ids[idx], st.manufacturer_ids[positions]]
+            # exclude itself, same as component_scores
+            own = positions == idx
+            sims_text[own] = -1
+            sims_category[own] = -1
+            sims_manufacturer[own] = -1
+            pop_norm = st.popularity_norm[positions]
+        w = weights or self.weights()
+        return (w['w_text'] * sims_text) + (w['w_category'] * sims_category) + (w['w_manufacturer'] * sims_manufacturer) + (w['w_popularity'] * pop_norm)
+
+    def _top_positions(self, scores: np.ndarray, positions, top_k: int, fit_mask=None) -> List[int]:
+        """Индексы в `scores` лучших top_k положительных скоров; при равенстве — меньшая позиция."""
+        if positions is None:
+            positions = np.arange(len(scores))
+        keep = scores > 0
+        if fit_mask is not None:
+            keep &= fit_mask[positions]
+        sel = np.flatnonzero(keep)
+        if len(sel) > top_k > 0:
+            # everything tied with the k-th best stays in, so ties resolve exactly as a full sort
+            kth = np.partition(scores[sel], len(sel) - top_k)[len(sel) - top_k]
+            sel = sel[scores[sel] >= kth]
+        order = sel[np.lexsort((positions[sel], -scores[sel]))]
+        return [int(j) for j in order[:max(int(top_k), 0)]]
+
+    @timed_method('recommendations')
+    def get_recommendations(self, product_id: int, top_k: int = 5, vehicle: str = None,
+                            use_candidates: bool = True, profile: str = None) -> List[Dict]:
+        """Вернуть список рекомендованных товаров (JSON-сериализуемый).
+
+        `vehicle` (например, "BMW X5") оставляет только подходящие автомобилю товары.
+        Скор считается только по кандидатам (см. candidates.py); `use_candidates=False`
+        — точный проход по всем товарам. `profile` — имя профиля весов (см. profile_for).
+        Результаты кэшируются (result_cache) до изменения модели.
+        """
+        profile = profile if profile in self.profiles else None
+        self.metrics.observe_profile(profile or self.DEFAULT_PROFILE)
+        key = (product_id, int(top_k), vehicle or None, profile, bool(use_candidates))
+        results, computed = self._cached_recommendations(key)
+        if computed and self.prefetch_neighbors and results:
+            self._enqueue_prefetch(key, results)
+        return [dict(r) for r in results]
+
+    def recommend_for(self, product_id: int, top_k: int = 5, vehicle: str = None, use_candidates: bool = True,
+                      profile: str = None, user_id=None) -> Optional[Tuple[str, List[Dict]]]:
+        """(профиль, рекомендации) одним вызовом: профиль выбирается как в profile_for.
+
+        None — товара нет в модели (добавлен после сборки, до перестройки).
+        """
+        if not self.has_product(product_id):
+            return None
+        name = self.profile_for(profile, user_id)
+        return name, self.get_recommendations(product_id, top_k=top_k, vehicle=vehicle,
+                                              use_candidates=use_candidates, profile=name)
+
+    def _cached_recommendations(self, key):
+        """(результат из result_cache или посчитанный и сохранённый, True — если считали).
+
+        Запись, посчитанная до последнего обновления популярности, пересчитывается;
+        если её видимый список изменился, товар передаётся result_listeners.
+        """
+        entry = self.result_cache.get(key)
+        if entry is not None and entry[0] == self._popularity_version:
+            return entry[1], False
+        generation = self._result_generation
+        version = self._popularity_version
+        results = self._compute_recommendations(*key)
+        if generation == self._result_generation:
+            self.result_cache.put(key, (version, results))
+        if entry is not None:
+            self.popularity_rescored['rescored'] += 1
+            if [self._visible(r) for r in results] != [self._visible(r) for r in entry[1]]:
+                self.popularity_rescored['changed'] += 1
+                self._notify_listeners({key[0]})
+        return results, True
+
+    def recommend_many(self, product_ids: List[int], top_k: int = 5, vehicle: str = None,
+                       profile: str = None) -> Dict[int, List[Dict]]:
+        """get_recommendations для нескольких товаров: id -> список (неизвестные товары — [])."""
+        return {pid: self.get_recommendations(pid, top_k=top_k, vehicle=vehicle, profile=profile) for pid in product_ids}
+
+    @timed_method('related')
+    def related(self, product_id: int, top_k: int = 5, services_k: int = 3, vehicle: str = None,
+                profile: str = None) -> Dict[str, List[Dict]]:
+        """Связанные товары и услуги одним вызовом: {'goods': [...], 'services': [...]}.
+
+        Товары — как get_recommendations (полный взвешенный скор); услуги ранжируются
+        по текстовому сходству в общем с товарами пространстве признаков (категории,
+        производителя и популярности у них нет). У каждой записи есть поле 'type'.
+        """
+        st = self._state
+        idx = st._positions.get(product_id)
+        if idx is None:
+            return {self.ENTITY_GOODS: [], self.ENTITY_SERVICE: []}
+        goods = [dict(r, type=self.ENTITY_GOODS)
+                 for r in self.get_recommendations(product_id, top_k=top_k, vehicle=vehicle, profile=profile)]
+        services = []
+        service_matrix, rows = st.service_matrix_text, st.services
+        k = min(int(services_k), len(rows))
+        if service_matrix is not None and st.matrix_text is not None and k > 0:
+            scores = (st.matrix_text[idx:idx+1] @ service_matrix.T).toarray().ravel()
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.lexsort((top, -scores[top]))]
+            for i in top:
+                if scores[i] <= 0:
+                    continue
+                r = rows[i]
+                services.append({'id': r['id'], 'name': r['name'], 'address': r.get('address', ''),
+                                 'phone': r.get('phone', ''), 'score': float(scores[i]), 'type': self.ENTITY_SERVICE})
+        return {self.ENTITY_GOODS: goods, self.ENTITY_SERVICE: services}
+
+    def _compute_recommendations(self, product_id: int, top_k: int = 5, vehicle: str = None,
+                                 profile: str = None, use_candidates: bool = True,
+                                 state: _ModelState = None) -> List[Dict]:
+        # one state for the whole query: a rebuild published meanwhile is picked up by the next one
+        st = state or self._state
+        idx = st._positions.get(product_id)
+        if idx is None:
+            return []
+
+        fit_mask = self.fitment_mask(vehicle, st)
+        collapse = self._collapse_mask(idx, st)
+        if collapse is not None:
+            fit_mask = collapse if fit_mask is None else fit_mask & collapse
+
+        positions = self._candidate_positions(idx, fit_mask, st) if use_candidates else None
+        self.metrics.observe_candidates(len(st.ids) if positions is None else len(positions), positions is None)
+
+        # weighted sum of text / category / manufacturer similarity and popularity
+        scores = self._weighted_scores(idx, positions, self.weights(profile), st)
         results = []
-        scores = []
-        for i in range(len(self.ids)):
-            cos_t = float(sims_text[i]) if sims_text is not None else 0.0
-            cos_c = float(sims_category[i]) if sims_category is not None else 0.0
-            cos_m = float(sims_manufacturer[i]) if sims_manufacturer is not None else 0.0
-            pop = float(self.products[i].get('popularity', 0))
-            pop_norm = pop / max_pop if max_pop > 0 else 0.0
+        for j in self._top_positions(scores, positions, top_k, fit_mask):
+            i = j if positions is None else int(positions[j])
+            results.append(self._result_item(i, scores[j], st))
+        return results
+
+    @property
+    def graph(self) -> Optional['reco_graph.GraphRecommender']:
+        """Опубликованный граф multi-hop (None — ещё не построен)."""
+        published = self._graph_published
+        return published[1] if published is not None else None
+
+    def _invalidate_graph(self):
+        """Перестроить граф в фоне после изменения модели или заказов, если его уже запрашивали."""
+        if self._graph_wanted:
+            self.schedule_graph_build()
+
+    def schedule_graph_build(self):
+        """Построить граф multi-hop в фоне; вызовы во время построения схлопываются в одно повторное."""
+        with self._graph_guard:
+            self._graph_wanted = True
+            self._graph_dirty = True
+            if self._graph_thread is not None:
+                return
+            self._graph_thread = threading.Thread(target=self._graph_worker, name='reco-graph', daemon=True)
+            self._graph_thread.start()
+
+    def _graph_worker(self):
+        while True:
+            with self._graph_guard:
+                if not self._graph_dirty:
+                    self._graph_thread = None
+                    return
+                self._graph_dirty = False
+            try:
+                self.build_graph()
+            except Exception as e:
+                print(f'Граф multi-hop не построен ({e}), остаётся предыдущий')
+
+    def build_graph(self) -> 'reco_graph.GraphRecommender':
+        """Построить граф по текущему состоянию модели и опубликовать его вместе с этим состоянием."""
+        state = self._state
+        weights = self.weights()
+        matrices = (state.matrix_text, state.matrix_category, state.manufacturer_sim, state.manufacturer_ids)
+        params = (weights['w_text'], weights['w_category'], weights['w_manufacturer'], self.graph_k)
+        with self.metrics.timed_maintenance('graph_build'):
+            cached = self._graph_similarity
+            if cached is not None and cached[1] == params and all(a is b for a, b in zip(cached[0], matrices)):
+                similarity = cached[2]
+            else:
+                similarity = reco_graph.similarity_graph(state, weights, k=self.graph_k)
+                self._graph_similarity = (matrices, params, similarity)
+            conn = db_connection.connect(self.db_path)
+            try:
+                co = reco_graph.co_purchase_graph(conn, state.ids)
+            finally:
+                conn.close()
+            graph = reco_graph.GraphRecommender(
+                similarity, co, co_weight=self.graph_co_weight, damping=self.graph_damping,
+                max_iter=self.graph_max_iter, tol=self.graph_tol)
+        self._graph_published = (state, graph)
+        self.graph_cache.clear()
+        return graph
 
-            score = (self.w_text * cos_t) + (self.w_category * cos_c) + (self.w_manufacturer * cos_m) + (self.w_popularity * pop_norm)
-            scores.append((i, score))
+    @timed_method('graph')
+    def graph_recommendations(self, product_id: int, top_k: int = 5, exclude_direct: bool = False) -> List[Dict]:
+        """Многошаговые рекомендации: personalized PageRank от товара по графу
+        сходства и совместных покупок (см. reco_graph.py).
 
-        # sort by score desc and take top_k (exclude negative/zero)
-        top = sorted(scores, key=lambda x: x[1], reverse=True)
-        taken = 0
-        for i, sc in top:
-            if taken >= top_k:
+        `exclude_direct=True` убирает прямых соседей по сходству, оставляя только
+        товары, до которых «доходят» через несколько шагов. Пока первый граф
+        строится в фоне, результат пуст.
+        """
+        published = self._graph_published
+        if published is None:
+            if not self._graph_wanted:
+                self.schedule_graph_build()
+            return []
+        st, graph = published
+        idx = st._positions.get(product_id)
+        if idx is None or len(st.ids) < 2:
+            return []
+        cached = self.graph_cache.get(idx)
+        if cached is not None and cached[0] is graph:
+            ranked = cached[1]
+        else:
+            ranked = graph.rank(idx, limit=max(50, int(top_k) + self.graph_k))
+            self.graph_cache.put(idx, (graph, ranked))
+        positions, scores = ranked
+        skip = set(graph.neighbors(idx).tolist()) if exclude_direct else set()
+        # same positions after popularity / metadata updates: show current prices and images
+        current = self._state
+        if current.ids is st.ids:
+            st = current
+        collapse = self._collapse_mask(idx, st)
+        results = []
+        for pos, score in zip(positions, scores):
+            if len(results) >= top_k:
                 break
-            if sc <= 0:
+            if int(pos) not in skip and (collapse is None or collapse[pos]):
+                results.append(self._result_item(int(pos), score, st))
+        return results
+
+    def explain(self, product_id: int, page: int = 1, per_page: int = 10) -> Dict:
+        """Разложение скора по компонентам для всех товаров относительно `product_id`, по убыванию, постранично."""
+        st = self._state
+        idx = st._positions.get(product_id)
+        if idx is None or st.matrix_text is None:
+            return {'items': []}
+        # per-component similarities (self excluded with -1)
+        sims_text, sims_category, sims_manufacturer = self.component_scores(idx, st)
+        max_pop = float(st.popularity.max()) if len(st.popularity) else 1
+        items = []
+        for i, p in enumerate(st.products):
+            if i == idx:
                 continue
-            p = self.products[i]
-            results.append({
+            cos = float(sims_text[i])
+            cos_cat = float(sims_category[i])
+            cos_man = float(sims_manufacturer[i])
+            pop = float(st.popularity[i])
+            pop_norm = pop / max_pop if max_pop > 0 else 0.0
+            final_score = self.w_text * cos + self.w_category * cos_cat + self.w_manufacturer * cos_man + self.w_popularity * pop_norm
+            items.append({
                 'id': p['id'],
                 'name': p['name'],
-                'price': p.get('price', ''),
-                'image': p.get('image', ''),
-                'score': float(sc)
+                'cosine': cos,
+                'cos_category': cos_cat,
+                'cos_manufacturer': cos_man,
+                'popularity': pop,
+                'pop_norm': pop_norm,
+                'final_score': float(final_score)
             })
-            taken += 1
+        items.sort(key=lambda x: x['final_score'], reverse=True)
+        start = (page - 1) * per_page
+        return {'items': items[start:start + per_page], 'total': len(items), 'page': page, 'per_page': per_page}
 
-        return results
+    def candidate_recall(self, sample: int = 50, top_k: int = 5, seed: int = 0, profile: str = None) -> Dict:
+        """Сравнить рекомендации по кандидатам с точным скорингом на выборке товаров.
+
+        recall — доля точного top_k, найденная по кандидатам; fallback_rate —
+        доля товаров, для которых кандидатов оказалось мало и был полный проход.
+        """
+        st = self._state
+        if not st.ids:
+            return {'sample': 0, 'top_k': top_k, 'recall': None, 'avg_candidates': 0, 'fallback_rate': 0.0}
+        rng = np.random.default_rng(seed)
+        picks = rng.choice(len(st.ids), size=min(sample, len(st.ids)), replace=False)
+        weights = self.weights(profile)
+        found = expected = fallbacks = 0
+        sizes = []
+        for idx in picks:
+            idx = int(idx)
+            exact = self._top_positions(self._weighted_scores(idx, None, weights, st), None, top_k)
+            positions = self._candidate_positions(idx, state=st)
+            if positions is None:
+                fallbacks += 1
+                sizes.append(len(st.ids))
+                approx = exact
+            else:
+                sizes.append(len(positions))
+                approx = [int(positions[j]) for j in self._top_positions(
+                    self._weighted_scores(idx, positions, weights, st), positions, top_k)]
+            found += len(set(exact) & set(approx))
+            expected += len(exact)
+        return {
+            'sample': len(picks),
+            'top_k': top_k,
+            'recall': round(found / expected, 4) if expected else None,
+            'avg_candidates': round(float(np.mean(sizes)), 1),
+            'n_products': len(st.ids),
+            'fallback_rate': round(fallbacks / len(picks), 4),
+        }
+
+
+def _model_field(name: str) -> property:
+    # engine.<name> reads the published state; assignment publishes a copy with the field replaced
+    def get(self):
+        return getattr(self._state, name)
+
+    def set(self, value):
+        with self._lock:
+            self._install(self._state.replace(**{name: value}))
+    return property(get, set)
+
+
+for _name in _ModelState.FIELDS:
+    setattr(RecommendationEngine, _name, _model_field(_name))
 
 
 if __name__ == '__main__':
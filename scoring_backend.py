@@ -0,0 +1,145 @@
+"""
+Стратегии скоринга движка в зависимости от размера каталога.
+
+  dense   — небольшие каталоги: матрицы сходства text / category N x N
+            считаются при сборке, запрос сводится к чтению строки;
+  sparse  — средние: разреженное произведение строки на матрицу по
+            кандидатам (candidates.py), иначе по всем товарам;
+  ann     — огромные: кандидаты берутся из IVF-индекса (кластеры
+            MiniBatchKMeans поверх TruncatedSVD-эмбеддингов), полный
+            взвешенный скор считается только по ним.
+
+choose() выбирает стратегию по числу товаров, nnz матриц и доступной
+памяти; reco_config.json "scoring_backend" задаёт её явно. Для out-of-core
+сборки (hashing_build.py) dense не выбирается: N x N в памяти сводит на нет
+ограничение памяти сборки.
+"""
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+BACKENDS = ('dense', 'sparse', 'ann')
+
+
+def available_memory() -> Optional[int]:
+    """Доступная память в байтах (MemAvailable из /proc/meminfo), None — неизвестно."""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def dense_nbytes(n: int) -> int:
+    # text + category similarity, float64
+    return 2 * n * n * 8
+
+
+def choose(n: int, nnz: int, override: str = 'auto', dense_budget: int = 256 << 20,
+           ann_min_products: int = 200000, ann_min_nnz: int = 50000000,
+           memory: Optional[int] = None, allow_dense: bool = True) -> Tuple[str, str]:
+    """(имя стратегии, причина выбора); `allow_dense=False` — только sparse / ann."""
+    if override in BACKENDS and (allow_dense or override != 'dense'):
+        return override, 'config override'
+    need = dense_nbytes(n)
+    # dense matrices may take at most a quarter of what the machine has free
+    budget = dense_budget if memory is None else min(dense_budget, memory // 4)
+    if not allow_dense:
+        if n >= ann_min_products or nnz >= ann_min_nnz:
+            return 'ann', f'out-of-core build: {n} products / {nnz} nnz exceed the exact sparse scan limits'
+        return 'sparse', 'out-of-core build: dense similarity is not kept in memory'
+    if need <= budget:
+        return 'dense', f'{need >> 20} MB of dense similarity fits the {budget >> 20} MB budget'
+    if n >= ann_min_products or nnz >= ann_min_nnz:
+        return 'ann', f'{n} products / {nnz} nnz exceed the exact sparse scan limits'
+    return 'sparse', f'{n} products: dense needs {need >> 20} MB, below ANN thresholds'
+
+
+class DenseBackend:
+    """Предпосчитанные N x N матрицы сходства по тексту и категории."""
+
+    name = 'dense'
+
+    def __init__(self, matrix_text, matrix_category):
+        self.sims_text = None if matrix_text is None else (matrix_text @ matrix_text.T).toarray()
+        self.sims_category = None if matrix_category is None else (matrix_category @ matrix_category.T).toarray()
+
+    def rows(self, idx: int):
+        """Копии строк (text, category); None — компонента не построена."""
+        text = None if self.sims_text is None else self.sims_text[idx].copy()
+        category = None if self.sims_category is None else self.sims_category[idx].copy()
+        return text, category
+
+    def nbytes(self) -> int:
+        return int(sum(m.nbytes for m in (self.sims_text, self.sims_category) if m is not None))
+
+
+class AnnBackend:
+    """IVF-индекс: товары разбиты на кластеры, запрос просматривает nprobe ближайших."""
+
+    name = 'ann'
+
+    def __init__(self, matrix_text, matrix_category, n_components: int = 32, nprobe: int = 8,
+                 sample: int = 100000, seed: int = 0):
+        parts = [m for m in (matrix_text, matrix_category) if m is not None]
+        features = sparse.hstack(parts).tocsr() if len(parts) > 1 else parts[0]
+        n = features.shape[0]
+        rng = np.random.default_rng(seed)
+        fit_rows = np.sort(rng.choice(n, size=min(sample, n), replace=False))
+        n_components = max(1, min(n_components, features.shape[1] - 1, len(fit_rows) - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=seed).fit(features[fit_rows])
+        self.embeddings = np.empty((n, n_components), dtype=np.float32)
+        for start in range(0, n, 50000):
+            block = features[start:start + 50000]
+            self.embeddings[start:start + block.shape[0]] = normalize(svd.transform(block))
+        n_clusters = max(1, min(int(np.sqrt(n)), len(fit_rows)))
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=1, random_state=seed)
+        kmeans.fit(self.embeddings[fit_rows])
+        self.centroids = kmeans.cluster_centers_.astype(np.float32)
+        assign = kmeans.predict(self.embeddings)
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(n_clusters + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]].astype(np.int32) for c in range(n_clusters)]
+        self.nprobe = min(nprobe, n_clusters)
+
+    def candidates(self, idx: int) -> np.ndarray:
+        """Товары из nprobe кластеров, ближайших к эмбеддингу товара `idx`."""
+        sims = self.centroids @ self.embeddings[idx]
+        probe = np.argpartition(-sims, self.nprobe - 1)[:self.nprobe]
+        return np.concatenate([self._lists[c] for c in probe])
+
+    def nbytes(self) -> int:
+        return int(self.embeddings.nbytes + self.centroids.nbytes + sum(p.nbytes for p in self._lists))
+
+
+def build(name: str, matrix_text, matrix_category, **ann_params):
+    """Объект стратегии; для 'sparse' — None (используются матрицы движка напрямую)."""
+    if matrix_text is None and matrix_category is None:
+        return None
+    if name == 'dense':
+        return DenseBackend(matrix_text, matrix_category)
+    if name == 'ann':
+        return AnnBackend(matrix_text, matrix_category, **ann_params)
+    return None
+
+
+def describe(name: str, reason: str, n: int, nnz: int, backend, memory: Optional[int]) -> Dict:
+    return {
+        'name': name,
+        'reason': reason,
+        'n_products': n,
+        'nnz': nnz,
+        'backend_bytes': backend.nbytes() if backend is not None else 0,
+        'available_memory_bytes': memory,
+    }
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк полнотекстового поиска (product_search.py) на большом каталоге.
+
+Создаёт временную БД с `--rows` синтетическими товарами (по умолчанию
+1 000 000), строит goods_fts и сравнивает время страниц поиска:
+
+  keyset  — product_search.search(): ключи (rowid, rank) страницы по
+            (rank, rowid) > курсора, затем подсветка только её строк;
+  offset  — для сравнения: один запрос с highlight/snippet,
+            ORDER BY rank и окно LIMIT/OFFSET.
+
+bm25 в обоих случаях считается по всем совпадениям запроса, поэтому время
+страницы растёт с числом совпадений; узкие запросы остаются быстрыми.
+
+Usage:
+  python scripts/bench_fts.py [--rows 1000000] [--db /tmp/bench_fts.db] [--pages 5]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import product_search  # noqa: E402
+
+NAMES = ['Масляный фильтр', 'Воздушный фильтр', 'Тормозные колодки', 'Тормозной диск', 'Свеча зажигания',
+         'Амортизатор', 'Ремень ГРМ', 'Датчик кислорода', 'Радиатор', 'Помпа', 'Сцепление', 'Стартер']
+CATEGORIES = ['Фильтры', 'Тормозная система', 'Двигатель', 'Подвеска', 'Электрика', 'Охлаждение']
+MANUFACTURERS = ['Bosch', 'Mann', 'Brembo', 'NGK', 'Sachs', 'Gates', 'Denso', 'Valeo', 'Mahle', 'Febi']
+VEHICLES = ['BMW X5', 'BMW 3', 'Audi A4', 'Toyota Camry', 'Lada Vesta', 'Kia Rio', 'Ford Focus', 'Все модели']
+QUERIES = ['фильтр', 'тормозные колодки brembo', 'датчик']
+
+# single-query LIMIT/OFFSET window, kept for comparison
+OFFSET_SQL = f'''
+    SELECT g.id, g.name, g.price, g.image, g.category, g.manufacturer, g.compatibility,
+           highlight(goods_fts, 0, '{product_search._HL_OPEN}', '{product_search._HL_CLOSE}') AS name_highlight,
+           snippet(goods_fts, 1, '{product_search._HL_OPEN}', '{product_search._HL_CLOSE}', '…', 16),
+           goods_fts.rank
+    FROM goods_fts
+    JOIN goods g ON g.id = goods_fts.rowid
+    WHERE goods_fts MATCH ?
+    ORDER BY goods_fts.rank
+    LIMIT ? OFFSET ?
+'''
+
+
+def populate(conn: sqlite3.Connection, rows: int, seed: int = 0, batch: int = 50000):
+    conn.execute('''
+        CREATE TABLE goods (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price TEXT,
+            image TEXT,
+            description TEXT,
+            category TEXT,
+            compatibility TEXT,
+            manufacturer TEXT
+        )
+    ''')
+    rng = random.Random(seed)
+    for start in range(0, rows, batch):
+        chunk = []
+        for i in range(start, min(start + batch, rows)):
+            name = rng.choice(NAMES)
+            manufacturer = rng.choice(MANUFACTURERS)
+            chunk.append((f'{name} {manufacturer} {i}', str(rng.randint(500, 90000)), '',
+                          f'{name} для {rng.choice(VEHICLES)}, артикул {rng.randint(10 ** 5, 10 ** 6)}',
+                          rng.choice(CATEGORIES), ', '.join(rng.sample(VEHICLES, 2)), manufacturer))
+        conn.executemany('INSERT INTO goods (name, price, image, description, category, compatibility, manufacturer) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)', chunk)
+    conn.commit()
+
+
+def keyset_pages(conn: sqlite3.Connection, query: str, limit: int, pages: int):
+    cursor = None
+    for _ in range(pages):
+        cursor = product_search.search(conn, query, limit=limit, cursor=cursor)['next_cursor']
+        if cursor is None:
+            return
+
+
+def offset_pages(conn: sqlite3.Connection, query: str, limit: int, pages: int):
+    match = product_search.build_match(query)
+    for page in range(pages):
+        rows = conn.execute(OFFSET_SQL, (match, limit + 1, page * limit)).fetchall()
+        if len(rows) <= limit:
+            return
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark FTS5 search pagination on a synthetic catalogue')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--db', default=os.path.join(ROOT, 'bench_fts.db'))
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--keep', action='store_true', help='reuse / keep the benchmark database')
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db) and not args.keep:
+        os.remove(args.db)
+    conn = sqlite3.connect(args.db)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'goods'").fetchone():
+        started = time.perf_counter()
+        populate(conn, args.rows)
+        print(f'{args.rows} goods inserted in {time.perf_counter() - started:.1f}s')
+    started = time.perf_counter()
+    if product_search.ensure_schema(conn):
+        conn.commit()
+        print(f'goods_fts built in {time.perf_counter() - started:.1f}s')
+
+    print(f'{"query":<28}{"matches":>9}{"keyset, s":>12}{"offset, s":>12}')
+    for query in QUERIES:
+        match = product_search.build_match(query)
+        matches = conn.execute('SELECT COUNT(*) FROM goods_fts WHERE goods_fts MATCH ?', (match,)).fetchone()[0]
+        keyset = timed(keyset_pages, conn, query, args.limit, args.pages)
+        offset = timed(offset_pages, conn, query, args.limit, args.pages)
+        print(f'{query:<28}{matches:>9}{keyset:>12.3f}{offset:>12.3f}')
+    conn.close()
+    if not args.keep:
+        os.remove(args.db)
+
+
+if __name__ == '__main__':
+    main()
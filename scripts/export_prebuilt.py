@@ -5,10 +5,11 @@ Export current `data.db` and trained recommendation engine into `prebuilt/` fold
 Usage:
   python scripts/export_prebuilt.py
 
-This creates `prebuilt/data.db` (copy) and `prebuilt/engine.joblib` (serialized engine).
+This creates `prebuilt/data.db` (copy) and `prebuilt/engine/` (engine snapshot,
+see engine_store.py; no pickle, so it loads across Python/library versions).
 """
 import os
-import shutil
+import sqlite3
 import sys
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
@@ -22,7 +23,14 @@ def main():
         sys.exit(1)
     os.makedirs(PRE, exist_ok=True)
     print('Copying data.db to prebuilt/data.db')
-    shutil.copy2(DB_SRC, DB_DST)
+    # backup API instead of a file copy: in WAL mode recent commits may still live in data.db-wal
+    src = sqlite3.connect(DB_SRC)
+    dst = sqlite3.connect(DB_DST)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
 
     # serialize recommendation engine
     try:
@@ -36,13 +44,12 @@ def main():
 
     if engine is not None:
         try:
-            import joblib
-            dst = os.path.join(PRE, 'engine.joblib')
-            print('Serializing engine to', dst)
-            joblib.dump(engine, dst)
-            print('Engine serialized')
+            dst = os.path.join(PRE, 'engine')
+            print('Saving engine snapshot to', dst)
+            manifest = engine.save(dst)
+            print('Engine saved:', manifest['n_products'], 'products')
         except Exception as e:
-            print('Failed to serialize engine:', e)
+            print('Failed to save engine:', e)
     else:
         print('Engine not present; skipped serialization')
 
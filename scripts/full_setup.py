@@ -41,6 +41,11 @@ def main():
         print('Found prebuilt data archive. Restoring data.db from prebuilt/data.db.gz')
         try:
             import gzip, shutil
+            # a WAL journal left from the old database must not be replayed onto the restored one
+            for suffix in ('-wal', '-shm'):
+                stale = os.path.join(ROOT, 'data.db' + suffix)
+                if os.path.exists(stale):
+                    os.remove(stale)
             with gzip.open(prebuilt_db_gz, 'rb') as f_in:
                 with open(os.path.join(ROOT, 'data.db'), 'wb') as f_out:
                     shutil.copyfileobj(f_in, f_out)
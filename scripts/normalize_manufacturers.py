@@ -1,20 +1,40 @@
-import sqlite3
-import re
+"""
+Normalize manufacturer spellings in `goods` and sync the canonical dictionary.
+
+Usage:
+  python scripts/normalize_manufacturers.py
+  python scripts/normalize_manufacturers.py --alias "Robert Bosch=Bosch"
+
+Normalization rules live in manufacturers.py (shared with the recommendation engine).
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db_connection
+import manufacturers
+
+DB = db_connection.DB_PATH
 
-DB = 'data.db'
 
 def normalize(name: str) -> str:
-    if not name:
-        return ''
-    s = name.lower()
-    s = re.sub(r"\b(llc|ltd|inc|corp|corporation|gmbh|srl|oy|sa|limited)\b", "", s)
-    s = re.sub(r"[^a-z0-9а-яё\s]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
     # titlecase for DB readability
-    return s.title()
+    return manufacturers.normalize_manufacturer(name).title()
+
 
 if __name__ == '__main__':
-    conn = sqlite3.connect(DB)
+    conn = db_connection.connect(DB)
+    manufacturers.ensure_schema(conn)
+    args = sys.argv[1:]
+    while '--alias' in args:
+        i = args.index('--alias')
+        alias, _, canonical = args[i + 1].partition('=')
+        manufacturers.add_alias(conn, alias, canonical)
+        print(f'alias "{alias}" -> "{canonical}"')
+        del args[i:i + 2]
+
     cur = conn.cursor()
     cur.execute('SELECT DISTINCT manufacturer FROM goods')
     rows = [r[0] for r in cur.fetchall() if r[0] is not None]
@@ -24,8 +44,10 @@ if __name__ == '__main__':
         if norm != (orig or '').strip():
             cur.execute('UPDATE goods SET manufacturer = ? WHERE manufacturer = ?', (norm, orig))
             changes.append((orig, norm))
+    updated = manufacturers.sync_goods(conn)
     conn.commit()
     conn.close()
     print(f'Normalized {len(changes)} manufacturer values')
     for o, n in changes[:50]:
         print(f'"{o}" -> "{n}"')
+    print(f'manufacturer_id set on {updated} goods rows')
@@ -41,14 +41,14 @@ if __name__ == '__main__':
             cosine_similarities[idx] = -1
 
             items = []
-            max_pop = max((p.get('popularity', 0) for p in engine.products), default=1)
+            max_pop = float(engine.popularity.max()) if len(engine.popularity) else 1
             alpha = 0.8
             beta = 0.2
             for i, cos in enumerate(cosine_similarities):
                 if i == idx:
                     continue
                 p = engine.products[i]
-                pop = float(p.get('popularity', 0))
+                pop = float(engine.popularity[i])
                 pop_norm = pop / max_pop if max_pop > 0 else 0.0
                 final_score = alpha * float(cos) + beta * pop_norm
                 items.append({
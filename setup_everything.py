@@ -5,11 +5,12 @@
 
 import os
 import subprocess
-import sqlite3
+
+import db_connection
 
 def check_db_exists():
     """Проверка наличия БД"""
-    return os.path.exists('data.db')
+    return os.path.exists(db_connection.DB_PATH)
 
 def run_script(script_name, description):
     """Запуск python скрипта"""
@@ -87,7 +88,7 @@ def full_pipeline(users=200, orders=1000, cart=300):
     print("█" * 80)
     
     # Выводим финальную информацию
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     print("\n📈 ИТОГОВАЯ СТАТИСТИКА:")
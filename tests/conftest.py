@@ -0,0 +1,61 @@
+import os
+import sys
+
+# modules live at the repository root (no package), same as app.py imports them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+
+import pytest
+
+BASE_GOODS = [
+    ('Двигатель V8 5.0L', '450000', '/static/img/engine.svg', 'Мощный бензиновый двигатель V8 с алюминиевым блоком',
+     'Двигатели', 'BMW, Mercedes, Range Rover', 'Bosch'),
+    ('Коробка передач автомат 8-ступ', '180000', '/static/img/transmission.svg',
+     'Надежная автоматическая коробка передач с гидравликой', 'Коробки передач', 'BMW X5, Mercedes GLE, Audi Q7', 'ZF'),
+    ('Тормозные колодки керамика', '12000', '/static/img/brake_pads.svg', 'Керамические тормозные колодки с низким износом',
+     'Тормозная система', 'Все модели', 'Brembo'),
+    ('Амортизатор пневматический', '85000', '/static/img/shock_absorber.svg',
+     'Пневматический амортизатор с электроуправлением', 'Подвеска', 'Land Rover, BMW X5, Mercedes', 'Continental'),
+    ('Масляный фильтр Premium', '3500', '/static/img/oil_filter.svg', 'Фильтр тонкой очистки моторного масла',
+     'Фильтры', 'Все модели', 'Mann'),
+    ('Воздушный фильтр спортивный', '8500', '/static/img/air_filter.svg', 'Спортивный воздушный фильтр нулевого сопротивления',
+     'Фильтры', 'BMW, Audi, Volkswagen', 'K&N'),
+    ('Свечи зажигания иридиевые', '6000', '/static/img/spark_plug.svg', 'Иридиевые свечи зажигания с долгим ресурсом',
+     'Двигатели', 'Toyota Camry, Kia Rio', 'NGK'),
+    ('Тормозной диск вентилируемый', '22000', '/static/img/brake_disc.svg', 'Вентилируемый тормозной диск для спортивной езды',
+     'Тормозная система', 'Audi A4, BMW 3', 'Brembo'),
+]
+
+
+def create_catalog(path: str, clones: int = 3, users: int = 6) -> str:
+    """БД со схемой app.init_db: товары BASE_GOODS, их клоны («— sample N»), пользователи и заказы."""
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, login TEXT UNIQUE NOT NULL, password TEXT NOT NULL,
+                            email TEXT UNIQUE NOT NULL, role TEXT DEFAULT 'user', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE goods (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, price TEXT NOT NULL, image TEXT NOT NULL,
+                            description TEXT, category TEXT, compatibility TEXT, manufacturer TEXT, warranty TEXT, stock INTEGER);
+        CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, fio TEXT NOT NULL, phone TEXT NOT NULL, email TEXT NOT NULL,
+                             comment TEXT NOT NULL, product_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE cart (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, product_id INTEGER NOT NULL,
+                           quantity INTEGER DEFAULT 1, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    ''')
+    rows = [g + ('2 года', 10) for g in BASE_GOODS]
+    for n in range(1, clones + 1):
+        rows.extend((f'{g[0]} — sample {n}',) + g[1:] + ('2 года', 10) for g in BASE_GOODS)
+    conn.executemany('INSERT INTO goods (name, price, image, description, category, compatibility, manufacturer, '
+                     'warranty, stock) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    for u in range(1, users + 1):
+        conn.execute('INSERT INTO users (login, password, email) VALUES (?, ?, ?)', (f'user{u}', 'x', f'user{u}@example.com'))
+        for product_id in (u, u % len(BASE_GOODS) + 1, 2 * u):
+            conn.execute("INSERT INTO orders (fio, phone, email, comment, product_id) VALUES ('Покупатель', '1', ?, '', ?)",
+                         (f'user{u}@example.com', product_id))
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def catalog_db(tmp_path):
+    return create_catalog(str(tmp_path / 'data.db'))
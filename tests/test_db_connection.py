@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db_connection
+
+
+def test_connect_applies_pragmas(tmp_path):
+    conn = db_connection.connect(str(tmp_path / 'data.db'))
+    try:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        # NORMAL
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert conn.execute('PRAGMA cache_size').fetchone()[0] == -db_connection.CACHE_SIZE_KB
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == db_connection.BUSY_TIMEOUT_MS
+    finally:
+        conn.close()
+
+
+def test_thread_connection_is_reused_until_released(tmp_path):
+    path = str(tmp_path / 'data.db')
+    conn = db_connection.thread_connection(path)
+    try:
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.execute('INSERT INTO t VALUES (1)')
+        # close() in handlers and helpers keeps the shared connection open
+        conn.close()
+        assert db_connection.thread_connection(path) is conn
+        assert conn.execute('SELECT x FROM t').fetchone()['x'] == 1
+        other = []
+
+        def in_thread():
+            other.append(db_connection.thread_connection(path) is conn)
+            db_connection.close_thread_connections()
+        thread = threading.Thread(target=in_thread)
+        thread.start()
+        thread.join()
+        assert other == [False]
+    finally:
+        db_connection.close_thread_connections()
+    # the open transaction was rolled back on release
+    assert sqlite3.connect(path).execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    assert db_connection.thread_connection(path) is not conn
+    db_connection.close_thread_connections()
+
+
+def test_readers_do_not_wait_for_a_writer(tmp_path):
+    path = str(tmp_path / 'data.db')
+    writer = db_connection.connect(path)
+    reader = db_connection.connect(path, timeout=0)
+    try:
+        writer.execute('CREATE TABLE t (x INTEGER)')
+        writer.commit()
+        writer.execute('BEGIN IMMEDIATE')
+        writer.execute('INSERT INTO t VALUES (1)')
+        assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+        writer.commit()
+    finally:
+        writer.close()
+        reader.close()
+
+
+def test_flask_request_gets_one_connection(tmp_path):
+    from flask import Flask
+    app = Flask(__name__)
+    app.config['DATABASE'] = str(tmp_path / 'data.db')
+    db_connection.init_app(app)
+    with app.app_context():
+        conn = db_connection.get_db()
+        assert db_connection.get_db() is conn
+    # released in teardown
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
@@ -0,0 +1,34 @@
+import json
+
+import recommendations
+from recommendations import RecommendationEngine
+
+
+def _load(tmp_path, monkeypatch, cfg):
+    # _load_weights reads reco_config.json next to the module
+    (tmp_path / 'reco_config.json').write_text(json.dumps(cfg), encoding='utf-8')
+    monkeypatch.setattr(recommendations, '__file__', str(tmp_path / 'recommendations.py'))
+    return RecommendationEngine(str(tmp_path / 'data.db'), build=False)
+
+
+def test_bad_values_are_skipped_one_by_one(tmp_path, monkeypatch, capsys):
+    engine = _load(tmp_path, monkeypatch, {
+        'w_text': 'много', 'w_category': 0.5, 'alpha': 0.9, 'candidate_min': 7, 'graph_k': [3],
+        'use_candidates': 'false', 'hashing_dir': 5, 'prefetch_neighbors': False,
+        'profiles': {'broken': {'w_text': 'x'}, 'fast': {'w_popularity': 0.3}}})
+    # a bad key keeps its default and does not stop the keys after it
+    assert (engine.w_text, engine.w_category, engine.candidate_min, engine.graph_k) == (0.6, 0.5, 7, 10)
+    assert engine.use_candidates is True and engine.hashing_dir is None and engine.prefetch_neighbors is False
+    assert sorted(engine.profiles) == ['fast'] and engine.profiles['fast']['w_category'] == 0.5
+    out = capsys.readouterr().out
+    for key in ('w_text', 'graph_k', 'use_candidates', 'hashing_dir', "'broken'"):
+        assert key in out
+
+
+def test_legacy_keys_and_unreadable_file(tmp_path, monkeypatch, capsys):
+    engine = _load(tmp_path, monkeypatch, {'alpha': 0.9, 'beta': 0.05, 'cat_weight': 2})
+    assert (engine.w_text, engine.w_popularity, engine.cat_scale) == (0.9, 0.05, 2.0)
+    (tmp_path / 'reco_config.json').write_text('{"w_text": ', encoding='utf-8')
+    engine._load_weights()
+    assert engine.w_text == 0.9
+    assert 'reco_config.json не прочитан' in capsys.readouterr().out
@@ -0,0 +1,111 @@
+import os
+import socket
+import struct
+import threading
+
+import pytest
+
+import engine_rpc
+
+
+class FakeEngine:
+    products = {5: [{'id': 7, 'score': 0.5, 'name': 'Фильтр', 'price': '100', 'image': None}]}
+
+    def recommend_for(self, product_id, top_k=5, vehicle=None, use_candidates=True, profile=None, user_id=None):
+        if product_id not in self.products:
+            return None
+        return f'{profile or "default"}:{user_id}:{vehicle}', self.products[product_id][:top_k]
+
+    def recommend_many(self, product_ids, top_k=5, vehicle=None, profile=None):
+        return {pid: self.products.get(pid, []) for pid in product_ids}
+
+
+def test_items_round_trip_long_and_missing_strings():
+    items = [{'id': 1, 'score': 0.25, 'name': 'Масло ' * 20000, 'price': None, 'image': '/i.svg'},
+             {'id': -2, 'score': 1.0, 'name': '', 'price': '10', 'image': None}]
+    decoded, offset = engine_rpc.unpack_items(engine_rpc.pack_items(items) + b'tail')
+    assert offset == len(engine_rpc.pack_items(items))
+    # strings are cut to the uint16 length on UTF-8 boundaries decoded with 'replace'
+    assert len(decoded[0]['name'].encode('utf-8')) <= engine_rpc._MAX_STR + 3
+    assert decoded[0]['price'] is None and decoded[1]['image'] is None
+    assert [(d['id'], d['score']) for d in decoded] == [(1, 0.25), (-2, 1.0)]
+
+
+def test_item_values_keep_their_types():
+    items = [{'id': 3, 'score': 0.5, 'name': 'Фильтр', 'price': 450000, 'image': None},
+             {'id': 4, 'score': 0.25, 'name': 'Диск', 'price': 99.5, 'image': '/i.svg'}]
+    decoded, _ = engine_rpc.unpack_items(engine_rpc.pack_items(items))
+    assert decoded == items
+    assert [type(d['price']) for d in decoded] == [int, float]
+
+
+def test_server_refuses_a_shared_socket_directory(tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    os.chmod(shared, 0o777)
+    with pytest.raises(engine_rpc.EngineRPCError):
+        engine_rpc.EngineServer(str(shared / 'engine.sock'), FakeEngine())
+    private = tmp_path / 'private' / 'engine.sock'
+    server = engine_rpc.EngineServer(str(private), FakeEngine())
+    try:
+        assert os.stat(private.parent).st_mode & 0o777 == 0o700
+        assert os.stat(private).st_mode & 0o077 == 0
+    finally:
+        server.server_close()
+
+
+def test_frames_over_a_socket_pair():
+    left, right = socket.socketpair()
+    try:
+        engine_rpc.send_frame(left, engine_rpc.OP_CALL, b'x' * 70000)
+        engine_rpc.send_frame(left, engine_rpc.OP_QUERY, b'')
+        assert engine_rpc.recv_frame(right) == (engine_rpc.OP_CALL, b'x' * 70000)
+        assert engine_rpc.recv_frame(right) == (engine_rpc.OP_QUERY, b'')
+        left.close()
+        with pytest.raises(ConnectionError):
+            engine_rpc.recv_frame(right)
+    finally:
+        right.close()
+
+
+def _query(product_id, user_id=None):
+    return (engine_rpc._QUERY.pack(product_id, 5, True) + engine_rpc._pack_str('BMW X5')
+            + engine_rpc._pack_str(None) + engine_rpc._pack_str(user_id))
+
+
+def test_query_returns_profile_and_items():
+    reply = engine_rpc.handle_request(FakeEngine(), engine_rpc.OP_QUERY, _query(5, '42'))
+    profile, offset = engine_rpc._unpack_str(reply, 0)
+    assert profile == 'default:42:BMW X5'
+    assert engine_rpc.unpack_items(reply, offset)[0] == FakeEngine.products[5]
+
+
+def test_unknown_product_is_a_status_code(tmp_path):
+    path = str(tmp_path / 'engine.sock')
+    server = engine_rpc.EngineServer(path, FakeEngine())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = engine_rpc.EngineClient(path)
+    try:
+        with pytest.raises(engine_rpc.UnknownProductError):
+            client._request(engine_rpc.OP_QUERY, _query(404))
+        assert client.recommend_for(404) is None
+        assert client.get_recommendations(404) == []
+        assert client.recommend_for(5, user_id=3) == ('default:3:None', FakeEngine.products[5])
+        # errors come back as STATUS_ERROR and keep the connection usable
+        with pytest.raises(engine_rpc.EngineRPCError):
+            client._request(99, b'')
+        assert client.recommend_many([5, 6])[5] == FakeEngine.products[5]
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_batch_body_layout():
+    body = (engine_rpc._COUNT.pack(3) + engine_rpc._pack_str(None) + engine_rpc._pack_str(None)
+            + engine_rpc._COUNT.pack(2) + struct.pack('!2q', 5, 6))
+    reply = engine_rpc.handle_request(FakeEngine(), engine_rpc.OP_BATCH, body)
+    (n,) = engine_rpc._COUNT.unpack_from(reply, 0)
+    (first,) = engine_rpc._ID.unpack_from(reply, engine_rpc._COUNT.size)
+    assert (n, first) == (2, 5)
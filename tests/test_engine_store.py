@@ -0,0 +1,60 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import engine_store
+from recommendations import RecommendationEngine
+
+
+@pytest.fixture
+def engine(catalog_db):
+    engine = RecommendationEngine(catalog_db)
+    engine.warmup_top_n = 0
+    return engine
+
+
+def test_snapshot_round_trip_gives_same_model(engine, catalog_db, tmp_path):
+    path = str(tmp_path / 'snapshot')
+    manifest = engine.save(path)
+    assert set(manifest['files']) == {engine_store.ARRAYS, engine_store.VOCAB, engine_store.PRODUCTS, engine_store.TOKENS}
+
+    loaded = RecommendationEngine.load(path, catalog_db)
+    assert loaded.ids == engine.ids
+    assert (loaded.matrix_text != engine.matrix_text).nnz == 0
+    assert np.array_equal(loaded.duplicates.cluster, engine.duplicates.cluster)
+    # text signatures come from the snapshot, so validation finds nothing changed
+    assert loaded.update_products() == 'metadata'
+    for product_id in engine.ids[:8]:
+        assert loaded.get_recommendations(product_id) == engine.get_recommendations(product_id)
+        assert loaded.get_recommendations(product_id, vehicle='BMW X5') == engine.get_recommendations(product_id, vehicle='BMW X5')
+    assert loaded.search('тормозной диск') == engine.search('тормозной диск')
+
+
+def test_load_defers_derived_indexes(engine, catalog_db, tmp_path):
+    path = str(tmp_path / 'snapshot')
+    engine.save(path)
+    loaded = RecommendationEngine.load(path, catalog_db, validate=False)
+    state = loaded.model_state()
+    # clusters are read from the snapshot; the rest is built on first use
+    assert not state.is_deferred('duplicates')
+    loaded.get_recommendations(engine.ids[0])
+    assert not state.is_deferred('fitment') and not state.is_deferred('candidates')
+
+
+def test_corrupted_snapshot_is_rejected(engine, tmp_path):
+    path = str(tmp_path / 'snapshot')
+    engine.save(path)
+    with open(os.path.join(path, engine_store.PRODUCTS), 'a', encoding='utf-8') as f:
+        f.write(' ')
+    with pytest.raises(engine_store.SnapshotError):
+        engine_store.read_manifest(path)
+    with open(os.path.join(path, engine_store.MANIFEST), 'r+', encoding='utf-8') as f:
+        manifest = json.load(f)
+        manifest['version'] = engine_store.FORMAT_VERSION + 1
+        f.seek(0)
+        json.dump(manifest, f)
+        f.truncate()
+    with pytest.raises(engine_store.SnapshotError):
+        engine_store.read_manifest(path)
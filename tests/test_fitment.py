@@ -0,0 +1,54 @@
+import sqlite3
+
+import numpy as np
+
+import fitment
+import migrations
+
+
+def test_parse_compatibility_inherits_make_and_normalizes_aliases():
+    assert fitment.parse_compatibility('BMW 3, 5 Series, Mercedes-Benz GLE') == [
+        ('bmw', '3'), ('bmw', '5'), ('mercedes', 'gle')]
+    assert fitment.parse_compatibility('Land Rover Discovery, бмв X5') == [('land rover', 'discovery'), ('bmw', 'x5')]
+
+
+def test_parse_compatibility_universal_and_empty():
+    assert fitment.parse_compatibility('Все модели') == [(fitment.UNIVERSAL, '')]
+    assert fitment.parse_compatibility('') == []
+    assert fitment.parse_compatibility(None) == []
+    # repeated mentions are listed once
+    assert fitment.parse_compatibility('Audi A4, audi a4') == [('audi', 'a4')]
+
+
+def test_index_mask_follows_matching_rules():
+    index = fitment.FitmentIndex.from_compatibility(['BMW X5', 'BMW', 'Все модели', 'Audi A4', 'BMW 3'])
+    # exact model, make-wide product and universal product
+    assert np.flatnonzero(index.mask('BMW X5')).tolist() == [0, 1, 2]
+    # make-only query finds every product of the make
+    assert np.flatnonzero(index.mask('bmw')).tolist() == [0, 1, 2, 4]
+    assert np.flatnonzero(index.mask('Toyota Camry')).tolist() == [2]
+    assert index.mask('') is None
+    assert index.mask('Все модели') is None
+
+
+def test_triggers_queue_goods_written_outside_the_app(catalog_db):
+    conn = sqlite3.connect(catalog_db)
+    migrations.migrate(conn)
+
+    def makes(product_id):
+        return sorted(r[0] for r in conn.execute(
+            'SELECT v.make FROM goods_fitment gf JOIN vehicles v ON v.id = gf.vehicle_id WHERE gf.product_id = ?',
+            (product_id,)))
+
+    assert makes(1) == ['bmw', 'mercedes', 'range rover']
+    conn.execute("UPDATE goods SET compatibility = 'Kia Rio' WHERE id = 1")
+    new_id = conn.execute("INSERT INTO goods (name, price, image, compatibility) VALUES ('Помпа', '1', '', 'Audi A4')").lastrowid
+    conn.execute('DELETE FROM goods WHERE id = 2')
+    conn.commit()
+    # deletes drop fitment at once; inserts and edits wait in the queue for sync_pending
+    assert makes(2) == [] and makes(1) == ['bmw', 'mercedes', 'range rover']
+    assert fitment.sync_pending(conn) == 2
+    conn.commit()
+    assert (makes(1), makes(new_id)) == (['kia'], ['audi'])
+    assert fitment.sync_pending(conn) == 0
+    conn.close()
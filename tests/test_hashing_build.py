@@ -0,0 +1,68 @@
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+from recommendations import RecommendationEngine
+
+
+class HashedEngine(RecommendationEngine):
+    """Движок с build_mode='hashing' поверх той же reco_config.json."""
+
+    hashing_root = None
+
+    def _load_weights(self):
+        super()._load_weights()
+        self.build_mode = 'hashing'
+        self.hashing_chunk_size = 7
+        self.hashing_dir = self.hashing_root
+
+
+@pytest.fixture
+def engines(catalog_db, tmp_path):
+    HashedEngine.hashing_root = str(tmp_path / 'hashed')
+    return RecommendationEngine(catalog_db), HashedEngine(catalog_db)
+
+
+def _similarities(matrix):
+    return (matrix @ matrix.T).toarray()
+
+
+def test_hashing_build_equals_fit(engines):
+    fitted, hashed = engines
+    assert hashed.ids == fitted.ids
+    # no hash collisions in a small vocabulary: the same tf-idf vectors up to column order
+    assert np.allclose(_similarities(hashed.matrix_text), _similarities(fitted.matrix_text))
+    assert np.allclose(_similarities(hashed.matrix_category), _similarities(fitted.matrix_category))
+    assert np.array_equal(hashed.manufacturer_ids, fitted.manufacturer_ids)
+    assert np.array_equal(hashed.duplicates.cluster, fitted.duplicates.cluster)
+    for product_id in fitted.ids[:10]:
+        got = [r['id'] for r in hashed.get_recommendations(product_id, use_candidates=False)]
+        assert got == [r['id'] for r in fitted.get_recommendations(product_id, use_candidates=False)]
+
+
+def test_hashing_build_stays_out_of_core(engines):
+    _, hashed = engines
+    state = hashed.model_state()
+    assert 'description' not in state.products[0]
+    assert state.backend_info['name'] != 'dense'
+    # signatures were taken from full rows while streaming: nothing looks changed
+    assert hashed.update_products() == 'metadata'
+    build_dir = os.listdir(HashedEngine.hashing_root)
+    assert len(build_dir) == 1
+    assert 'minhash.u32' not in os.listdir(os.path.join(HashedEngine.hashing_root, build_dir[0]))
+
+
+def test_enrichment_stays_under_the_parameter_limit(catalog_db, monkeypatch):
+    conn = sqlite3.connect(catalog_db)
+    conn.execute('CREATE TABLE denormalized_data (product_id INTEGER, user_login TEXT, order_status TEXT)')
+    conn.executemany('INSERT INTO denormalized_data VALUES (?, ?, ?)', [(i, f'user{i}', 'выполнен') for i in range(1, 33)])
+    monkeypatch.setattr(RecommendationEngine, 'ENRICHMENT_BATCH', 5)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    extras = RecommendationEngine._enrichment(conn, list(range(1, 33)))
+    assert len(extras) == 32 and extras[7] == ('user7', 'выполнен')
+    # one IN list per ENRICHMENT_BATCH ids, whatever the chunk size of the caller
+    assert sum('FROM denormalized_data WHERE' in s for s in statements) == 7
+    conn.close()
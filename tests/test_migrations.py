@@ -0,0 +1,61 @@
+import sqlite3
+
+import migrations
+from conftest import create_catalog
+
+
+def _schema(conn):
+    return sorted(conn.execute("SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'").fetchall(),
+                  key=lambda r: (r[0], r[1]))
+
+
+def test_migrate_is_idempotent(tmp_path):
+    conn = sqlite3.connect(create_catalog(str(tmp_path / 'data.db')))
+    # duplicate cart rows left by concurrent adds before the unique index existed
+    conn.executemany('INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)', [(1, 2, 1), (1, 2, 3), (2, 2, 1)])
+    conn.commit()
+
+    applied = migrations.migrate(conn)
+    assert applied == [name for _, name, _ in migrations.MIGRATIONS]
+    assert migrations.current_version(conn) == migrations.MIGRATIONS[-1][0]
+    schema = _schema(conn)
+    assert migrations.migrate(conn) == []
+    assert _schema(conn) == schema
+    # running every migration body again on a migrated database changes nothing either
+    for _, _, apply in migrations.MIGRATIONS:
+        apply(conn)
+    conn.commit()
+    assert _schema(conn) == schema
+    conn.close()
+
+
+def test_migrations_add_columns_indexes_and_merge_cart(tmp_path):
+    conn = sqlite3.connect(create_catalog(str(tmp_path / 'data.db')))
+    conn.executemany('INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)', [(1, 2, 1), (1, 2, 3), (2, 2, 1)])
+    conn.commit()
+    migrations.migrate(conn)
+
+    assert {'user_id', 'quantity', 'status'} <= set(migrations._columns(conn, 'orders'))
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_orders_product', 'idx_orders_user_created', 'idx_cart_user_product'} <= indexes
+    assert conn.execute('SELECT user_id, product_id, quantity FROM cart ORDER BY user_id').fetchall() == [(1, 2, 4), (2, 2, 1)]
+    plan = ' '.join(r[3] for r in conn.execute('EXPLAIN QUERY PLAN SELECT product_id, COUNT(*) FROM orders GROUP BY product_id'))
+    assert 'idx_orders_product' in plan
+
+    # change counters follow every write to goods
+    before = conn.execute("SELECT version FROM table_versions WHERE name = 'goods'").fetchone()[0]
+    conn.execute("UPDATE goods SET price = '1' WHERE id = 1")
+    assert conn.execute("SELECT version FROM table_versions WHERE name = 'goods'").fetchone()[0] == before + 1
+    conn.close()
+
+
+def test_migrations_create_the_catalog_side_tables(tmp_path):
+    conn = sqlite3.connect(create_catalog(str(tmp_path / 'data.db')))
+    migrations.migrate(conn)
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'manufacturers', 'manufacturer_aliases', 'vehicles', 'goods_fitment', 'goods_fts'} <= tables
+    assert conn.execute('SELECT COUNT(*) FROM goods WHERE manufacturer_id IS NULL').fetchone()[0] == 0
+    assert conn.execute('SELECT COUNT(DISTINCT product_id) FROM goods_fitment').fetchone()[0] == \
+        conn.execute('SELECT COUNT(*) FROM goods').fetchone()[0]
+    assert conn.execute("SELECT COUNT(*) FROM goods_fts WHERE goods_fts MATCH 'фильтр'").fetchone()[0] > 0
+    conn.close()
@@ -0,0 +1,52 @@
+import numpy as np
+
+import near_duplicates
+from conftest import BASE_GOODS
+from recommendations import RecommendationEngine
+
+FIELDS = ('name', 'price', 'image', 'description', 'category', 'compatibility', 'manufacturer')
+
+
+def _products(clones=2):
+    base = [dict(zip(FIELDS, g)) for g in BASE_GOODS]
+    rows = list(base)
+    for n in range(1, clones + 1):
+        rows.extend({**p, 'name': f"{p['name']} — sample {n}"} for p in base)
+    return rows
+
+
+def test_clones_collapse_to_the_original():
+    products = _products()
+    clusters = near_duplicates.find_clusters(products)
+    n = len(BASE_GOODS)
+    # every clone points at the original (smallest position); originals stay apart
+    assert clusters.cluster.tolist() == list(range(n)) * 3
+    assert clusters.is_representative.tolist() == [True] * n + [False] * 2 * n
+    assert sorted(clusters.members(n + 2).tolist()) == [2, n + 2, 2 * n + 2]
+    assert clusters.stats() == {'clusters': n, 'collapsed_products': 2 * n}
+
+
+def test_distinct_products_give_no_clusters():
+    assert near_duplicates.find_clusters(_products(clones=0)) is None
+    assert near_duplicates.find_clusters(_products()[:1]) is None
+
+
+def test_signatures_in_chunks_match_one_pass():
+    texts = [near_duplicates.product_text(p) for p in _products()]
+    whole = near_duplicates.signatures(near_duplicates.shingle_matrix(texts))
+    parts = np.vstack([near_duplicates.signatures(near_duplicates.shingle_matrix(texts[i:i + 5]))
+                       for i in range(0, len(texts), 5)])
+    assert np.array_equal(whole, parts)
+    assert np.array_equal(near_duplicates.clusters_from_signatures(parts).cluster,
+                          near_duplicates.find_clusters(_products()).cluster)
+
+
+def test_engine_results_keep_one_product_per_cluster(catalog_db):
+    engine = RecommendationEngine(catalog_db)
+    cluster = dict(zip(engine.ids, engine.duplicates.cluster.tolist()))
+    for results in (engine.search('тормозной диск'), engine.search('фильтр'), engine.get_recommendations(engine.ids[0])):
+        clusters = [cluster[r['id']] for r in results]
+        assert clusters and len(clusters) == len(set(clusters))
+    # never the product's own clones either
+    own = cluster[engine.ids[0]]
+    assert all(cluster[r['id']] != own for r in engine.get_recommendations(engine.ids[0]))
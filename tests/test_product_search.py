@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+import product_search
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE goods (id INTEGER PRIMARY KEY, name TEXT, price TEXT, image TEXT, description TEXT, '
+                 'category TEXT, manufacturer TEXT, compatibility TEXT)')
+    # equal names give equal ranks: pages must still neither repeat nor skip products
+    rows = [(i, f'Масляный фильтр {i % 3}', '100', '', 'фильтр для двигателя', 'Фильтры', 'Mann', 'BMW X5')
+            for i in range(1, 48)]
+    rows.append((100, 'Тормозной диск', '200', '', 'диск', 'Тормоза', 'Brembo', 'Audi A4'))
+    conn.executemany('INSERT INTO goods VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    product_search.ensure_schema(conn)
+    yield conn
+    conn.close()
+
+
+def _all_pages(conn, query, limit, **kwargs):
+    ids, cursor, pages = [], None, 0
+    while True:
+        result = product_search.search(conn, query, limit=limit, cursor=cursor, **kwargs)
+        ids.extend(item['id'] for item in result['items'])
+        pages += 1
+        cursor = result['next_cursor']
+        if cursor is None:
+            return ids, pages
+
+
+def test_pages_cover_every_match_once_in_rank_order(conn):
+    ids, pages = _all_pages(conn, 'фильтр', limit=10)
+    assert sorted(ids) == list(range(1, 48))
+    assert pages == 5
+    full = product_search.search(conn, 'фильтр', limit=100)
+    assert [item['id'] for item in full['items']] == ids
+    assert full['next_cursor'] is None
+    scores = [item['score'] for item in full['items']]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_pages_respect_filter_clause(conn):
+    ids, _ = _all_pages(conn, 'фильтр', limit=7, filter_clause=('goods_fts.rowid % 2 = ?', (0,)))
+    assert ids == [i for i in _all_pages(conn, 'фильтр', limit=7)[0] if i % 2 == 0]
+
+
+def test_inserts_between_pages_do_not_shift_the_next_page(conn):
+    first = product_search.search(conn, 'фильтр', limit=10)
+    rest, _ = _all_pages(conn, 'фильтр', limit=10)
+    # a new best match lands before the cursor: the next page neither repeats nor skips rows
+    conn.execute("INSERT INTO goods VALUES (200, 'Фильтр фильтр фильтр', '1', '', 'фильтр', 'Фильтры', '', '')")
+    ids = [item['id'] for item in first['items']]
+    cursor = first['next_cursor']
+    while cursor is not None:
+        result = product_search.search(conn, 'фильтр', limit=10, cursor=cursor)
+        ids.extend(item['id'] for item in result['items'])
+        cursor = result['next_cursor']
+    assert ids == rest
+
+
+def test_cursor_round_trip_and_invalid_cursor():
+    assert product_search.decode_cursor(product_search.encode_cursor(-3.25, 17)) == (-3.25, 17)
+    rank = -1.0 / 3
+    assert product_search.decode_cursor(product_search.encode_cursor(rank, 5)) == (rank, 5)
+    # garbage restarts from the first page
+    assert product_search.decode_cursor('abc') is None
+    assert product_search.decode_cursor('1.5:x') is None
+    assert product_search.decode_cursor(40) is None
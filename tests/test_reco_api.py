@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+import app as shop
+import reco_fallback
+
+
+class FakeEngine:
+    delay = 0.0
+
+    def recommend_for(self, product_id, top_k=5, vehicle=None, profile=None, user_id=None):
+        time.sleep(self.delay)
+        if product_id == 404:
+            return None
+        return 'default', [{'id': 2, 'name': 'Коробка', 'price': '1', 'image': None, 'score': 0.5}]
+
+
+@pytest.fixture
+def client(catalog_db, monkeypatch):
+    monkeypatch.setattr(shop, '_db_initialized', True)
+    monkeypatch.setattr(shop, 'RECO_EAGER_WARMUP', False)
+    monkeypatch.setattr(shop, 'RECO_TIME_BUDGET', 0.1)
+    monkeypatch.setattr(shop, 'top_sellers', reco_fallback.TopSellers(catalog_db))
+    monkeypatch.setattr(shop, 'reco_engine', FakeEngine())
+    return shop.app.test_client()
+
+
+def test_model_path(client):
+    response = client.get('/api/recommendations/1')
+    assert response.headers['X-Reco-Path'] == 'model'
+    assert response.headers['X-Reco-Profile'] == 'default'
+    assert [r['id'] for r in response.get_json()] == [2]
+
+
+def test_timeout_and_cold_start_serve_top_sellers(client, monkeypatch):
+    monkeypatch.setattr(FakeEngine, 'delay', 0.5)
+    response = client.get('/api/recommendations/1')
+    assert response.headers['X-Reco-Fallback-Reason'] == 'timeout'
+    # product 1 is a "Двигатели" seller: same-category hits come first
+    assert response.headers['X-Reco-Path'] == 'fallback-category'
+    items = response.get_json()
+    assert items and 1 not in [r['id'] for r in items]
+
+    monkeypatch.setattr(FakeEngine, 'delay', 0.0)
+    response = client.get('/api/recommendations/404')
+    assert response.headers['X-Reco-Fallback-Reason'] == 'cold_start'
+    assert response.headers['X-Reco-Path'] == 'fallback-global'
+    assert shop.top_sellers.stats()['served']['fallback-category:timeout'] == 1
+
+
+def test_engine_not_ready(client, monkeypatch):
+    monkeypatch.setattr(shop, 'reco_engine', None)
+    monkeypatch.setattr(shop, 'warm_up_reco_engine', lambda: None)
+    response = client.get('/api/recommendations/3')
+    assert response.headers['X-Reco-Fallback-Reason'] == 'not_ready'
+    assert response.get_json()
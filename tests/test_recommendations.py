@@ -0,0 +1,219 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import candidates
+import reco_graph
+from recommendations import RecommendationEngine
+
+
+@pytest.fixture
+def engine(catalog_db):
+    engine = RecommendationEngine(catalog_db)
+    engine.warmup_top_n = 0
+    return engine
+
+
+def test_metadata_update_publishes_copies(engine, catalog_db):
+    before = engine.model_state()
+    old_price = before.products[0]['price']
+    conn = sqlite3.connect(catalog_db)
+    conn.execute("UPDATE goods SET price = '1' WHERE id = ?", (engine.ids[0],))
+    conn.commit()
+    conn.close()
+
+    assert engine.update_products() == 'metadata'
+    after = engine.model_state()
+    # the published state is never changed in place: readers of the old one keep old prices
+    assert after is not before and after.ids is before.ids
+    assert before.products[0]['price'] == old_price and after.products[0]['price'] == '1'
+    assert after.products[1] is before.products[1]
+    assert engine._result_item(0, 1.0)['price'] == '1'
+
+
+def test_popularity_refresh_keeps_products_and_sets_timestamp(engine, catalog_db):
+    state = engine.model_state()
+    conn = sqlite3.connect(catalog_db)
+    conn.executemany("INSERT INTO orders (fio, phone, email, comment, product_id) VALUES ('x', '1', 'x', '', ?)",
+                     [(engine.ids[-1],)] * 5)
+    conn.commit()
+    conn.close()
+    engine.popularity_updated_at = None
+
+    assert engine.refresh_popularity()
+    new = engine.model_state()
+    assert new.products is state.products and 'popularity' not in new.products[-1]
+    assert new.popularity[-1] == state.popularity[-1] + 5
+    assert engine.popularity_updated_at is not None
+    assert engine.explain(engine.ids[0], per_page=100)['items']
+
+
+def test_snapshot_load_sets_popularity_timestamp(engine, catalog_db, tmp_path):
+    path = str(tmp_path / 'snapshot')
+    engine.save(path)
+    loaded = RecommendationEngine.load(path, catalog_db, validate=False)
+    # candidates are deferred after a load; the timestamp must not wait for them
+    assert loaded.model_state().is_deferred('candidates')
+    assert loaded.popularity_updated_at is not None
+    assert list(loaded.popularity) == list(engine.popularity)
+
+
+def test_update_products_streams_and_stops_at_the_first_change(engine, catalog_db, monkeypatch):
+    monkeypatch.setattr(RecommendationEngine, 'SIGNATURE_CHUNK', 3)
+    conn = sqlite3.connect(catalog_db)
+    conn.execute("UPDATE goods SET image = '/x.svg' WHERE id = ?", (engine.ids[-1],))
+    conn.commit()
+    assert engine.update_products() == 'metadata'
+    assert engine.products[-1]['image'] == '/x.svg'
+    conn.execute("UPDATE goods SET name = 'Помпа' WHERE id = ?", (engine.ids[-1],))
+    conn.commit()
+    assert engine.update_products() == 'rebuild'
+    conn.execute('DELETE FROM goods WHERE id = ?', (engine.ids[-1],))
+    conn.commit()
+    conn.close()
+    assert engine.update_products() == 'rebuild'
+    assert engine.update_products() == 'metadata'
+
+
+def _wait_for_graph(engine):
+    thread = engine._graph_thread
+    if thread is not None:
+        thread.join(timeout=30)
+
+
+def test_graph_builds_in_background_and_old_one_is_served(engine, catalog_db, monkeypatch):
+    seed = engine.ids[0]
+    # the first request only schedules the build
+    assert engine.graph_recommendations(seed) == []
+    _wait_for_graph(engine)
+    first = engine.graph
+    assert first is not None and engine.graph_recommendations(seed)
+    similarity = engine._graph_similarity[2]
+
+    started, release = threading.Event(), threading.Event()
+    co_purchase_graph = reco_graph.co_purchase_graph
+
+    def slow_co_purchase(conn, ids):
+        started.set()
+        release.wait(timeout=30)
+        return co_purchase_graph(conn, ids)
+    monkeypatch.setattr(reco_graph, 'co_purchase_graph', slow_co_purchase)
+
+    conn = sqlite3.connect(catalog_db)
+    conn.executemany("INSERT INTO orders (fio, phone, email, comment, product_id) VALUES ('x', '1', 'y', '', ?)",
+                     [(engine.ids[0],), (engine.ids[-1],)])
+    conn.commit()
+    conn.close()
+    assert engine.refresh_popularity()
+    assert started.wait(timeout=30)
+    # while the new graph is being built, queries keep using the published one
+    assert engine.graph is first and engine.graph_recommendations(seed)
+    release.set()
+    _wait_for_graph(engine)
+    assert engine.graph is not first
+    # popularity changes reuse the similarity graph
+    assert engine._graph_similarity[2] is similarity
+
+
+def _rebuilt(catalog_db, **settings):
+    engine = RecommendationEngine(catalog_db, build=False)
+    engine.warmup_top_n = 0
+    for name, value in settings.items():
+        setattr(engine, name, value)
+    engine._build()
+    return engine
+
+
+def test_candidates_keep_recall_of_full_scoring(catalog_db):
+    engine = _rebuilt(catalog_db, scoring_backend='sparse', candidate_min=5, candidate_backfill=2)
+    idx = engine.model_state()._positions[engine.ids[0]]
+    assert len(engine._candidate_positions(idx)) < len(engine.ids)
+    report = engine.candidate_recall(sample=len(engine.ids), top_k=5)
+    assert report['fallback_rate'] < 1.0 and report['avg_candidates'] < len(engine.ids)
+    assert report['recall'] >= 0.9
+    # too few candidates: the full scan
+    engine.candidate_min = len(engine.ids)
+    assert engine._candidate_positions(idx) is None
+
+
+def test_profiles_share_matrices_and_split_users(engine):
+    engine.profiles = {'text': {'w_text': 1.0, 'w_category': 0.0, 'w_manufacturer': 0.0, 'w_popularity': 0.0}}
+    engine.profile_split = [engine.DEFAULT_PROFILE, 'text']
+    state = engine.model_state()
+    seed = engine.ids[0]
+    default = engine.get_recommendations(seed, top_k=5)
+    text = engine.get_recommendations(seed, top_k=5, profile='text')
+    assert [r['id'] for r in default] != [r['id'] for r in text]
+    # one set of matrices for every profile
+    assert engine.model_state() is state
+    assert engine.weights('unknown') == engine.weights()
+    # the same user always lands in the same profile, and users are spread over both
+    picks = {engine.profile_for(user_id=u) for u in range(50)}
+    assert picks == {engine.DEFAULT_PROFILE, 'text'}
+    assert all(engine.profile_for(user_id=u) == engine.profile_for(user_id=u) for u in range(50))
+    assert engine.profile_for('text', user_id=1) == 'text'
+
+
+def test_rebuild_reports_only_changed_lists(engine, catalog_db):
+    engine.prefetch_neighbors = False
+    for product_id in engine.ids:
+        engine.get_recommendations(product_id)
+    deltas = []
+    engine.result_listeners.append(deltas.append)
+    conn = sqlite3.connect(catalog_db)
+    conn.execute("UPDATE goods SET name = 'Помпа водяная', category = 'Охлаждение' WHERE id = ?", (engine.ids[-1],))
+    conn.commit()
+    conn.close()
+
+    assert engine.update_products() == 'rebuild'
+    delta = engine.last_result_delta
+    assert delta['checked'] == len(engine.ids)
+    assert 0 < len(delta['changed']) < len(engine.ids)
+    assert deltas == [set(delta['changed'])]
+    # cached lists are the ones a fresh computation returns, changed or not
+    for product_id in engine.ids:
+        fresh = engine._compute_recommendations(product_id)
+        assert [r['id'] for r in engine.get_recommendations(product_id)] == [r['id'] for r in fresh]
+
+
+def test_related_returns_goods_and_services_in_one_call(catalog_db):
+    conn = sqlite3.connect(catalog_db)
+    conn.execute('CREATE TABLE services (id INTEGER PRIMARY KEY, name TEXT, address TEXT, phone TEXT, '
+                 'services TEXT, description TEXT)')
+    conn.executemany('INSERT INTO services (name, address, phone, services, description) VALUES (?, ?, ?, ?, ?)', [
+        ('Тормозной сервис', 'ул. Ленина, 1', '1', 'замена тормозных колодок и дисков', 'Тормозная система'),
+        ('Шиномонтаж', 'ул. Мира, 2', '2', 'сезонная замена шин', 'Колёса'),
+    ])
+    conn.commit()
+    conn.close()
+    engine = _rebuilt(catalog_db)
+
+    related = engine.related(engine.ids[2], top_k=3, services_k=2)
+    assert len(related['goods']) == 3 and {r['type'] for r in related['goods']} == {'goods'}
+    assert related['service'][0]['name'] == 'Тормозной сервис'
+    assert all(r['type'] == 'service' for r in related['service'])
+    assert engine.related(-1) == {'goods': [], 'service': []}
+
+
+def test_warmup_fills_cache_for_top_sellers(catalog_db):
+    engine = _rebuilt(catalog_db, prefetch_neighbors=False)
+    engine.warmup_top_n = 3
+    engine.schedule_warmup()
+    engine._warmup_thread.join(timeout=30)
+    warmup = engine.status()['warmup']
+    assert warmup['state'] == 'done' and warmup['done'] == warmup['total'] == 3
+    assert len(engine.result_cache) == 3
+    assert engine.get_recommendations(engine.ids[int(candidates.top_popular(engine.popularity, 1)[0])])
+
+
+def test_viewed_product_prefetches_its_neighbors(engine):
+    seed = engine.ids[0]
+    shown = engine.get_recommendations(seed, top_k=3)
+    deadline = time.time() + 30
+    while engine.prefetch_stats['computed'] < len(shown) and time.time() < deadline:
+        time.sleep(0.01)
+    assert engine.status()['prefetch']['queued'] == len(shown)
+    for r in shown:
+        assert engine.result_cache.get((r['id'], 3, None, None, True)) is not None
@@ -0,0 +1,18 @@
+import scoring_backend
+
+
+def test_choose_by_catalog_size_nnz_and_memory():
+    assert scoring_backend.choose(1000, 10000)[0] == 'dense'
+    # dense needs 2 * n^2 * 8 bytes: 50k products is far over the 256 MB budget
+    assert scoring_backend.choose(50000, 10 ** 6)[0] == 'sparse'
+    assert scoring_backend.choose(1000000, 10 ** 7)[0] == 'ann'
+    assert scoring_backend.choose(50000, 10 ** 8)[0] == 'ann'
+    # a quarter of the free memory caps the dense budget
+    assert scoring_backend.choose(1000, 10000, memory=4 << 20)[0] == 'sparse'
+
+
+def test_override_and_out_of_core_builds():
+    assert scoring_backend.choose(1000000, 10 ** 7, override='sparse') == ('sparse', 'config override')
+    assert scoring_backend.choose(1000, 10000, override='unknown')[0] == 'dense'
+    assert scoring_backend.choose(1000, 10000, allow_dense=False)[0] == 'sparse'
+    assert scoring_backend.choose(1000, 10000, override='dense', allow_dense=False)[0] == 'sparse'
@@ -0,0 +1,58 @@
+import csv
+import gzip
+import sqlite3
+
+import pytest
+
+import user_recommendations as ur
+from recommendations import RecommendationEngine
+
+
+@pytest.fixture
+def engine(catalog_db):
+    return RecommendationEngine(catalog_db)
+
+
+def test_export_rows_match_single_purchase_recommendations(engine, catalog_db):
+    conn = sqlite3.connect(catalog_db)
+    conn.execute("INSERT INTO users (login, password, email) VALUES ('solo', 'x', 'solo@example.com')")
+    conn.execute("INSERT INTO orders (fio, phone, email, comment, product_id) VALUES ('s', '1', 'solo@example.com', '', 3)")
+    conn.commit()
+    rows = list(ur.iter_recommendations(engine, conn, top_k=4, workers=1))
+    solo = conn.execute("SELECT id FROM users WHERE login = 'solo'").fetchone()[0]
+    mine = [r for r in rows if r[0] == solo]
+    # one purchase: the profile is that product, so the list is its exact recommendation list
+    assert [r[2] for r in mine] == [r['id'] for r in engine.get_recommendations(3, top_k=4, use_candidates=False)]
+    assert [r[1] for r in mine] == list(range(1, len(mine) + 1))
+    conn.close()
+
+
+def test_export_rows_skip_bought_products_and_their_clones(engine, catalog_db):
+    conn = sqlite3.connect(catalog_db)
+    rows = list(ur.iter_recommendations(engine, conn, top_k=5, workers=1, block_users=2))
+    cluster = dict(zip(engine.ids, engine.duplicates.cluster.tolist()))
+    bought = {}
+    for user_id, product_id in conn.execute('SELECT u.id, o.product_id FROM orders o JOIN users u ON u.email = o.email'):
+        bought.setdefault(user_id, set()).add(cluster[product_id])
+    assert {r[0] for r in rows} == set(bought)
+    for user_id, rank, product_id, score in rows:
+        assert cluster[product_id] not in bought[user_id]
+        assert 1 <= rank <= 5 and score > 0
+    # blocks and worker pools do not change the result
+    assert rows == list(ur.iter_recommendations(engine, conn, top_k=5, workers=2, block_users=1))
+    conn.close()
+
+
+def test_write_table_and_file(engine, catalog_db, tmp_path):
+    conn = sqlite3.connect(catalog_db)
+    rows = list(ur.iter_recommendations(engine, conn, top_k=3, workers=1))
+    assert ur.write_table(conn, iter(rows), batch=4) == len(rows)
+    stored = conn.execute(f'SELECT user_id, rank, product_id FROM {ur.TABLE} ORDER BY user_id, rank').fetchall()
+    assert stored == sorted(r[:3] for r in rows)
+    path = str(tmp_path / 'out.csv.gz')
+    assert ur.write_file(path, iter(rows)) == len(rows)
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        lines = list(csv.reader(f))
+    assert lines[0] == ['user_id', 'rank', 'product_id', 'score']
+    assert [tuple(int(x) for x in line[:3]) for line in lines[1:]] == [r[:3] for r in rows]
+    conn.close()
@@ -0,0 +1,87 @@
+"""
+Кэш токенизации для быстрого переобучения TF-IDF.
+
+Токены документа хранятся по хэшу его текста, поэтому при перестройке
+движка заново разбираются только товары, чей текст изменился (после
+массового обновления цен — ни один). Матрица частот строится
+CountVectorizer'ом прямо по закэшированным спискам токенов; результат
+совпадает с TfidfVectorizer.fit_transform на тех же документах.
+
+Кэш сохраняется вместе со снимком движка (engine_store), так что первая
+перестройка после перезапуска процесса тоже разбирает только изменённые товары.
+"""
+import hashlib
+from typing import Dict, List, Tuple
+
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, TfidfVectorizer
+
+# CountVectorizer settings that TfidfVectorizer forwards unchanged
+_COUNT_PARAMS = ('max_df', 'min_df', 'max_features', 'binary', 'dtype')
+
+
+class TokenCache:
+    """Токены документов по хэшу содержимого (для одного набора параметров векторизатора)."""
+
+    def __init__(self, **vectorizer_params):
+        self.params = vectorizer_params
+        self._analyze = TfidfVectorizer(**vectorizer_params).build_analyzer()
+        self._tokens: Dict[str, List[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def keys_for(self, docs: List[str]) -> List[str]:
+        """Ключи документов; токенизируются только документы, которых нет в кэше."""
+        keys = []
+        for doc in docs:
+            key = hashlib.blake2b(doc.encode('utf-8'), digest_size=16).hexdigest()
+            if key in self._tokens:
+                self.hits += 1
+            else:
+                self._tokens[key] = self._analyze(doc)
+                self.misses += 1
+            keys.append(key)
+        return keys
+
+    def retain(self, keys: List[str]):
+        """Оставить в кэше только документы `keys` (текущий корпус)."""
+        live = set(keys)
+        self._tokens = {k: v for k, v in self._tokens.items() if k in live}
+
+    def clear(self):
+        self._tokens = {}
+
+    def to_dict(self) -> Dict:
+        """Содержимое для сохранения (JSON): параметры векторизатора и токены по ключам."""
+        return {'params': self.params, 'tokens': self._tokens}
+
+    def update_from(self, data: Dict) -> int:
+        """Добавить токены из to_dict(); кэш с другими параметрами не подходит (0 — ничего не добавлено)."""
+        if not data or data.get('params') != self.params:
+            return 0
+        tokens = data.get('tokens') or {}
+        self._tokens.update(tokens)
+        return len(tokens)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {'size': len(self._tokens), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
+
+    def fit_tfidf(self, docs: List[str]) -> Tuple[TfidfVectorizer, object]:
+        """Обучить TfidfVectorizer(**params) на `docs`, используя кэш; вернуть (vectorizer, matrix)."""
+        keys = self.keys_for(docs)
+        vec = TfidfVectorizer(**self.params)
+        counter = CountVectorizer(analyzer=self._tokens.__getitem__,
+                                  **{k: getattr(vec, k) for k in _COUNT_PARAMS})
+        counts = counter.fit_transform(keys)
+        transformer = TfidfTransformer(norm=vec.norm, use_idf=vec.use_idf,
+                                       smooth_idf=vec.smooth_idf, sublinear_tf=vec.sublinear_tf)
+        matrix = transformer.fit_transform(counts)
+        # the returned vectorizer transforms raw query text with the same vocabulary and idf
+        vec.vocabulary_ = counter.vocabulary_
+        vec.idf_ = transformer.idf_
+        self.retain(keys)
+        return vec, matrix
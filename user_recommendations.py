@@ -0,0 +1,266 @@
+"""
+Ночная выгрузка персональных рекомендаций для всех пользователей.
+
+Профиль пользователя — строка разреженной матрицы «пользователь x товар»
+по orders (сумма quantity, строка нормирована к 1). Скор товара j для
+пользователя — среднее взвешенное его сходства с купленными товарами,
+тот же взвешенный скор, что у get_recommendations:
+
+  P @ T @ T.T  (текст),  P @ C @ C.T  (категории),
+  (P @ onehot(производитель)) @ manufacturer_sim[:, производитель j],
+  + w_popularity * popularity_norm[j].
+
+Пользователи идут блоками по `block_users` строк: сначала разреженные
+P_block @ T и P_block @ C (узкие — по терминам), затем плотное умножение
+на T.T / C.T даёт блок «пользователи x товары», из которого берутся top_k
+(купленные товары и их почти-дубликаты исключаются, от каждого кластера
+дубликатов — один представитель). Блоки считаются в пуле процессов;
+матрицы модели передаются процессам один раз (initializer).
+
+Результат потоково пишется в таблицу user_recommendations (через
+временную таблицу, заменяется одной транзакцией — читатели не видят
+полувыгрузку) или в сжатый CSV.
+
+Запуск:  python user_recommendations.py --db data.db [--file out.csv.gz]
+"""
+import argparse
+import csv
+import gzip
+import multiprocessing
+import os
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+import db_connection
+
+TABLE = 'user_recommendations'
+
+# model matrices of the current worker process (set by _init_worker)
+_model: Optional[Dict] = None
+
+
+def profile_matrix(conn: sqlite3.Connection, ids: List[int]) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """(id пользователей, матрица профилей users x товары модели) по orders; строки нормированы к 1."""
+    positions = {pid: i for i, pid in enumerate(ids)}
+    # orders created by app.py's init_db have neither user_id nor quantity: match users by email
+    columns = {r[1] for r in conn.execute('PRAGMA table_info(orders)')}
+    user = 'COALESCE(o.user_id, u.id)' if 'user_id' in columns else 'u.id'
+    quantity = 'COALESCE(o.quantity, 1)' if 'quantity' in columns else '1'
+    rows = conn.execute(f'SELECT {user} AS uid, o.product_id, SUM({quantity}) FROM orders o '
+                        f'LEFT JOIN users u ON u.email = o.email '
+                        f'WHERE {user} IS NOT NULL GROUP BY uid, o.product_id ORDER BY uid').fetchall()
+    # products missing from the model (added after the build) do not contribute
+    rows = [r for r in rows if r[1] in positions]
+    users = np.array(sorted({r[0] for r in rows}), dtype=np.int64)
+    if not len(users):
+        return users, sparse.csr_matrix((0, len(ids)))
+    user_pos = np.searchsorted(users, np.array([r[0] for r in rows], dtype=np.int64))
+    cols = np.array([positions[r[1]] for r in rows], dtype=np.int64)
+    data = np.array([max(float(r[2] or 1), 1.0) for r in rows])
+    matrix = sparse.csr_matrix((data, (user_pos, cols)), shape=(len(users), len(ids)))
+    totals = np.asarray(matrix.sum(axis=1)).ravel()
+    return users, sparse.diags(1.0 / totals) @ matrix
+
+
+def model_from_engine(engine, state=None) -> Dict:
+    """Матрицы движка, нужные для скоринга профилей (передаются процессам пула).
+
+    `state` — состояние модели, по позициям которого пронумерованы профили (по умолчанию текущее).
+    """
+    state = state or engine.model_state()
+    n = len(state.ids)
+    duplicates = state.duplicates if engine.collapse_duplicates else None
+    manufacturer = None
+    if state.manufacturer_sim is not None and state.manufacturer_ids is not None:
+        m_ids = np.asarray(state.manufacturer_ids)
+        onehot = sparse.csr_matrix((np.ones(n), (np.arange(n), m_ids)), shape=(n, state.manufacturer_sim.shape[0]))
+        manufacturer = (onehot, np.asarray(state.manufacturer_sim)[:, m_ids])
+    return {
+        'text': state.matrix_text,
+        'category': state.matrix_category,
+        'manufacturer': manufacturer,
+        'popularity': np.asarray(state.popularity_norm, dtype=np.float64),
+        'cluster': None if duplicates is None else duplicates.cluster,
+        'representative': None if duplicates is None else duplicates.is_representative,
+    }
+
+
+def _init_worker(model: Dict):
+    global _model
+    _model = model
+
+
+def score_block(profiles: sparse.csr_matrix, weights: Dict[str, float], top_k: int,
+                model: Dict = None) -> Tuple[np.ndarray, np.ndarray]:
+    """(позиции товаров, скоры) top_k для каждой строки блока; пустые места — позиция -1."""
+    model = model or _model
+    n_users, n = profiles.shape
+    scores = np.zeros((n_users, n))
+    for key, weight in (('text', 'w_text'), ('category', 'w_category')):
+        matrix = model[key]
+        if matrix is not None and weights[weight]:
+            # narrow sparse product first (users x terms), then one dense pass over the products
+            scores += weights[weight] * (profiles @ matrix @ matrix.T).toarray()
+    if model['manufacturer'] is not None and weights['w_manufacturer']:
+        onehot, sim_cols = model['manufacturer']
+        scores += weights['w_manufacturer'] * ((profiles @ onehot).toarray() @ sim_cols)
+    scores += weights['w_popularity'] * model['popularity']
+
+    # no already-bought products, and nothing from their near-duplicate clusters
+    bought = profiles.tocoo()
+    keep = np.ones((n_users, n), dtype=bool)
+    keep[bought.row, bought.col] = False
+    if model['cluster'] is not None:
+        cluster = model['cluster']
+        keep &= model['representative']
+        # users x cluster ids of their purchases, spread back to every member of those clusters
+        bought_clusters = sparse.csr_matrix((np.ones(bought.nnz), (bought.row, cluster[bought.col])), shape=(n_users, n))
+        keep &= ~(bought_clusters[:, cluster].toarray() > 0)
+    scores[~keep | (scores <= 0)] = -np.inf
+
+    k = min(int(top_k), n)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (n_users, 1))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    # score descending, smaller position first on ties (same order as _top_positions)
+    order = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    top[~np.isfinite(top_scores)] = -1
+    return top, top_scores
+
+
+def _score_task(task):
+    rows, profiles, weights, top_k = task
+    top, top_scores = score_block(profiles, weights, top_k)
+    return rows, top, top_scores
+
+
+def iter_recommendations(engine, conn: sqlite3.Connection, top_k: int = 10, block_users: int = 0,
+                         workers: int = 0, budget_mb: int = 256) -> Iterator[Tuple[int, int, int, float]]:
+    """(user_id, место, product_id, скор) для всех пользователей с заказами, блоками по порядку.
+
+    `block_users` = 0 — размер блока по `budget_mb` на плотный блок скоров;
+    `workers` = 0 — по числу ядер, 1 — без пула процессов.
+    """
+    # profiles, scores and returned ids all come from one published model state
+    state = engine.model_state()
+    ids = list(state.ids)
+    users, profiles = profile_matrix(conn, ids)
+    if not len(users) or not ids:
+        return
+    if block_users <= 0:
+        block_users = max(1, int(budget_mb * 1024 * 1024 // (8 * 3 * len(ids))))
+    # users of one weight profile (profile_split) are scored together
+    names = np.array([engine.profile_for(user_id=int(u)) for u in users])
+    tasks = []
+    for name in dict.fromkeys(names.tolist()):
+        group = np.flatnonzero(names == name)
+        weights = engine.weights(None if name == engine.DEFAULT_PROFILE else name)
+        for start in range(0, len(group), block_users):
+            rows = group[start:start + block_users]
+            tasks.append((rows, profiles[rows], weights, top_k))
+
+    model = model_from_engine(engine, state)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        _init_worker(model)
+        results = map(_score_task, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(min(workers, len(tasks)), initializer=_init_worker, initargs=(model,))
+        results = pool.imap(_score_task, tasks)
+    try:
+        for rows, top, top_scores in results:
+            for user_row, positions, values in zip(rows, top, top_scores):
+                user_id = int(users[user_row])
+                for rank, (pos, score) in enumerate(zip(positions, values), start=1):
+                    if pos < 0:
+                        break
+                    yield user_id, rank, ids[pos], float(score)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def write_table(conn: sqlite3.Connection, rows: Iterator[Tuple[int, int, int, float]], batch: int = 10000) -> int:
+    """Записать строки в user_recommendations (замена таблицы целиком одной транзакцией)."""
+    staging = TABLE + '_new'
+    conn.execute(f'DROP TABLE IF EXISTS {staging}')
+    conn.execute(f'''CREATE TABLE {staging} (
+        user_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, rank)
+    )''')
+    conn.commit()
+    written = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= batch:
+            conn.executemany(f'INSERT INTO {staging} (user_id, rank, product_id, score) VALUES (?, ?, ?, ?)', chunk)
+            conn.commit()
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        conn.executemany(f'INSERT INTO {staging} (user_id, rank, product_id, score) VALUES (?, ?, ?, ?)', chunk)
+        written += len(chunk)
+    conn.execute(f'DROP TABLE IF EXISTS {TABLE}')
+    conn.execute(f'ALTER TABLE {staging} RENAME TO {TABLE}')
+    conn.commit()
+    return written
+
+
+def write_file(path: str, rows: Iterator[Tuple[int, int, int, float]]) -> int:
+    """Записать строки в CSV (gzip, если путь оканчивается на .gz); файл заменяется атомарно."""
+    tmp = path + '.tmp'
+    opener = gzip.open if path.endswith('.gz') else open
+    written = 0
+    with opener(tmp, 'wt', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user_id', 'rank', 'product_id', 'score'])
+        for user_id, rank, product_id, score in rows:
+            writer.writerow([user_id, rank, product_id, f'{score:.6f}'])
+            written += 1
+    os.replace(tmp, path)
+    return written
+
+
+def main(argv=None):
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Export top-K recommendations for every user with orders')
+    parser.add_argument('--db', default=db_connection.DB_PATH)
+    parser.add_argument('--snapshot', default=os.path.join(here, 'prebuilt', 'engine'))
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=0, help='processes (0 = CPU count, 1 = no pool)')
+    parser.add_argument('--block-users', type=int, default=0, help='users per block (0 = by --budget-mb)')
+    parser.add_argument('--budget-mb', type=int, default=256, help='memory for one dense score block')
+    parser.add_argument('--file', help='write CSV (.csv or .csv.gz) instead of the user_recommendations table')
+    args = parser.parse_args(argv)
+
+    from recommendations import RecommendationEngine
+    engine = RecommendationEngine.load_or_build(args.db, args.snapshot)
+    started = time.time()
+    conn = db_connection.connect(args.db)
+    try:
+        rows = iter_recommendations(engine, conn, top_k=args.top_k, block_users=args.block_users,
+                                    workers=args.workers, budget_mb=args.budget_mb)
+        if args.file:
+            written = write_file(args.file, rows)
+            target = args.file
+        else:
+            written = write_table(conn, rows)
+            target = TABLE
+    finally:
+        conn.close()
+    print(f'{written} recommendations -> {target} in {time.time() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,21 +2,22 @@
 Утилита для просмотра и экспорта денормализованной таблицы
 """
 
-import sqlite3
 import csv
 import json
 import os
 from datetime import datetime
 import pandas as pd
 
+import db_connection
+
 def view_denormalized_data(limit=20):
     """Показать денормализованные данные в красивом формате"""
     
-    if not os.path.exists('data.db'):
+    if not os.path.exists(db_connection.DB_PATH):
         print("❌ База данных data.db не найдена!")
         return
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     # Проверяем существует ли таблица
@@ -93,11 +94,11 @@ def view_denormalized_data(limit=20):
 def export_to_csv(filename='denormalized_data.csv'):
     """Экспортировать данные в CSV"""
     
-    if not os.path.exists('data.db'):
+    if not os.path.exists(db_connection.DB_PATH):
         print("❌ База данных data.db не найдена!")
         return
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     
     try:
         df = pd.read_sql_query('SELECT * FROM denormalized_data', conn)
@@ -113,11 +114,11 @@ def export_to_csv(filename='denormalized_data.csv'):
 def export_to_json(filename='denormalized_data.json'):
     """Экспортировать данные в JSON"""
     
-    if not os.path.exists('data.db'):
+    if not os.path.exists(db_connection.DB_PATH):
         print("❌ База данных data.db не найдена!")
         return
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     try:
@@ -142,11 +143,11 @@ def export_to_json(filename='denormalized_data.json'):
 def analyze_by_category():
     """Анализ данных по категориям товаров"""
     
-    if not os.path.exists('data.db'):
+    if not os.path.exists(db_connection.DB_PATH):
         print("❌ База данных data.db не найдена!")
         return
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     print("\n📊 АНАЛИЗ ПО КАТЕГОРИЯМ:")
@@ -176,11 +177,11 @@ def analyze_by_category():
 def analyze_by_manufacturer():
     """Анализ данных по производителям"""
     
-    if not os.path.exists('data.db'):
+    if not os.path.exists(db_connection.DB_PATH):
         print("❌ База данных data.db не найдена!")
         return
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     print("\n🏭 АНАЛИЗ ПО ПРОИЗВОДИТЕЛЯМ:")
@@ -210,11 +211,11 @@ def analyze_by_manufacturer():
 def analyze_user_behavior():
     """Анализ поведения пользователей"""
     
-    if not os.path.exists('data.db'):
+    if not os.path.exists(db_connection.DB_PATH):
         print("❌ База данных data.db не найдена!")
         return
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     print("\n👥 АНАЛИЗ ПОВЕДЕНИЯ ПОЛЬЗОВАТЕЛЕЙ:")
@@ -2,17 +2,18 @@
 Простая утилита для просмотра денормализованной таблицы без зависимостей от pandas
 """
 
-import sqlite3
 import os
 
+import db_connection
+
 def view_denormalized_data(limit=20):
     """Показать денормализованные данные в красивом формате"""
     
-    if not os.path.exists('data.db'):
+    if not os.path.exists(db_connection.DB_PATH):
         print("❌ База данных data.db не найдена!")
         return
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     # Проверяем существует ли таблица
@@ -151,11 +152,11 @@ def view_denormalized_data(limit=20):
 def export_to_csv(filename='denormalized_data.csv'):
     """Экспортировать данные в CSV"""
     
-    if not os.path.exists('data.db'):
+    if not os.path.exists(db_connection.DB_PATH):
         print("❌ База данных data.db не найдена!")
         return
     
-    conn = sqlite3.connect('data.db')
+    conn = db_connection.connect()
     cursor = conn.cursor()
     
     try: